@@ -0,0 +1,476 @@
+"""Micro-benchmarks for the recommendation path.
+
+Runs against a synthetic catalog so it works without data/songs.csv:
+
+    python bench.py filters --rows 30000
+    python bench.py scoring --rows 30000
+    python bench.py fuzzy --rows 30000
+    python bench.py snapshot --rows 100000
+    python bench.py buckets --rows 30000
+    python bench.py selection --rows 30000
+    python bench.py neighbors --rows 1000000
+    python bench.py batch --rows 30000
+    python bench.py ranking --rows 30000
+    python bench.py ingest --rows 1000000
+    python bench.py llm
+
+loadtest.py runs the end-to-end suite (startup, engine, conversations) at
+several catalog sizes and saves JSON results to compare across commits.
+"""
+import argparse
+import gc
+import itertools
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from tests.helpers import (
+    FEATURES, GENRE_POOL, PREFERENCE_MIX, brute_force_neighbors, fuzzy_queries, legacy_filter, legacy_load_songs,
+    legacy_recommendation_map, legacy_select, make_synthetic_catalog, run_session,
+)
+from utils import build_recommendation_key, fuzzy_match_artist_song
+
+
+def load_engine(n_rows: int, seed: int = 0):
+    # recommender_eng loads its catalog at import time, so point it at a synthetic CSV first
+    tmpdir = tempfile.mkdtemp(prefix="moodify-bench-")
+    path = os.path.join(tmpdir, "songs.csv")
+    make_synthetic_catalog(n_rows, seed).to_csv(path, index=False)
+    os.environ["MOODIFY_DATA_PATH"] = path
+    import recommender_eng
+    return recommender_eng
+
+
+def summarize(timings: list) -> dict:
+    # Latency distribution of a list of durations in seconds
+    timings = sorted(timings)
+    pick = lambda q: timings[min(len(timings) - 1, int(q * len(timings)))]
+    total = sum(timings)
+    return {
+        "n": len(timings),
+        "mean_ms": 1000 * total / len(timings),
+        "p50_ms": 1000 * pick(0.50),
+        "p95_ms": 1000 * pick(0.95),
+        "p99_ms": 1000 * pick(0.99),
+        "max_ms": 1000 * timings[-1],
+        "ops_per_s": len(timings) / total if total else float("inf"),
+    }
+
+
+def measure(fn, repeat: int) -> dict:
+    fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(summarize(timings), peak_alloc_kb=peak / 1024)
+
+
+def bench_filters(eng, repeat: int) -> None:
+    print(f"{'preferences':<60} {'legacy ms':>10} {'masks ms':>10} {'legacy KiB':>11} {'masks KiB':>10}")
+    for prefs in PREFERENCE_MIX:
+        expected = legacy_filter(eng, dict(prefs))
+        got, _, _ = eng.candidate_rows(dict(prefs))
+        # Same rows; float32 similarity ties are ordered by catalog position instead
+        assert sorted(eng.df.index[got]) == sorted(expected.index), f"candidate mismatch for {prefs}"
+        if prefs.get("mood") in eng.catalog.moods:
+            sim = eng.catalog.moods.column(prefs["mood"])[got]
+            assert (np.diff(sim) <= 0).all(), f"candidates not in similarity order for {prefs}"
+        legacy = measure(lambda: legacy_filter(eng, dict(prefs)), repeat)
+        masks = measure(lambda: eng.candidate_rows(dict(prefs)), repeat)
+        label = ", ".join(f"{k}={v}" for k, v in prefs.items() if v)
+        print(f"{label:<60} {legacy['p50_ms']:>10.2f} {masks['p50_ms']:>10.2f} "
+              f"{legacy['peak_alloc_kb']:>11.0f} {masks['peak_alloc_kb']:>10.0f}")
+
+
+def check_score_parity(eng) -> int:
+    # Vectorized scores must equal weighted_score bit for bit on every catalog row
+    rows = eng.catalog.all_rows()
+    checked = 0
+    for genre, mood, tempo, artist in itertools.product(
+        [None, "pop", "r&b", "ro"],
+        [None, "happy", "sad", "melancholy", "calm", "party"],
+        [None, "slow", "fast", "chill", "medium"],
+        [None, "ka", "love"],
+    ):
+        prefs = {"genre": genre, "mood": mood, "tempo": tempo, "artist_or_song": artist}
+        expected = eng.df.apply(lambda row: eng.weighted_score(row, prefs), axis=1).to_numpy(dtype=np.float64)
+        got = eng.scorer.score(rows, prefs)
+        assert np.array_equal(expected, got), f"score mismatch for {prefs}"
+        checked += 1
+    return checked
+
+
+def bench_scoring(eng, repeat: int) -> None:
+    print(f"parity: {check_score_parity(eng)} preference sets identical over {eng.catalog.size} rows")
+    rows = eng.catalog.all_rows()
+    print(f"{'preferences':<60} {'apply ms':>10} {'numpy ms':>10}")
+    for prefs in PREFERENCE_MIX:
+        legacy = measure(lambda: eng.df.apply(lambda row: eng.weighted_score(row, prefs), axis=1), max(1, repeat // 5))
+        vectorized = measure(lambda: eng.scorer.score(rows, prefs), repeat)
+        label = ", ".join(f"{k}={v}" for k, v in prefs.items() if v)
+        print(f"{label:<60} {legacy['p50_ms']:>10.2f} {vectorized['p50_ms']:>10.2f}")
+
+
+def bench_fuzzy(eng, repeat: int) -> None:
+    import contextlib
+    import io
+
+    names = eng.df[["track_artist", "track_name"]].reset_index(drop=True)
+    queries = fuzzy_queries(eng, 20)
+    legacy_times, index_times = [], []
+    for query in queries:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            expected = fuzzy_match_artist_song(names.copy(), query).index.to_numpy()
+            legacy_times.append(time.perf_counter() - start)
+        got = eng.catalog.match_rows(query)
+        assert np.array_equal(expected, got), f"fuzzy mismatch for {query!r}"
+        index_times.append(measure(lambda: eng.catalog.match_rows(query), repeat)["p50_ms"])
+    print(f"parity: {len(queries)} queries return identical rows")
+    print(f"difflib scan p50 {1000 * sorted(legacy_times)[len(legacy_times) // 2]:.2f} ms, "
+          f"index p50 {sorted(index_times)[len(index_times) // 2]:.3f} ms, "
+          f"index max {max(index_times):.3f} ms")
+
+
+def retained(build) -> tuple:
+    # (result, seconds, KiB still allocated once the build returns)
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, current / 1024
+
+
+def bench_buckets(eng, repeat: int) -> None:
+    from catalog import BucketIndex
+
+    legacy, legacy_s, legacy_kb = retained(lambda: legacy_recommendation_map(eng.df))
+    index, index_s, index_kb = retained(lambda: BucketIndex(eng.df))
+    assert sorted(legacy) == sorted(index.keys()), "bucket keys differ"
+    for key, songs in legacy.items():
+        genre, rest = key.split("_", 1)
+        (mood, energy), tempo = rest.rsplit("_", 1)[0].split(" "), rest.rsplit("_", 1)[1]
+        got = eng.df.index[index.rows(genre, mood, energy, tempo)]
+        assert list(got) == [song.name for song in songs], f"bucket mismatch for {key}"
+    print(f"parity: {len(legacy)} buckets hold identical rows")
+
+    lookups = [(p.get("genre") or "rock", p.get("mood") or "calm", "energetic", p.get("tempo") or "medium")
+               for p in PREFERENCE_MIX]
+    legacy_get = measure(lambda: [legacy.get(build_recommendation_key(*k), []) for k in lookups], repeat)
+    index_get = measure(lambda: [index.rows(*k) for k in lookups], repeat)
+    print(f"{'':<10} {'build s':>9} {'retained MiB':>13} {'lookup us':>10}")
+    print(f"{'legacy':<10} {legacy_s:>9.2f} {legacy_kb / 1024:>13.1f} {1000 * legacy_get['p50_ms'] / len(lookups):>10.2f}")
+    print(f"{'buckets':<10} {index_s:>9.2f} {index_kb / 1024:>13.1f} {1000 * index_get['p50_ms'] / len(lookups):>10.2f}")
+
+
+def bench_selection(eng, repeat: int) -> None:
+    prefs = {"genre": None, "mood": "happy", "tempo": None, "artist_or_song": None}
+    rows, _, _ = eng.candidate_rows(dict(prefs))
+    order = np.lexsort((np.arange(len(rows)), -eng.scorer.score(rows, prefs)))
+    print(f"{len(rows)} candidates")
+    print(f"{'history':>8} {'legacy ms':>10} {'top_k ms':>10}")
+    for played in (0, 10, 50, 200):
+        # Worst case for the old loop: the best `played` songs were all recommended already
+        history = [tuple(eng.df.iloc[rows[i]][["track_name", "track_artist"]]) for i in order[:played]]
+        legacy = measure(lambda: legacy_select(eng, rows, prefs, history), max(1, repeat // 5))
+        new = measure(lambda: eng.recommend_engine(dict(prefs, history=list(history))), repeat)
+        print(f"{played:>8} {legacy['p50_ms']:>10.2f} {new['p50_ms']:>10.2f}")
+
+
+def bench_neighbors(eng, repeat: int) -> None:
+    rng = np.random.default_rng(1)
+    seeds = rng.choice(eng.catalog.size, size=min(50, eng.catalog.size), replace=False)
+    for seed in seeds:
+        # Synthetic track ids are unique, so only the seed itself is excluded
+        got, got_dist = eng.catalog.neighbors.nearest(eng.catalog.feature_matrix[seed], 10, np.array([seed]))
+        _, want_dist = brute_force_neighbors(eng, seed, 10, np.array([seed]))
+        assert np.allclose(got_dist, want_dist), f"neighbor distances differ for seed {seed}"
+    print(f"parity: kd-tree distances match a full scan for {len(seeds)} seeds")
+
+    track_id = eng.catalog.df["track_id"].iloc[int(seeds[0])]
+    history = [tuple(eng.df.iloc[int(i)][["track_name", "track_artist"]]) for i in seeds[1:]]
+    print(f"{'k':>6} {'full scan ms':>13} {'kd-tree ms':>11} {'similar_songs ms':>17}")
+    for k in (1, 10, 100):
+        scan = measure(lambda: brute_force_neighbors(eng, int(seeds[0]), k, seeds[:1]), repeat)
+        tree = measure(lambda: eng.catalog.neighbors.nearest(eng.catalog.feature_matrix[seeds[0]], k, seeds[:1]), repeat)
+        full = measure(lambda: eng.similar_songs(track_id=track_id, k=k, history=history), repeat)
+        print(f"{k:>6} {scan['p50_ms']:>13.2f} {tree['p50_ms']:>11.2f} {full['p50_ms']:>17.2f}")
+
+
+def bench_batch(eng, repeat: int) -> None:
+    base = [dict(prefs) for prefs in PREFERENCE_MIX if prefs.get("artist_or_song") is None]
+    # The playlist's first song is what a single recommend_engine call would pick
+    for prefs in base:
+        single = eng.recommend_engine(dict(prefs, history=[]))
+        playlist = eng.recommend_playlist(dict(prefs, history=[]), 20)
+        assert playlist and single == playlist[0], f"playlist head differs for {prefs}"
+    print(f"parity: playlist head matches recommend_engine for {len(base)} preference sets")
+
+    print(f"{'sets x songs':>14} {'one by one ms':>14} {'batch ms':>10}")
+    for sets, count in ((1, 20), (1, 50), (100, 20)):
+        batch = [dict(base[i % len(base)]) for i in range(sets)]
+
+        def one_by_one():
+            for prefs in batch:
+                session = dict(prefs, history=[])
+                for _ in range(count):
+                    eng.recommend_engine(session)
+
+        single = measure(one_by_one, max(1, repeat // 10))
+        batched = measure(lambda: eng.recommend_batch([dict(p, history=[]) for p in batch], count), repeat)
+        print(f"{f'{sets} x {count}':>14} {single['p50_ms']:>14.1f} {batched['p50_ms']:>10.1f}")
+
+
+def bench_ranking(eng, repeat: int) -> None:
+    cache = eng.ranking_cache
+    # Past HEAD_SIZE turns the cached head is exhausted and the rest of the ranking is searched
+    turns = 300
+    size = cache.max_size
+    for prefs in PREFERENCE_MIX:
+        cache.max_size = 0
+        cache.invalidate()
+        uncached = run_session(eng, prefs, turns)
+        cache.max_size = size
+        cache.invalidate()
+        assert run_session(eng, prefs, turns) == uncached, f"cached session differs for {prefs}"
+    print(f"parity: {turns}-turn sessions identical with and without the ranking cache")
+
+    def cold(prefs):
+        cache.invalidate()
+        eng.recommend_engine(dict(prefs, history=[]))
+
+    print(f"{'preferences':<60} {'cold ms':>8} {'warm ms':>8} {'warm, 50 played':>16}")
+    for prefs in PREFERENCE_MIX:
+        played = run_session(eng, prefs, 50)
+        history = [(song["song"], song["artist"]) for song in played if song]
+        miss = measure(lambda: cold(prefs), repeat)
+        hit = measure(lambda: eng.recommend_engine(dict(prefs, history=[])), repeat)
+        retry = measure(lambda: eng.recommend_engine(dict(prefs, history=list(history))), repeat)
+        label = ", ".join(f"{k}={v}" for k, v in prefs.items() if v)
+        print(f"{label:<60} {miss['p50_ms']:>8.2f} {hit['p50_ms']:>8.2f} {retry['p50_ms']:>16.2f}")
+    print(cache.stats())
+
+
+def proc_status_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def ingest_worker(loader: str, path: str, conn) -> None:
+    # Runs in a fresh interpreter; VmHWM is reset first, so the peak covers this one load only
+    from catalog import read_catalog_csv
+
+    gc.collect()
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    before = proc_status_mb("VmRSS")
+    start = time.perf_counter()
+    df = legacy_load_songs(path, FEATURES) if loader == "legacy" else read_catalog_csv(path, FEATURES)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    conn.send({"seconds": elapsed, "peak_mb": proc_status_mb("VmHWM") - before,
+               "steady_mb": proc_status_mb("VmRSS") - before,
+               "frame_mb": df.memory_usage(deep=True).sum() / 2 ** 20, "rows": len(df)})
+
+
+def bench_ingest(rows: int) -> None:
+    tmpdir = tempfile.mkdtemp(prefix="moodify-bench-")
+    path = os.path.join(tmpdir, "songs.csv")
+    df = make_synthetic_catalog(rows)
+    # Columns of the Spotify export the engine never reads
+    df["track_album_name"] = df["track_name"] + " (album)"
+    df["playlist_name"] = df["playlist_genre"] + " mix"
+    df["playlist_id"] = [f"pl{i % 5000:06d}" for i in range(rows)]
+    df.to_csv(path, index=False)
+    del df
+    print(f"{rows} rows, {os.path.getsize(path) / 2 ** 20:.0f} MiB CSV")
+    print(f"{'loader':<8} {'seconds':>8} {'peak MiB':>9} {'steady MiB':>11} {'frame MiB':>10}")
+    context = multiprocessing.get_context("spawn")
+    for loader in ("legacy", "chunked"):
+        parent, child = context.Pipe()
+        process = context.Process(target=ingest_worker, args=(loader, path, child))
+        process.start()
+        result = parent.recv()
+        process.join()
+        print(f"{loader:<8} {result['seconds']:>8.2f} {result['peak_mb']:>9.0f} {result['steady_mb']:>11.0f} "
+              f"{result['frame_mb']:>10.0f}")
+
+
+# (label, LLMClient settings) for the llm suite; limits that bite at 64 concurrent calls of 200 ms
+LLM_SETTINGS = [
+    ("semaphore", {"coalesce": False}),
+    ("coalesce", {}),
+    ("queue", {"coalesce": False, "max_concurrency": 4, "max_queue": 16, "max_wait": 0.5}),
+    ("rate", {"coalesce": False, "rate": 20.0, "burst": 5.0, "max_wait": 1.0}),
+]
+
+
+def bench_llm(repeat: int, clients: int = 64, messages: int = 4, latency: float = 0.2) -> None:
+    import asyncio
+    from llm_client import LLMClient, LLMRejected
+    from llm_stub import StubServer
+    from utils import _extraction_body
+
+    stub = StubServer(latency=latency).start()
+    bodies = [_extraction_body(f"some {genre} music") for genre in GENRE_POOL[:messages]]
+
+    async def burst(client):
+        async def call(body):
+            start = time.perf_counter()
+            try:
+                data = await client.apost(body, "bench", kind="extract")
+            except LLMRejected:
+                return None, time.perf_counter() - start
+            return data["choices"][0]["message"]["content"], time.perf_counter() - start
+        results = await asyncio.gather(*(call(bodies[i % messages]) for i in range(clients)))
+        await client.aclose()
+        return results
+
+    expected = [reply for reply, _ in asyncio.run(burst(LLMClient(url=stub.url, coalesce=False)))]
+    print(f"{clients} concurrent extraction calls over {messages} messages, stub latency {latency * 1000:.0f} ms")
+    print(f"{'settings':<10} {'upstream':>9} {'coalesced':>10} {'rejected':>9} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'rejected p95 ms':>16}")
+    for name, settings in LLM_SETTINGS:
+        ok, rejected, sent, coalesced = [], [], 0, 0
+        for _ in range(max(1, repeat // 10)):
+            client = LLMClient(url=stub.url, **settings)
+            before = stub.requests
+            results = asyncio.run(burst(client))
+            for i, (reply, seconds) in enumerate(results):
+                if reply is None:
+                    rejected.append(seconds)
+                else:
+                    assert reply == expected[i], f"{name}: reply {i} differs"
+                    ok.append(seconds)
+            sent += stub.requests - before
+            coalesced += client.flights.followers
+        ok_stats = summarize(ok) if ok else {"p50_ms": float("nan"), "p95_ms": float("nan")}
+        rejected_p95 = summarize(rejected)["p95_ms"] if rejected else 0.0
+        print(f"{name:<10} {sent:>9} {coalesced:>10} {len(rejected):>9} {ok_stats['p50_ms']:>8.1f} "
+              f"{ok_stats['p95_ms']:>8.1f} {rejected_p95:>16.1f}")
+    print("parity: every admitted reply matches the uncoalesced reply")
+    stub.stop()
+    bench_degraded_llm(max(10, repeat))
+
+
+# (label, stub settings) for bench_degraded_llm
+STUB_CONDITIONS = [
+    ("healthy", {"latency": 0.2}),
+    ("slow", {"latency": 3.0}),
+    ("failing", {"latency": 0.2, "fail_rate": 1.0}),
+]
+
+
+def bench_degraded_llm(turns: int, budget: float = 1.0) -> None:
+    # Sequential turns under a latency budget, with and without the circuit breaker
+    import asyncio
+    from llm_admission import CircuitBreaker
+    from llm_client import LLMClient
+    from llm_stub import StubServer
+    from pipeline import StageTimer
+    from utils import _chat_body
+
+    body = _chat_body({"song": "wild night", "artist": "kata neelvi"}, {"mood": "happy"})
+
+    async def run(client):
+        timings, fallbacks = [], 0
+        for _ in range(turns):
+            StageTimer("bench", budget)
+            start = time.perf_counter()
+            try:
+                await client.apost(body, "bench", kind="chat")
+            except Exception:
+                # What the utils helpers answer with their template
+                fallbacks += 1
+            timings.append(time.perf_counter() - start)
+        await client.aclose()
+        return timings, fallbacks
+
+    print(f"\n{turns} sequential chat calls per row, {budget:.1f} s budget per turn")
+    print(f"{'stub':<8} {'breaker':<8} {'upstream':>9} {'fallbacks':>10} {'p50 ms':>8} {'p95 ms':>8} {'total s':>8}")
+    for name, conditions in STUB_CONDITIONS:
+        for breaker in (False, True):
+            stub = StubServer(**conditions).start()
+            client = LLMClient(url=stub.url, max_retries=1,
+                               breaker=CircuitBreaker(min_calls=5, slow_p95=budget) if breaker else None)
+            timings, fallbacks = asyncio.run(run(client))
+            stats = summarize(timings)
+            print(f"{name:<8} {'on' if breaker else 'off':<8} {stub.requests:>9} {fallbacks:>10} "
+                  f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {sum(timings):>8.1f}")
+            stub.stop()
+
+
+def bench_snapshot(eng, repeat: int) -> None:
+    from snapshot import read_snapshot
+
+    def from_csv():
+        df = eng.load_songs(eng.DATA_PATH)
+        return eng.Catalog(df, eng.features, eng.MOOD_VECTORS), eng.VectorizedScorer(df)
+
+    manifest = eng.compile_snapshot()
+    df, objects = read_snapshot(eng.SNAPSHOT_PATH, eng.DATA_PATH, eng.SNAPSHOT_KEY)
+    pd.testing.assert_frame_equal(df, eng.df)
+    for prefs in PREFERENCE_MIX:
+        assert np.array_equal(objects["scorer"].score(eng.catalog.all_rows(), prefs),
+                              eng.scorer.score(eng.catalog.all_rows(), prefs)), f"score mismatch for {prefs}"
+    print(f"parity: snapshot frame and scores identical over {manifest['rows']} rows")
+
+    runs = max(1, repeat // 5)
+    csv = measure(from_csv, runs)
+    snap = measure(lambda: read_snapshot(eng.SNAPSHOT_PATH, eng.DATA_PATH, eng.SNAPSHOT_KEY), runs)
+    print(f"catalog from CSV p50 {csv['p50_ms']:.1f} ms, from snapshot p50 {snap['p50_ms']:.1f} ms "
+          f"(peak alloc {csv['peak_alloc_kb'] / 1024:.1f} MiB vs {snap['peak_alloc_kb'] / 1024:.1f} MiB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("suite", choices=["filters", "scoring", "fuzzy", "snapshot", "buckets", "selection", "neighbors", "batch",
+                                          "ranking", "ingest", "llm"])
+    parser.add_argument("--rows", type=int, default=30000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.suite == "ingest":
+        return bench_ingest(args.rows)
+    if args.suite == "llm":
+        return bench_llm(args.repeat)
+    eng = load_engine(args.rows)
+    if args.suite == "filters":
+        bench_filters(eng, args.repeat)
+    elif args.suite == "scoring":
+        bench_scoring(eng, args.repeat)
+    elif args.suite == "fuzzy":
+        bench_fuzzy(eng, args.repeat)
+    elif args.suite == "snapshot":
+        bench_snapshot(eng, args.repeat)
+    elif args.suite == "buckets":
+        bench_buckets(eng, args.repeat)
+    elif args.suite == "selection":
+        bench_selection(eng, args.repeat)
+    elif args.suite == "neighbors":
+        bench_neighbors(eng, args.repeat)
+    elif args.suite == "batch":
+        bench_batch(eng, args.repeat)
+    elif args.suite == "ranking":
+        bench_ranking(eng, args.repeat)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from sklearn.neighbors import KDTree
+from sklearn.preprocessing import MinMaxScaler
+
+from search_index import ArtistMentionDetector, NameIndex
+from utils import build_recommendation_key, split_mode_category
+
+
+def lower_codes(series: pd.Series) -> tuple:
+    # Integer codes over the lowercased values; missing/non-string values get -1
+    codes, table = pd.factorize(series.str.lower())
+    return codes.astype(np.int32), list(table)
+
+
+def _column_or(df: pd.DataFrame, col: str, default) -> pd.Series:
+    if col in df.columns:
+        return df[col]
+    return pd.Series([default] * len(df), index=df.index, dtype=object)
+
+
+# Columns the engine reads besides the features; everything else in the CSV is skipped at parse time
+CATALOG_COLUMNS = ["track_id", "track_name", "track_artist", "track_popularity", "popularity", "playlist_genre",
+                   "mode_category", "mood", "tempo_category"]
+# Repetitive text columns, stored as categoricals: int codes into one table of distinct strings
+CATEGORICAL_COLUMNS = ["track_name", "track_artist", "playlist_genre", "mode_category", "mood", "tempo_category"]
+
+
+def _lean_chunk(chunk: pd.DataFrame, features: list) -> pd.DataFrame:
+    chunk["tempo_raw"] = pd.to_numeric(chunk["tempo"], errors="coerce")
+    chunk[features] = chunk[features].apply(pd.to_numeric, errors="coerce")
+    chunk = chunk.dropna(subset=features)
+    # tempo_raw stays float64: float32 would move BPMs like 89.0000001 across the tempo bounds
+    for col in features:
+        chunk[col] = chunk[col].astype(np.float32)
+    for col in ("track_popularity", "popularity"):
+        if col in chunk.columns:
+            chunk[col] = pd.to_numeric(chunk[col], errors="coerce", downcast="integer")
+    for col in CATEGORICAL_COLUMNS:
+        if col in chunk.columns:
+            # Categories in order of appearance; sorting them is most of astype("category")
+            codes, uniques = pd.factorize(chunk[col])
+            chunk[col] = pd.Categorical.from_codes(codes, categories=uniques)
+    return chunk
+
+
+def read_catalog_csv(path: str, features: list, chunksize: int = 200000) -> pd.DataFrame:
+    """The song CSV as a lean frame (used columns, categorical text, float32 features),
+    read chunksize rows at a time so peak memory stays near the final frame."""
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [col for col in header if col in features or col in CATALOG_COLUMNS]
+    dtypes = {col: "str" for col in usecols if col in CATEGORICAL_COLUMNS or col == "track_id"}
+    reader = pd.read_csv(path, usecols=usecols, dtype=dtypes, chunksize=chunksize)
+    chunks = [_lean_chunk(chunk, features) for chunk in reader]
+    if not chunks:
+        chunks = [_lean_chunk(pd.read_csv(path, usecols=usecols, dtype=dtypes), features)]
+
+    categorical = [col for col in CATEGORICAL_COLUMNS if col in usecols]
+    categories = {col: union_categoricals([chunk[col] for chunk in chunks]) for col in categorical}
+    df = pd.concat([chunk.drop(columns=categorical) for chunk in chunks])
+    del chunks
+    for col, values in categories.items():
+        df[col] = values
+    df = df[usecols + ["tempo_raw"]]
+
+    for col in features:
+        values = df[col].to_numpy(dtype=np.float64).reshape(-1, 1)
+        df[col] = MinMaxScaler().fit_transform(values).ravel().astype(np.float32)
+    return df
+
+
+class BucketIndex:
+    """Fallback candidates per (genre, mood, energy, tempo) recommendation key, as int32
+    catalog positions grouped in one array with an offset pair per bucket."""
+
+    def __init__(self, df: pd.DataFrame):
+        genre_codes, genre_table = pd.factorize(_column_or(df, "playlist_genre", "unknown"), use_na_sentinel=False)
+        mode_codes, mode_table = pd.factorize(_column_or(df, "mode_category", "calm calm"), use_na_sentinel=False)
+        tempo_codes, tempo_table = pd.factorize(_column_or(df, "tempo_category", "medium"), use_na_sentinel=False)
+
+        # Key parts are derived per distinct value; values the old string key
+        # could not be built from (missing mode/tempo, single-word modes) get -1
+        mood_of_mode, energy_of_mode = [], []
+        for mode in mode_table:
+            mood, energy = split_mode_category(mode)
+            ok = mood is not None and energy is not None
+            mood_of_mode.append(mood.capitalize() if ok else None)
+            energy_of_mode.append(energy.capitalize() if ok else None)
+        mood_codes, mood_table = pd.factorize(pd.Series(mood_of_mode, dtype=object))
+        energy_codes, energy_table = pd.factorize(pd.Series(energy_of_mode, dtype=object))
+        tempo_parts = [t.capitalize() if isinstance(t, str) else None for t in tempo_table]
+        tempo_part_codes, tempo_part_table = pd.factorize(pd.Series(tempo_parts, dtype=object))
+
+        parts = np.stack([
+            genre_codes,
+            mood_codes[mode_codes] if len(mode_table) else np.full(len(df), -1),
+            energy_codes[mode_codes] if len(mode_table) else np.full(len(df), -1),
+            tempo_part_codes[tempo_codes] if len(tempo_table) else np.full(len(df), -1),
+        ], axis=1).astype(np.int64)
+        valid = (parts >= 0).all(axis=1)
+        keys, inverse = np.unique(parts[valid], axis=0, return_inverse=True)
+
+        # Distinct code tuples whose key strings coincide share a bucket, as they shared a dict entry
+        self._buckets = {}
+        bucket_of_key = np.empty(len(keys), dtype=np.int64)
+        for i, (g, m, e, t) in enumerate(keys):
+            key = f"{genre_table[g]}_{mood_table[m]} {energy_table[e]}_{tempo_part_table[t]}"
+            bucket_of_key[i] = self._buckets.setdefault(key, len(self._buckets))
+
+        bucket_of_row = bucket_of_key[inverse.reshape(-1)]
+        rows = np.nonzero(valid)[0]
+        order = np.argsort(bucket_of_row, kind="stable")
+        self.positions = rows[order].astype(np.int32)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(bucket_of_row, minlength=len(self._buckets)))])
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def keys(self) -> list:
+        return list(self._buckets)
+
+    def rows(self, genre, mood, energy, tempo) -> np.ndarray:
+        bucket = self._buckets.get(build_recommendation_key(genre, mood, energy, tempo))
+        if bucket is None:
+            return self.positions[:0]
+        return self.positions[self.offsets[bucket]:self.offsets[bucket + 1]]
+
+
+class MoodIndex:
+    """Cosine similarity of every song to each mood vector, computed at load.
+    order lists positions by descending similarity (ties in catalog order); rank is its inverse."""
+
+    def __init__(self, feature_matrix: np.ndarray, mood_vectors: dict):
+        self.moods = list(mood_vectors)
+        self._lookup = {m: i for i, m in enumerate(self.moods)}
+        vectors = np.array([mood_vectors[m] for m in self.moods], dtype=np.float64).reshape(len(self.moods), -1)
+
+        # Zero vectors score 0 against everything, as in sklearn's cosine_similarity
+        row_norms = np.linalg.norm(feature_matrix, axis=1)
+        row_norms[row_norms == 0] = 1.0
+        mood_norms = np.linalg.norm(vectors, axis=1)
+        mood_norms[mood_norms == 0] = 1.0
+        similarity = (vectors @ feature_matrix.T) / mood_norms[:, None] / row_norms[None, :]
+        self.similarity = similarity.astype(np.float32)
+
+        n = feature_matrix.shape[0]
+        positions = np.arange(n, dtype=np.int32)
+        self.order = np.empty((len(self.moods), n), dtype=np.int32)
+        self.rank = np.empty((len(self.moods), n), dtype=np.int32)
+        for i in range(len(self.moods)):
+            self.order[i] = np.lexsort((positions, -self.similarity[i]))
+            self.rank[i, self.order[i]] = positions
+
+    def __contains__(self, mood) -> bool:
+        return mood in self._lookup
+
+    def column(self, mood: str) -> np.ndarray:
+        return self.similarity[self._lookup[mood]]
+
+    def ordered(self, mood: str, mask: np.ndarray = None) -> np.ndarray:
+        # Catalog positions by similarity, optionally only those where mask (over all rows) holds
+        order = self.order[self._lookup[mood]]
+        return order if mask is None else order[mask[order]]
+
+    def sort(self, mood: str, rows: np.ndarray) -> np.ndarray:
+        return rows[np.argsort(self.rank[self._lookup[mood]][rows], kind="stable")]
+
+
+class NeighborIndex:
+    """KD-tree over the normalized feature matrix for "more like this" lookups;
+    rows are grouped by track_id so results are distinct tracks."""
+
+    def __init__(self, feature_matrix: np.ndarray, track_ids: pd.Series, leaf_size: int = 40):
+        self.tree = KDTree(feature_matrix, leaf_size=leaf_size)
+        self.size = feature_matrix.shape[0]
+        codes, table = pd.factorize(track_ids, sort=True)
+        self.id_codes = codes.astype(np.int32)
+        self.id_table = np.asarray(table, dtype=str)
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes[codes >= 0], minlength=len(table))
+        self.id_positions = order[np.count_nonzero(codes < 0):].astype(np.int32)
+        self.id_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def rows_of_id(self, track_id: str) -> np.ndarray:
+        code = np.searchsorted(self.id_table, track_id)
+        if code >= len(self.id_table) or self.id_table[code] != track_id:
+            return self.id_positions[:0]
+        return self.id_positions[self.id_offsets[code]:self.id_offsets[code + 1]]
+
+    def nearest(self, point: np.ndarray, k: int, exclude: np.ndarray = None) -> tuple:
+        """(positions, distances) of the k closest tracks, nearest first, skipping exclude and repeated track_ids."""
+        point = np.asarray(point, dtype=np.float64).reshape(1, -1)
+        excluded = np.zeros(0, dtype=np.int64) if exclude is None else np.asarray(exclude)
+        ask = min(self.size, k + len(excluded) + 1)
+        while True:
+            distances, positions = self.tree.query(point, k=ask)
+            distances, positions = distances[0], positions[0]
+            keep = ~np.isin(positions, excluded)
+            # First occurrence of each track_id; rows without an id count as distinct tracks
+            codes = self.id_codes[positions]
+            first = np.zeros(len(positions), dtype=bool)
+            _, firsts = np.unique(np.where(codes >= 0, codes, -1 - np.arange(len(codes))), return_index=True)
+            first[firsts] = True
+            keep &= first
+            if keep.sum() >= k or ask == self.size:
+                chosen = np.nonzero(keep)[0][:k]
+                return positions[chosen], distances[chosen]
+            ask = min(self.size, ask * 2)
+
+
+class Catalog:
+    """Columnar view of the song table; filters are boolean masks over catalog positions."""
+
+    def __init__(self, df: pd.DataFrame, features: list, mood_vectors: dict):
+        self.df = df
+        self.size = len(df)
+        self.features = list(features)
+        self.feature_matrix = np.ascontiguousarray(df[self.features].to_numpy(dtype=np.float64))
+        self.tempo_raw = df["tempo_raw"].to_numpy(dtype=np.float64)
+        self.genre_codes, self.genre_table = lower_codes(df["playlist_genre"])
+        self.artist_codes, self.artist_table = lower_codes(df["track_artist"])
+        self._genre_lookup = {g: i for i, g in enumerate(self.genre_table)}
+        self._artist_lookup = {a: i for i, a in enumerate(self.artist_table)}
+        self.name_index = NameIndex(df)
+        self.artist_detector = ArtistMentionDetector(df["track_artist"].dropna().unique())
+        self.buckets = BucketIndex(df)
+        self.moods = MoodIndex(self.feature_matrix, mood_vectors)
+        self.neighbors = NeighborIndex(self.feature_matrix, _column_or(df, "track_id", None))
+
+    def all_rows(self) -> np.ndarray:
+        return np.arange(self.size)
+
+    def genre_mask(self, genre: str) -> np.ndarray:
+        code = self._genre_lookup.get(genre.lower())
+        if code is None:
+            return np.zeros(self.size, dtype=bool)
+        return self.genre_codes == code
+
+    def tempo_mask(self, bpm_range: tuple) -> np.ndarray:
+        return (self.tempo_raw >= bpm_range[0]) & (self.tempo_raw <= bpm_range[1])
+
+    def exclude_artist_mask(self, artist: str) -> np.ndarray:
+        code = self._artist_lookup.get(artist.lower())
+        if code is None:
+            return np.ones(self.size, dtype=bool)
+        return self.artist_codes != code
+
+    def match_rows(self, query: str) -> np.ndarray:
+        # Same rows fuzzy_match_artist_song would return, as positions
+        if not isinstance(query, str):
+            return np.arange(min(5, self.size))
+        return self.name_index.match_rows(query)
+
+    def seed_rows(self, track_id: str = None, name: str = None) -> np.ndarray:
+        # Rows of the seed track for "more like this": exact id, else the closest song title, then artist
+        if track_id:
+            return self.neighbors.rows_of_id(track_id)
+        if not isinstance(name, str) or not name.strip():
+            return np.zeros(0, dtype=np.int64)
+        query = name.lower()
+        for index in (self.name_index.tracks, self.name_index.artists):
+            matches = index.close_matches(query, n=1, cutoff=0.6)
+            if matches:
+                return index.rows_for(matches)
+        return np.zeros(0, dtype=np.int64)
+
+    def rows(self, positions: np.ndarray) -> pd.DataFrame:
+        return self.df.iloc[positions]
+
+    def _pair_rows(self, name: str, artist: str) -> np.ndarray:
+        # Rows of the rarer of the two lowercased values, filtered by the other's per-row code
+        tracks, artists = self.name_index.tracks, self.name_index.artists
+        by_name, by_artist = tracks.rows_of(name), artists.rows_of(artist)
+        if len(by_name) <= len(by_artist):
+            return by_name[artists.codes[by_name] == artists.code_of(artist)]
+        return by_artist[tracks.codes[by_artist] == tracks.code_of(name)]
+
+    def played_rows(self, history, lowercased: bool = False) -> np.ndarray:
+        """Positions of rows whose (track_name, track_artist) pair is in history.
+        With lowercased=True rows compare the way name-matched candidates are shown."""
+        candidates, want_names, want_artists = [], [], []
+        for name, artist in history:
+            if not isinstance(name, str) or not isinstance(artist, str):
+                continue
+            if lowercased and (name != name.lower() or artist != artist.lower()):
+                continue
+            rows = self._pair_rows(name.lower(), artist.lower())
+            if len(rows):
+                candidates.append(rows)
+                want_names.extend([name] * len(rows))
+                want_artists.extend([artist] * len(rows))
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+
+        candidates = np.concatenate(candidates)
+        if lowercased:
+            # The indexes already compared the lowercased values
+            return np.unique(candidates)
+        names = self.df["track_name"].iloc[candidates]
+        artists = self.df["track_artist"].iloc[candidates]
+        same = names.to_numpy(dtype=object) == np.array(want_names, dtype=object)
+        same &= artists.to_numpy(dtype=object) == np.array(want_artists, dtype=object)
+        return np.unique(candidates[same])
@@ -0,0 +1,336 @@
+"""Admission control, request coalescing and a circuit breaker for outbound LLM calls, per process."""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from hashlib import sha256
+
+
+class Saturated(Exception):
+    def __init__(self, reason: str):
+        super().__init__(f"LLM admission rejected: {reason}")
+        self.reason = reason
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+
+    def take(self) -> float:
+        """0 after taking a token, else seconds until one is available. Not thread-safe."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _Waiter:
+    # One queued admit()/aadmit() call; wake() may be called from any thread
+    __slots__ = ("loop", "event")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self.loop = loop
+        self.event = threading.Event() if loop is None else asyncio.Event()
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class AdmissionController:
+    """At most max_concurrency calls in flight, started no faster than the token bucket allows.
+    The rest wait first come, first served in a queue of max_queue for up to max_wait seconds."""
+
+    def __init__(self, max_concurrency: int = 16, rate: float = 0.0, burst: float = 10.0,
+                 max_queue: int = 64, max_wait: float = 5.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "timeout": 0}
+        self._lock = threading.Lock()
+        self._waiters = deque()  # _Waiter, oldest first
+
+    def _try_admit(self, waiter: _Waiter = None):
+        """0 once admitted, else seconds until a token or None to wait for a wake-up.
+        Only the queue head, or a new call while nobody is queued, can be admitted."""
+        with self._lock:
+            head = self._waiters[0] if self._waiters else None
+            if head is not waiter:
+                return None
+            if self.in_flight >= self.max_concurrency:
+                return None
+            wait = self.bucket.take()
+            if wait:
+                return wait
+            self.in_flight += 1
+            self.admitted += 1
+            if waiter is not None:
+                self._waiters.popleft()
+                self.queued -= 1
+                # The next in line may fit too
+                self._wake_head()
+            return 0.0
+
+    def _wake_head(self):
+        if self._waiters:
+            self._waiters[0].wake()
+
+    def _enqueue(self, waiter: _Waiter):
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected["queue_full"] += 1
+                raise Saturated("queue_full")
+            self._waiters.append(waiter)
+            self.queued += 1
+
+    def _dequeue(self, waiter: _Waiter):
+        # Gave up (timeout or cancellation) while still queued
+        with self._lock:
+            if waiter not in self._waiters:
+                return
+            head = self._waiters[0] is waiter
+            self._waiters.remove(waiter)
+            self.queued -= 1
+            self.rejected["timeout"] += 1
+            if head:
+                self._wake_head()
+
+    def admit(self, max_wait: float = None) -> float:
+        """Block until the call may start; returns the seconds waited. Raises Saturated.
+        max_wait lowers the limit for this call (a request's remaining budget)."""
+        max_wait = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+        if self._try_admit() == 0:
+            return 0.0
+        started = time.monotonic()
+        waiter = _Waiter()
+        self._enqueue(waiter)
+        try:
+            while True:
+                waiter.event.clear()
+                wait = self._try_admit(waiter)
+                if wait == 0:
+                    return time.monotonic() - started
+                remaining = max_wait - (time.monotonic() - started)
+                if remaining <= 0 or (wait is not None and wait > remaining):
+                    raise Saturated("timeout")
+                waiter.event.wait(remaining if wait is None else wait)
+        finally:
+            self._dequeue(waiter)
+
+    async def aadmit(self, max_wait: float = None) -> float:
+        max_wait = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+        if self._try_admit() == 0:
+            return 0.0
+        started = time.monotonic()
+        waiter = _Waiter(asyncio.get_running_loop())
+        self._enqueue(waiter)
+        try:
+            while True:
+                waiter.event.clear()
+                wait = self._try_admit(waiter)
+                if wait == 0:
+                    return time.monotonic() - started
+                remaining = max_wait - (time.monotonic() - started)
+                if remaining <= 0 or (wait is not None and wait > remaining):
+                    raise Saturated("timeout")
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), remaining if wait is None else wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._dequeue(waiter)
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._wake_head()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_wait": self.max_wait,
+            "rate": self.bucket.rate,
+            "burst": self.bucket.burst,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> concurrent.futures.Future of the leader's call
+        self._tasks = {}  # (event loop, key) -> asyncio.Task
+        self.leaders = 0
+        self.followers = 0
+
+    @staticmethod
+    def key(*parts) -> str:
+        return sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def submit(self, key: str, fn, executor, on_join=None) -> Future:
+        """Future of fn() run on executor, or of an identical call already running; on_join() runs when joining one.
+
+        The call outlives whichever caller started it, so each caller bounds only its own wait.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = executor.submit(fn)
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if leader:
+            future.add_done_callback(lambda done: self._forget(key, done))
+        elif on_join is not None:
+            on_join()
+        return future
+
+    def _forget(self, key: str, future: Future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    async def ado(self, key: str, make_coro, on_join=None):
+        # The call runs as its own task, so a cancelled leader does not fail its followers
+        task_key = (asyncio.get_running_loop(), key)
+        task = self._tasks.get(task_key)
+        if task is None:
+            self.leaders += 1
+            task = self._tasks[task_key] = asyncio.ensure_future(make_coro())
+            task.add_done_callback(lambda done: self._finished(task_key, done))
+        else:
+            self.followers += 1
+            if on_join is not None:
+                on_join()
+        return await asyncio.shield(task)
+
+    def _finished(self, task_key: tuple, task: asyncio.Task):
+        self._tasks.pop(task_key, None)
+        # Every waiter may have given up already; the failure was theirs to handle, not the loop's to log
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        calls = self.leaders + self.followers
+        return {
+            "in_flight": len(self._calls) + len(self._tasks),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "coalescing_ratio": self.followers / calls if calls else 0.0,
+        }
+
+
+class CircuitBreaker:
+    """Refuses calls for cooldown seconds once the last `window` calls reach error_rate
+    or a p95 of slow_p95 seconds; then a single probe decides whether it closes."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, window: int = 50, min_calls: int = 10, error_rate: float = 0.5,
+                 slow_p95: float = 5.0, cooldown: float = 30.0):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_p95 = slow_p95
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened = 0
+        self.refused = 0
+        self._calls = []  # (ok, seconds), oldest first
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        return cls(
+            window=int(os.getenv("MOODIFY_LLM_BREAKER_WINDOW", "50")),
+            min_calls=int(os.getenv("MOODIFY_LLM_BREAKER_MIN_CALLS", "10")),
+            error_rate=float(os.getenv("MOODIFY_LLM_BREAKER_ERROR_RATE", "0.5")),
+            slow_p95=float(os.getenv("MOODIFY_LLM_BREAKER_SLOW_P95", "5")),
+            cooldown=float(os.getenv("MOODIFY_LLM_BREAKER_COOLDOWN", "30")),
+        )
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.refused += 1
+            return False
+
+    def record(self, ok: bool, seconds: float):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if ok and seconds < self.slow_p95:
+                    self.state = self.CLOSED
+                    self._calls = []
+                    logging.warning("LLM circuit breaker closed after a successful probe")
+                else:
+                    self._open(f"probe {'failed' if not ok else f'took {seconds:.1f}s'}")
+                return
+            if self.state == self.OPEN:
+                # Finished after the breaker opened; the window restarts when it closes
+                return
+            self._calls.append((ok, seconds))
+            del self._calls[:-self.window]
+            if len(self._calls) < self.min_calls:
+                return
+            errors = sum(not ok for ok, _ in self._calls) / len(self._calls)
+            latencies = sorted(seconds for _, seconds in self._calls)
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+            if errors >= self.error_rate:
+                self._open(f"error rate {errors:.0%} over the last {len(self._calls)} calls")
+            elif p95 >= self.slow_p95:
+                self._open(f"p95 latency {p95:.1f}s over the last {len(self._calls)} calls")
+
+    def abandon(self):
+        # An allowed call that ended without an outcome (cancelled, refused by admission)
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+
+    def _open(self, reason: str):
+        self.state = self.OPEN
+        self.opened += 1
+        self._opened_at = time.monotonic()
+        self._probing = False
+        logging.warning("LLM circuit breaker open for %.0fs: %s", self.cooldown, reason)
+
+    def stats(self) -> dict:
+        calls = list(self._calls)
+        return {
+            "state": self.state,
+            "window_calls": len(calls),
+            "window_errors": sum(not ok for ok, _ in calls),
+            "opened": self.opened,
+            "refused": self.refused,
+        }
@@ -0,0 +1,130 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_message(message: str) -> str:
+    # "  Something CHILL!! " and "something chill" share an entry
+    text = re.sub(r"\s+", " ", message.strip().lower())
+    return text.rstrip(".!?")
+
+
+class PreferenceCache:
+    """LRU + TTL cache for LLM preference extractions, keyed on the normalized message and
+    the prompt/model version; with a path, entries are written through to SQLite."""
+
+    def __init__(self, max_size: int = 4096, ttl: float = 24 * 3600, path: str = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._db = None
+        self.reopen()
+
+    def reopen(self):
+        # Called per worker after fork; several processes may share one file, hence WAL and a busy timeout
+        if self.path:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS extractions (key TEXT PRIMARY KEY, value TEXT, stored_at REAL)"
+            )
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @classmethod
+    def from_env(cls) -> "PreferenceCache":
+        return cls(
+            max_size=int(os.getenv("MOODIFY_EXTRACTION_CACHE_SIZE", "4096")),
+            ttl=float(os.getenv("MOODIFY_EXTRACTION_CACHE_TTL", str(24 * 3600))),
+            path=os.getenv("MOODIFY_EXTRACTION_CACHE_PATH") or None,
+        )
+
+    @staticmethod
+    def make_key(message: str, version: str) -> str:
+        return f"{version}:{normalize_message(message)}"
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(value)
+                del self._entries[key]
+                self.expirations += 1
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, stored_at FROM extractions WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return dict(value)
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: dict):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, dict(value))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO extractions (key, value, stored_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), now),
+                )
+                # Keep the store within the same cap, dropping the oldest writes
+                self._db.execute(
+                    "DELETE FROM extractions WHERE stored_at < ? OR key NOT IN "
+                    "(SELECT key FROM extractions ORDER BY stored_at DESC LIMIT ?)",
+                    (now - self.ttl, self.max_size),
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, stored_at: float, value: dict):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM extractions")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
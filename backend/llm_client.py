@@ -0,0 +1,350 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import json
+import os
+import random
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from llm_admission import AdmissionController, CircuitBreaker, Saturated, SingleFlight
+from metrics import LLM_QUEUE_SECONDS, LLM_REQUESTS, LLM_RETRIES, LLM_SECONDS, LLM_TOKENS
+from pipeline import count, note, remaining_budget
+
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# With less of the request's latency budget left than this, a call is not attempted
+MIN_CALL_SECONDS = 0.1
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMRejected(LLMError):
+    """Not sent: admission refused it, the circuit breaker is open or the latency budget is spent."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"LLM call rejected: {reason}")
+        self.reason = reason
+
+
+class LLMClient:
+    """Shared, pooled chat-completions client for the Groq helpers in utils.
+    Calls pass one AdmissionController, retry transient failures and respect the request's
+    latency budget and the circuit breaker (MOODIFY_LLM_BREAKER=0 turns it off); calls not made raise LLMRejected."""
+
+    def __init__(self, url: str = GROQ_API_URL, timeout: float = 15.0, connect_timeout: float = 3.0,
+                 max_concurrency: int = 16, max_retries: int = 2, backoff: float = 0.25, pool_size: int = 32,
+                 rate: float = 0.0, burst: float = 10.0, max_queue: int = 64, max_wait: float = 5.0,
+                 coalesce: bool = True, breaker: CircuitBreaker = None):
+        self.url = url
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.coalesce = coalesce
+        self.admission = AdmissionController(max_concurrency, rate, burst, max_queue, max_wait)
+        self.flights = SingleFlight()
+        self.breaker = breaker
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._async_client = None
+        # Coalesced sync calls run here, so the call does not end with the caller that started it
+        self._flight_pool = concurrent.futures.ThreadPoolExecutor(pool_size, thread_name_prefix="llm-flight")
+
+    @classmethod
+    def from_env(cls) -> "LLMClient":
+        return cls(
+            url=os.getenv("GROQ_API_URL", GROQ_API_URL),
+            timeout=float(os.getenv("MOODIFY_LLM_TIMEOUT", "15")),
+            connect_timeout=float(os.getenv("MOODIFY_LLM_CONNECT_TIMEOUT", "3")),
+            max_concurrency=int(os.getenv("MOODIFY_LLM_CONCURRENCY", "16")),
+            max_retries=int(os.getenv("MOODIFY_LLM_RETRIES", "2")),
+            backoff=float(os.getenv("MOODIFY_LLM_BACKOFF", "0.25")),
+            rate=float(os.getenv("MOODIFY_LLM_RATE", "0")),
+            burst=float(os.getenv("MOODIFY_LLM_BURST", "10")),
+            max_queue=int(os.getenv("MOODIFY_LLM_QUEUE", "64")),
+            max_wait=float(os.getenv("MOODIFY_LLM_QUEUE_WAIT", "5")),
+            coalesce=os.getenv("MOODIFY_LLM_COALESCE", "1") == "1",
+            breaker=CircuitBreaker.from_env() if os.getenv("MOODIFY_LLM_BREAKER", "1") == "1" else None,
+        )
+
+    def _headers(self, api_key: str) -> dict:
+        return {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _delay(self, attempt: int) -> float:
+        return self.backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    def _record(self, kind: str, started: float, outcome: str, data: dict = None, chunks: int = 0,
+                latency: float = None):
+        seconds = time.perf_counter() - started
+        if outcome == "cancelled":
+            self._abandon()
+        elif self.breaker is not None:
+            self.breaker.record(outcome == "ok", seconds if latency is None else latency)
+        LLM_SECONDS.observe(seconds, kind=kind, outcome=outcome)
+        count("llm_calls")
+        usage = (data or {}).get("usage") or {}
+        prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", chunks)
+        if prompt:
+            LLM_TOKENS.inc(prompt, kind=kind, type="prompt")
+        if completion:
+            LLM_TOKENS.inc(completion, kind=kind, type="completion")
+        if prompt or completion:
+            count("llm_tokens", prompt + completion)
+
+    @staticmethod
+    def _admitted(kind: str, waited: float):
+        LLM_REQUESTS.inc(kind=kind, outcome="sent")
+        LLM_QUEUE_SECONDS.observe(waited, kind=kind)
+        if waited:
+            count("llm_queue_ms", round(waited * 1000, 2))
+
+    @staticmethod
+    def _rejected(kind: str, reason: str) -> LLMRejected:
+        LLM_REQUESTS.inc(kind=kind, outcome=f"rejected_{reason}")
+        note("llm_rejected", reason)
+        return LLMRejected(reason)
+
+    @staticmethod
+    def _joined(kind: str):
+        LLM_REQUESTS.inc(kind=kind, outcome="coalesced")
+        count("llm_coalesced")
+
+    def _flight_key(self, body: dict, api_key: str) -> str:
+        return SingleFlight.key(self.url, api_key, body)
+
+    def _budget(self, kind: str):
+        # Seconds the call may take (None: no deadline); raises once too little is left to try
+        remaining = remaining_budget()
+        if remaining is not None and remaining < MIN_CALL_SECONDS:
+            raise self._rejected(kind, "deadline")
+        return remaining
+
+    def _allow(self, kind: str):
+        if self.breaker is not None and not self.breaker.allow():
+            raise self._rejected(kind, "breaker_open")
+
+    @staticmethod
+    def _max_wait(bounded: bool = True):
+        # How long admission may wait: the remaining budget, less time for the call itself
+        remaining = remaining_budget() if bounded else None
+        return None if remaining is None else remaining - MIN_CALL_SECONDS
+
+    def _abandon(self):
+        if self.breaker is not None:
+            self.breaker.abandon()
+
+    def _timeouts(self, bounded: bool = True) -> tuple:
+        # (connect, read) timeouts for the next attempt, shortened to the remaining budget
+        remaining = remaining_budget() if bounded else None
+        if remaining is None:
+            return self.connect_timeout, self.timeout
+        remaining = max(remaining, 0.001)
+        return min(self.connect_timeout, remaining), min(self.timeout, remaining)
+
+    def post(self, body: dict, api_key: str, kind: str = "chat") -> dict:
+        remaining = self._budget(kind)
+        if not self.coalesce:
+            return self._post(body, api_key, kind)
+        # As in apost: the shared call runs to the client timeout and each caller waits out its own budget
+        call = contextvars.copy_context().run
+        future = self.flights.submit(self._flight_key(body, api_key),
+                                     lambda: call(self._post, body, api_key, kind, False),
+                                     self._flight_pool, on_join=lambda: self._joined(kind))
+        try:
+            return future.result(remaining)
+        except concurrent.futures.TimeoutError as e:
+            raise LLMError("LLM request failed: latency budget spent") from e
+
+    def _post(self, body: dict, api_key: str, kind: str, bounded: bool = True) -> dict:
+        self._allow(kind)
+        try:
+            waited = self.admission.admit(self._max_wait(bounded))
+        except Saturated as e:
+            self._abandon()
+            raise self._rejected(kind, e.reason) from e
+        self._admitted(kind, waited)
+        started, outcome, data = time.perf_counter(), "error", None
+        try:
+            for attempt in range(self.max_retries + 1):
+                last = attempt == self.max_retries
+                try:
+                    response = self._session.post(
+                        self.url, headers=self._headers(api_key), json=body, timeout=self._timeouts(bounded),
+                    )
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if last:
+                        raise LLMError(f"LLM request failed: {e}") from e
+                    error = e
+                else:
+                    if response.status_code not in RETRY_STATUS or last:
+                        response.raise_for_status()
+                        data = response.json()
+                        outcome = "ok"
+                        return data
+                    error = f"status {response.status_code}"
+                delay = self._delay(attempt)
+                remaining = remaining_budget() if bounded else None
+                if remaining is not None and remaining < delay + MIN_CALL_SECONDS:
+                    raise LLMError(f"LLM request failed: {error}; no latency budget left to retry")
+                LLM_RETRIES.inc(kind=kind)
+                time.sleep(delay)
+        finally:
+            self.admission.release()
+            self._record(kind, started, outcome, data)
+
+    def _async_state(self):
+        # Created on first use so it binds to the running event loop
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+        return self._async_client
+
+    async def apost(self, body: dict, api_key: str, kind: str = "chat") -> dict:
+        remaining = self._budget(kind)
+        if not self.coalesce:
+            return await self._apost(body, api_key, kind)
+        # The shared call runs to the client timeout, not to whichever caller's deadline
+        # started it; every caller still stops waiting when its own budget runs out
+        try:
+            return await asyncio.wait_for(self.flights.ado(self._flight_key(body, api_key),
+                                                           lambda: self._apost(body, api_key, kind, bounded=False),
+                                                           on_join=lambda: self._joined(kind)), remaining)
+        except asyncio.TimeoutError as e:
+            raise LLMError("LLM request failed: latency budget spent") from e
+
+    async def _apost(self, body: dict, api_key: str, kind: str, bounded: bool = True) -> dict:
+        client = self._async_state()
+        self._allow(kind)
+        try:
+            waited = await self.admission.aadmit(self._max_wait(bounded))
+        except Saturated as e:
+            self._abandon()
+            raise self._rejected(kind, e.reason) from e
+        except asyncio.CancelledError:
+            self._abandon()
+            raise
+        self._admitted(kind, waited)
+        started, outcome, data = time.perf_counter(), "error", None
+        try:
+            data = await asyncio.wait_for(self._attempts(client, body, api_key, kind),
+                                          remaining_budget() if bounded else None)
+            outcome = "ok"
+            return data
+        except asyncio.TimeoutError as e:
+            outcome = "timeout"
+            raise LLMError("LLM request failed: latency budget spent") from e
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            self.admission.release()
+            self._record(kind, started, outcome, data)
+
+    async def _attempts(self, client: httpx.AsyncClient, body: dict, api_key: str, kind: str) -> dict:
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            try:
+                response = await client.post(self.url, headers=self._headers(api_key), json=body)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                if last:
+                    raise LLMError(f"LLM request failed: {e}") from e
+            else:
+                if response.status_code not in RETRY_STATUS or last:
+                    response.raise_for_status()
+                    return response.json()
+            LLM_RETRIES.inc(kind=kind)
+            await asyncio.sleep(self._delay(attempt))
+
+    async def astream(self, body: dict, api_key: str, kind: str = "chat"):
+        """Yield content deltas as the model produces them (OpenAI-style SSE).
+        Retries only happen before the first token."""
+        self._budget(kind)
+        client = self._async_state()
+        body = dict(body, stream=True)
+        self._allow(kind)
+        try:
+            waited = await self.admission.aadmit(self._max_wait())
+        except Saturated as e:
+            self._abandon()
+            raise self._rejected(kind, e.reason) from e
+        except asyncio.CancelledError:
+            self._abandon()
+            raise
+        self._admitted(kind, waited)
+        started, outcome, chunks, first_token = time.perf_counter(), "error", 0, None
+        try:
+            for attempt in range(self.max_retries + 1):
+                last = attempt == self.max_retries
+                connect, read = self._timeouts()
+                try:
+                    async with client.stream("POST", self.url, headers=self._headers(api_key), json=body,
+                                             timeout=httpx.Timeout(read, connect=connect)) as response:
+                        if response.status_code not in RETRY_STATUS or last:
+                            response.raise_for_status()
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[len("data:"):].strip()
+                                if data == "[DONE]":
+                                    outcome = "ok"
+                                    return
+                                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                                if delta:
+                                    if first_token is None:
+                                        first_token = time.perf_counter() - started
+                                    chunks += 1
+                                    yield delta
+                            outcome = "ok"
+                            return
+                except (httpx.TransportError, httpx.TimeoutException) as e:
+                    if last or chunks:
+                        raise LLMError(f"LLM stream failed: {e}") from e
+                delay = self._delay(attempt)
+                remaining = remaining_budget()
+                if remaining is not None and remaining < delay + MIN_CALL_SECONDS:
+                    raise LLMError("LLM stream failed: no latency budget left to retry")
+                LLM_RETRIES.inc(kind=kind)
+                await asyncio.sleep(delay)
+        except (asyncio.CancelledError, GeneratorExit):
+            # The consumer went away; says nothing about the provider
+            outcome = "cancelled"
+            raise
+        finally:
+            self.admission.release()
+            self._record(kind, started, outcome, chunks=chunks, latency=first_token)
+
+    def stats(self) -> dict:
+        return {
+            "admission": self.admission.stats(),
+            "coalescing": dict(self.flights.stats(), enabled=self.coalesce),
+            "breaker": self.breaker.stats() if self.breaker is not None else {"state": "disabled"},
+        }
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def close(self):
+        self._flight_pool.shutdown(wait=False)
+        self._session.close()
+
+
+llm = LLMClient.from_env()
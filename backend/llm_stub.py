@@ -0,0 +1,123 @@
+"""Local stand-in for the Groq chat-completions endpoint.
+
+Point the backend at it with GROQ_API_URL, e.g.
+
+    python llm_stub.py --port 8099 --latency 0.3 --fail-rate 0.1
+    GROQ_API_URL=http://127.0.0.1:8099/v1/chat/completions uvicorn main:app
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_GENRES = ["pop", "rock", "classical", "jazz", "metal", "electronic", "hip hop", "rap",
+               "r&b", "lofi", "latin", "folk", "reggae", "country", "blues", "indie"]
+STUB_MOODS = ["happy", "sad", "calm", "energetic"]
+STUB_TEMPOS = ["slow", "medium", "fast"]
+
+
+def stub_reply(body: dict) -> str:
+    system = body["messages"][0]["content"].lower()
+    prompt = body["messages"][-1]["content"]
+    if "extract" in system:
+        match = re.search(r'Input: "(.*)"', prompt)
+        text = match.group(1).lower() if match else ""
+        pick = lambda options: next((o for o in options if o in text), None)
+        return json.dumps({"genre": pick(STUB_GENRES), "mood": pick(STUB_MOODS),
+                           "tempo": pick(STUB_TEMPOS), "artist_or_song": None})
+    return "Here is a stub reply about a great song you might enjoy."
+
+
+class StubServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, fail_rate: float = 0.0, fail_status: int = 503, token_delay: float = 0.0,
+                 fail_first: int = 0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        # The first fail_first requests fail regardless of fail_rate
+        self.fail_first = fail_first
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                stub.requests += 1
+                time.sleep(max(0.0, stub.latency + random.uniform(-stub.jitter, stub.jitter)))
+                if stub.requests <= stub.fail_first or random.random() < stub.fail_rate:
+                    payload, status = {"error": "stub failure"}, stub.fail_status
+                elif body.get("stream"):
+                    self._stream(stub_reply(body))
+                    return
+                else:
+                    payload = {"choices": [{"message": {"role": "assistant", "content": stub_reply(body)}}]}
+                    status = 200
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, text):
+                # One SSE chunk per word, spaced by token_delay
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for i, word in enumerate(text.split(" ")):
+                    chunk = {"choices": [{"delta": {"content": word if i == 0 else " " + word}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(stub.token_delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    args = parser.parse_args()
+    stub = StubServer(args.host, args.port, args.latency, args.jitter, args.fail_rate, args.fail_status, args.token_delay)
+    print(f"LLM stub listening on {stub.url}")
+    stub.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""Benchmark suite and load test for the recommendation path, with JSON results.
+
+    python loadtest.py --sizes 10000,100000,1000000 --out results/HEAD.json
+    python loadtest.py --sizes 10000 --llm-latency 0.3 --compare results/main.json
+    python loadtest.py --sizes 100000 --serve-workers 1,2,4 --conversations 0
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+import pandas as pd
+
+from bench import measure, summarize
+from tests.helpers import PREFERENCE_MIX, fuzzy_queries, make_synthetic_catalog
+
+CONVERSATION = [
+    ("/recommend", {"artist_or_song": "hi"}),
+    ("/recommend", {"artist_or_song": "I want happy pop"}),
+    ("/recommend", {"artist_or_song": "fast"}),
+    ("/recommend", {"artist_or_song": "no preference"}),
+    ("/command", {"command": "no"}),
+    ("/command", {"command": "another one"}),
+    ("/command", {"command": "change genre"}),
+    ("/command", {"command": "rock"}),
+    ("/command", {"command": "yes"}),
+]
+BATCH_REQUEST = {"requests": [dict(p) for p in PREFERENCE_MIX] * 4, "count": 5, "summarize": False}
+SMAPS_FIELDS = {"Rss": "rss_mb", "Pss": "pss_mb", "Private_Clean": "private_mb", "Private_Dirty": "private_mb"}
+# Per-size metrics compared by --compare, as "section.metric"
+COMPARED = ("p50_ms", "p95_ms")
+
+
+def max_rss_mb() -> float:
+    # Linux reports ru_maxrss in KiB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def label(prefs: dict) -> str:
+    return ", ".join(f"{k}={v}" for k, v in prefs.items() if v) or "no preferences"
+
+
+def timed_import(name: str):
+    # No tracemalloc here: it would slow the import it is timing; RSS growth stands in
+    rss_before = max_rss_mb()
+    start = time.perf_counter()
+    module = __import__(name)
+    elapsed = time.perf_counter() - start
+    return module, {"seconds": elapsed, "rss_growth_mb": max_rss_mb() - rss_before, "max_rss_mb": max_rss_mb()}
+
+
+def bench_startup(eng, repeat: int) -> dict:
+    from catalog import BucketIndex
+    from snapshot import read_snapshot
+
+    eng.compile_snapshot()
+    runs = max(1, repeat // 10)
+    return {
+        "snapshot_load": measure(lambda: read_snapshot(eng.SNAPSHOT_PATH, eng.DATA_PATH, eng.SNAPSHOT_KEY), runs),
+        "bucket_index": measure(lambda: BucketIndex(eng.df), runs),
+    }
+
+
+def bench_engine(eng, repeat: int) -> dict:
+    results, timings = {}, []
+    for prefs in PREFERENCE_MIX:
+        samples = []
+        for _ in range(repeat):
+            session = dict(prefs, history=[])
+            start = time.perf_counter()
+            eng.recommend_engine(session)
+            samples.append(time.perf_counter() - start)
+        results[label(prefs)] = summarize(samples)
+        timings.extend(samples)
+    results["all"] = summarize(timings)
+    return results
+
+
+def bench_fuzzy(eng, repeat: int) -> dict:
+    from utils import fuzzy_match_artist_song
+
+    queries = fuzzy_queries(eng, 20)
+    timings = []
+    for _ in range(max(1, repeat // 10)):
+        for query in queries:
+            start = time.perf_counter()
+            fuzzy_match_artist_song(eng.df, query, index=eng.catalog.name_index)
+            timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def bench_scoring(eng, repeat: int, sample: int = 1000) -> dict:
+    rows = eng.df.iloc[:sample]
+    per_row = measure(lambda: [eng.weighted_score(row, PREFERENCE_MIX[0]) for _, row in rows.iterrows()],
+                      max(1, repeat // 10))
+    return {
+        "weighted_score_per_row_us": per_row["p50_ms"] * 1000 / len(rows),
+        "vectorized_all_rows": measure(lambda: eng.scorer.score(eng.catalog.all_rows(), PREFERENCE_MIX[0]), repeat),
+    }
+
+
+def run_conversation(client, session_id: str, timings: dict):
+    for path, payload in CONVERSATION:
+        start = time.perf_counter()
+        response = client.post(path, json=dict(payload, session_id=session_id))
+        timings.setdefault(path, []).append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.text}")
+
+
+def bench_conversations(conversations: int, concurrency: int) -> dict:
+    from fastapi.testclient import TestClient
+    import main
+
+    timings = {}
+    with TestClient(main.app) as client:
+        run_conversation(client, "warmup", {})
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(lambda i: run_conversation(client, f"load-{i}", timings), range(conversations)))
+        elapsed = time.perf_counter() - start
+    requests_made = sum(len(t) for t in timings.values())
+    results = {path: summarize(t) for path, t in timings.items()}
+    results["all"] = dict(summarize([x for t in timings.values() for x in t]),
+                          requests_per_s=requests_made / elapsed, conversations_per_s=conversations / elapsed)
+    return results
+
+
+def process_memory(pid: int) -> dict:
+    memory = {"rss_mb": 0.0, "pss_mb": 0.0, "private_mb": 0.0}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            field, _, value = line.partition(":")
+            if field in SMAPS_FIELDS:
+                memory[SMAPS_FIELDS[field]] += int(value.split()[0]) / 1024
+    return memory
+
+
+def child_pids(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def start_server(workers: int, port: int, env: dict, timeout: float = 600.0):
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port), "--host", "127.0.0.1",
+         "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"serve.py exited with {server.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/stats").status_code == 200 and len(child_pids(server.pid)) == workers:
+                return server
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("serve.py did not come up")
+
+
+def drive(base_url: str, scenario: str, clients: int, seconds: float) -> dict:
+    timings, errors = [], [0]
+    deadline = time.perf_counter() + seconds
+
+    def client_loop(i: int):
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            n = 0
+            while time.perf_counter() < deadline:
+                if scenario == "batch":
+                    calls = [("/recommend/batch", BATCH_REQUEST)]
+                else:
+                    calls = [(path, dict(payload, session_id=f"serve-{i}-{n}")) for path, payload in CONVERSATION]
+                for path, payload in calls:
+                    start = time.perf_counter()
+                    response = client.post(path, json=payload)
+                    timings.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        errors[0] += 1
+                n += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(client_loop, range(clients)))
+    elapsed = time.perf_counter() - start
+    return dict(summarize(timings), requests_per_s=len(timings) / elapsed, errors=errors[0])
+
+
+def bench_serving(path: str, stub_url: str, args) -> dict:
+    workdir = os.path.dirname(path)
+    results = {}
+    for workers in [int(w) for w in args.serve_workers.split(",") if w]:
+        env = dict(os.environ, MOODIFY_SNAPSHOT="1", MOODIFY_SESSION_BACKEND="sqlite",
+                   MOODIFY_SESSION_PATH=os.path.join(workdir, f"sessions-{workers}.db"), GROQ_API_URL=stub_url)
+        port = args.serve_port + workers
+        start = time.perf_counter()
+        server = start_server(workers, port, env)
+        run = {"workers": workers, "startup_s": time.perf_counter() - start}
+        try:
+            for scenario in ("batch", "conversation"):
+                run[scenario] = drive(f"http://127.0.0.1:{port}", scenario, args.serve_clients, args.serve_seconds)
+            run["parent_memory"] = process_memory(server.pid)
+            run["worker_memory"] = [process_memory(pid) for pid in child_pids(server.pid)]
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(30)
+        run["total_pss_mb"] = run["parent_memory"]["pss_mb"] + sum(m["pss_mb"] for m in run["worker_memory"])
+        results[str(workers)] = run
+    return results
+
+
+def worker(args) -> dict:
+    # One catalog size, in a fresh process; results go to args.worker_out as JSON
+    from llm_client import llm
+    from llm_stub import StubServer
+
+    workdir = tempfile.mkdtemp(prefix="moodify-load-")
+    path = os.path.join(workdir, "songs.csv")
+    make_synthetic_catalog(args.rows).to_csv(path, index=False)
+    stub = StubServer(latency=args.llm_latency, jitter=args.llm_jitter, fail_rate=args.llm_fail_rate).start()
+    os.environ.update({
+        "MOODIFY_DATA_PATH": path,
+        "MOODIFY_SNAPSHOT_PATH": path + ".snapshot",
+        "MOODIFY_SNAPSHOT": "0",
+        "GROQ_API_URL": stub.url,
+        "GROQ_API_KEY": "stub",
+    })
+    # The shared client was created when bench imported utils, before GROQ_API_URL was set
+    llm.url = stub.url
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        eng, startup = timed_import("recommender_eng")
+        results = {"rows": args.rows, "startup": dict(startup, **bench_startup(eng, args.repeat))}
+        results["recommend_engine"] = bench_engine(eng, args.repeat)
+        results["fuzzy_match_artist_song"] = bench_fuzzy(eng, args.repeat)
+        results["weighted_score"] = bench_scoring(eng, args.repeat)
+        if args.conversations:
+            results["conversation"] = bench_conversations(args.conversations, args.concurrency)
+    if args.serve_workers:
+        results["serving"] = bench_serving(path, stub.url, args)
+    results["llm_stub_requests"] = stub.requests
+    results["max_rss_mb"] = max_rss_mb()
+    stub.stop()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and name.rsplit(".", 1)[-1] in COMPARED:
+            flat[name] = value
+    return flat
+
+
+def compare(baseline: dict, current: dict, threshold: float, min_delta_ms: float) -> int:
+    """Print latency changes against a previous run; returns the number of regressions
+    (slower by more than threshold and min_delta_ms)."""
+    regressions = 0
+    for size, results in current["sizes"].items():
+        old = flatten(baseline.get("sizes", {}).get(size, {}))
+        if not old:
+            print(f"{size} rows: not in baseline")
+            continue
+        new = {name: value for name, value in flatten(results).items() if old.get(name, 0) > 0}
+        width = max(map(len, new), default=0)
+        print(f"\n{size} rows vs {baseline['meta'].get('commit') or 'baseline'}")
+        for name, value in new.items():
+            change = value / old[name] - 1
+            flag = ""
+            if change > threshold and value - old[name] > min_delta_ms:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"  {name:<{width}} {old[name]:>10.2f} -> {value:>10.2f} ms {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated catalog sizes")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--conversations", type=int, default=20, help="conversations per size (0 to skip)")
+    parser.add_argument("--concurrency", type=int, default=1, help="conversations run in parallel")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds added to every stub reply")
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--llm-fail-rate", type=float, default=0.0)
+    parser.add_argument("--serve-workers", default="", help="comma-separated worker counts to serve with serve.py")
+    parser.add_argument("--serve-clients", type=int, default=8, help="concurrent HTTP clients in serving mode")
+    parser.add_argument("--serve-seconds", type=float, default=10.0, help="duration of each serving scenario")
+    parser.add_argument("--serve-port", type=int, default=18100, help="serve.py listens on this port + workers")
+    parser.add_argument("--out", default=None, help="write results as JSON")
+    parser.add_argument("--compare", default=None, help="previous JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown reported as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="smaller absolute slowdowns are never flagged")
+    parser.add_argument("--rows", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker_out:
+        with open(args.worker_out, "w") as f:
+            json.dump(worker(args), f)
+        return 0
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": time.time(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("rows", "worker_out")},
+        },
+        "sizes": {},
+    }
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        with tempfile.NamedTemporaryFile(suffix=".json") as out:
+            command = [sys.executable, os.path.abspath(__file__), "--rows", str(size), "--worker-out", out.name]
+            for flag in ("repeat", "conversations", "concurrency", "llm_latency", "llm_jitter", "llm_fail_rate",
+                         "serve_workers", "serve_clients", "serve_seconds", "serve_port"):
+                command += [f"--{flag.replace('_', '-')}", str(getattr(args, flag))]
+            start = time.perf_counter()
+            subprocess.run(command, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            results = json.load(open(out.name))
+        report["sizes"][str(size)] = results
+        engine, startup = results["recommend_engine"]["all"], results["startup"]
+        line = (f"{size:>8} rows: startup {startup['seconds']:.2f}s, snapshot {startup['snapshot_load']['p50_ms']:.0f} ms, "
+                f"engine p50/p95/p99 {engine['p50_ms']:.1f}/{engine['p95_ms']:.1f}/{engine['p99_ms']:.1f} ms")
+        if "conversation" in results:
+            chat = results["conversation"]["all"]
+            line += f", requests p50/p99 {chat['p50_ms']:.0f}/{chat['p99_ms']:.0f} ms at {chat['requests_per_s']:.1f}/s"
+        print(f"{line}, rss {results['max_rss_mb']:.0f} MiB ({time.perf_counter() - start:.0f}s)")
+        for workers, run in results.get("serving", {}).items():
+            rss = max(m["rss_mb"] for m in run["worker_memory"])
+            private = max(m["private_mb"] for m in run["worker_memory"])
+            print(f"{'':>10}{workers} workers: batch {run['batch']['requests_per_s']:.1f} req/s "
+                  f"(p50 {run['batch']['p50_ms']:.0f} ms), conversation {run['conversation']['requests_per_s']:.1f} req/s, "
+                  f"worker rss {rss:.0f} MiB / private {private:.0f} MiB, total pss {run['total_pss_mb']:.0f} MiB")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold, args.min_delta_ms)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
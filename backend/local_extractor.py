@@ -0,0 +1,181 @@
+"""Rule-based preference extraction ahead of the LLM. Evaluate it against recorded LLM outputs
+(MOODIFY_EXTRACTION_RECORD_PATH):
+
+    python local_extractor.py recorded.jsonl --threshold 1.0
+"""
+import argparse
+import json
+import re
+import sys
+
+from vocab import GENRES, SAD_MOODS, SLOW_WORDS
+
+# Words with an everyday sense besides the mood ("down for some pop", "blue suede"); never matched locally
+AMBIGUOUS_WORDS = {"down", "blue"}
+
+MOOD_WORDS = {w: "sad" for w in SAD_MOODS - AMBIGUOUS_WORDS}
+MOOD_WORDS.update({w: "happy" for w in ["happy", "joy", "joyful", "excited", "celebrate", "cheerful", "fun"]})
+MOOD_WORDS.update({w: "energetic" for w in ["energetic", "hyped", "pumped", "intense", "party", "workout"]})
+MOOD_WORDS.update({w: "calm" for w in ["calm", "chill", "relaxed", "relaxing", "peaceful", "mellow"]})
+
+TEMPO_WORDS = {w: "slow" for w in SLOW_WORDS - {"chill", "calm"}}
+TEMPO_WORDS.update({"slower": "slow", "medium": "medium", "moderate": "medium", "midtempo": "medium",
+                    "fast": "fast", "faster": "fast", "quick": "fast", "upbeat": "fast", "uptempo": "fast"})
+
+GENRE_ALIASES = {g: g for g in GENRES}
+GENRE_ALIASES.update({"hiphop": "hip hop", "hip-hop": "hip hop", "rnb": "r&b", "r and b": "r&b",
+                      "lo-fi": "lofi", "lo fi": "lofi", "edm": "electronic"})
+
+FILLER = {
+    "i", "im", "i'm", "me", "my", "a", "an", "the", "some", "something", "want", "wanna", "need",
+    "play", "give", "music", "song", "songs", "track", "tracks", "tune", "tunes", "please", "feeling",
+    "feel", "am", "in", "mood", "for", "to", "listen", "hear", "really", "kinda", "very", "so",
+    "bit", "of", "and", "with", "tempo", "vibe", "vibes", "genre", "more", "maybe", "just", "hi",
+    "hello", "hey", "thanks", "let's", "lets", "today", "now", "right", "would", "could", "can", "you",
+    "by", "pace", "beat", "beats", "bpm", "kind", "type", "style", "mode", "stuff",
+}
+
+# Next to an artist name these ask for someone else ("something like Adele"), which the LLM keeps
+SIMILARITY_WORDS = {"like", "similar", "reminiscent", "style"}
+
+NEGATIONS = {"not", "no", "don't", "dont", "never", "without", "hate", "except", "nothing", "instead"}
+
+TOKEN = re.compile(r"[a-z0-9&'\-]+")
+
+_artist_detector = None
+
+
+def set_artist_detector(detector):
+    # recommender_eng registers the catalog's ArtistMentionDetector once it is built
+    global _artist_detector
+    _artist_detector = detector
+
+
+def _take_phrases(text: str, table: dict) -> tuple:
+    # Multi-word entries first so "hip hop" wins over a stray "hop"
+    found = []
+    for phrase in sorted((p for p in table if " " in p), key=len, reverse=True):
+        pattern = rf"(?<![a-z0-9]){re.escape(phrase)}(?![a-z0-9])"
+        if re.search(pattern, text):
+            found.append(table[phrase])
+            text = re.sub(pattern, " ", text)
+    return found, text
+
+
+def _is_vocabulary(word: str) -> bool:
+    return word in GENRE_ALIASES or word in MOOD_WORDS or word in TEMPO_WORDS or word in FILLER \
+        or word in AMBIGUOUS_WORDS
+
+
+def extract_locally(message: str) -> tuple:
+    text = message.strip().lower()
+    prefs = {"genre": None, "mood": None, "tempo": None, "artist_or_song": None}
+    recognized, unknown = 0, 0
+
+    if _artist_detector is not None:
+        artist = _artist_detector.find_longest(text)
+        if artist and len(artist) >= 3 and not _is_vocabulary(artist.lower()):
+            pattern = rf"(?<![a-z0-9]){re.escape(artist.lower())}(?![a-z0-9])"
+            if re.search(pattern, text):
+                if SIMILARITY_WORDS & set(TOKEN.findall(text)):
+                    return prefs, 0.0
+                prefs["artist_or_song"] = artist
+                text = re.sub(pattern, " ", text)
+                # One-word names are often ordinary words too ("Heart", "Train"): half a match
+                if len(artist.split()) > 1:
+                    recognized += 1
+                else:
+                    recognized += 0.5
+                    unknown += 0.5
+
+    genres, text = _take_phrases(text, GENRE_ALIASES)
+    moods, tempos = [], []
+    for token in TOKEN.findall(text):
+        token = token.strip("'-")
+        if not token:
+            continue
+        if token in NEGATIONS:
+            return prefs, 0.0
+        if token in GENRE_ALIASES:
+            genres.append(GENRE_ALIASES[token])
+        elif token in TEMPO_WORDS:
+            tempos.append(TEMPO_WORDS[token])
+        elif token in MOOD_WORDS:
+            moods.append(MOOD_WORDS[token])
+        elif token in FILLER:
+            continue
+        else:
+            unknown += 1
+            continue
+        recognized += 1
+
+    # Conflicting cues ("sad happy", "pop rock") are left to the LLM
+    for key, values in (("genre", genres), ("mood", moods), ("tempo", tempos)):
+        if len(set(values)) > 1:
+            return prefs, 0.0
+        if values:
+            prefs[key] = values[0]
+
+    total = recognized + unknown
+    confidence = recognized / total if total else 1.0
+    return prefs, confidence
+
+
+def _same(a, b) -> bool:
+    norm = lambda v: v.strip().lower() if isinstance(v, str) else None
+    return norm(a) == norm(b)
+
+
+def evaluate(records: list, threshold: float) -> dict:
+    from utils import PREFERENCE_KEYS, _finish_extraction, _pre_llm_fields
+
+    avoided, agreed = 0, 0
+    field_agreed = {k: 0 for k in PREFERENCE_KEYS}
+    disagreements = []
+    for record in records:
+        message = record["message"]
+        local, confidence = extract_locally(message)
+        if confidence < threshold:
+            continue
+        avoided += 1
+        none_fields, mapped = _pre_llm_fields(message)
+        ours = _finish_extraction(dict(local), none_fields, mapped)
+        theirs = _finish_extraction(dict(record["llm"]), none_fields, mapped)
+        matches = {k: _same(ours[k], theirs[k]) for k in PREFERENCE_KEYS}
+        for k, ok in matches.items():
+            field_agreed[k] += ok
+        if all(matches.values()):
+            agreed += 1
+        else:
+            disagreements.append({"message": message, "local": ours, "llm": theirs})
+
+    return {
+        "messages": len(records),
+        "llm_calls_avoided": avoided,
+        "avoided_fraction": avoided / len(records) if records else 0.0,
+        "agreement_rate": agreed / avoided if avoided else 0.0,
+        "field_agreement": {k: (v / avoided if avoided else 0.0) for k, v in field_agreed.items()},
+        "disagreements": disagreements,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recorded", help="JSONL with {\"message\": ..., \"llm\": {genre, mood, tempo, artist_or_song}}")
+    parser.add_argument("--threshold", type=float, default=1.0)
+    parser.add_argument("--with-catalog", action="store_true", help="load the catalog so artist names are detected")
+    parser.add_argument("--show", type=int, default=10, help="disagreements to print")
+    args = parser.parse_args()
+
+    if args.with_catalog:
+        import recommender_eng  # noqa: F401  registers the artist detector
+    with open(args.recorded) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    report = evaluate(records, args.threshold)
+    for item in report.pop("disagreements")[:args.show]:
+        print("disagree:", json.dumps(item))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
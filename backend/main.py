@@ -1,22 +1,58 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager
+import json
 import os
+import time
+import uuid
 from dotenv import load_dotenv
 from typing import Optional
 import logging
 
-from recommender_eng import recommend_engine
-from memory import SessionMemory
-from utils import generate_chat_response, extract_preferences_from_message, GENRES, next_ai_message
+from recommender_eng import ranking_cache, recommend_batch, recommend_engine, similar_songs
+from memory import SessionConflict, SessionMemory, remember_song
+from llm_client import llm
+import metrics
+from pipeline import PolishStore, PrefetchStore, Speculation, StageTimer
+from profiler import ProfileStore, SamplingProfiler
+from utils import (
+    agenerate_chat_response, agenerate_playlist_summary, aextract_preferences_from_message, GENRES, anext_ai_message,
+    astream_chat_response, astream_next_ai_message, chat_fallback, extraction_cache, extraction_stats,
+    guess_preferences,
+)
 
 # Load Groq key
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
-app = FastAPI()
-memory = SessionMemory()
+# Template-first: answer with the deterministic text, polish it with the LLM afterwards
+TEMPLATE_FIRST = os.getenv("MOODIFY_TEMPLATE_FIRST", "0") == "1"
+# Start recommend_engine on a guessed session while the LLM extraction is in flight
+SPECULATE = os.getenv("MOODIFY_SPECULATE", "1") == "1"
+POLISH_WAIT_SECONDS = float(os.getenv("MOODIFY_POLISH_WAIT", "10"))
+# After a song is served, compute the "no"/"another one" answers in the background (and their chat text)
+PREFETCH = os.getenv("MOODIFY_PREFETCH", "1") == "1"
+PREFETCH_CHAT = os.getenv("MOODIFY_PREFETCH_CHAT", "0") == "1"
+# Seconds a /recommend or /command turn may spend; LLM calls that cannot finish in what is left
+# are skipped for the template replies (0 disables)
+LATENCY_BUDGET_SECONDS = float(os.getenv("MOODIFY_LATENCY_BUDGET", "8"))
+# Honour the X-Moodify-Profile request header (sampling profiler); off by default
+PROFILING = os.getenv("MOODIFY_PROFILING", "0") == "1"
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await llm.aclose()
+    llm.close()
+
+app = FastAPI(lifespan=lifespan)
+memory = SessionMemory.from_env()
+polish_store = PolishStore()
+prefetches = PrefetchStore(max_running=int(os.getenv("MOODIFY_PREFETCH_CONCURRENCY", "2")))
+profiles = ProfileStore()
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,19 +64,232 @@ app.add_middleware(
 
 logging.basicConfig(level=logging.INFO)
 
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    # Timing and profiling end when the body has been sent, so streamed replies count in full;
+    # a streamed reply's profile id is sent up front and resolves once its stream ends
+    profiler = SamplingProfiler().start() if PROFILING and request.headers.get("x-moodify-profile") else None
+    profile_id = uuid.uuid4().hex if profiler is not None else None
+    start = time.perf_counter()
+
+    def finish(status: int):
+        route = request.scope.get("route")
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, route=route.path if route else "unmatched",
+                                        method=request.method, status=status)
+        if profiler is not None:
+            profile = profiler.stop()
+            profiles.add(profile, profile_id)
+            logging.info("%s profile: %d samples, top %s", request.url.path, profile["samples"], profile["functions"][:5])
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        finish(500)
+        raise
+    body = response.body_iterator
+
+    async def observed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            finish(response.status_code)
+
+    response.body_iterator = observed_body()
+    if profile_id is not None:
+        response.headers["X-Moodify-Profile-Id"] = profile_id
+    return response
+
+@metrics.collect
+def service_gauges():
+    sessions, cache, rankings = memory.stats(), extraction_cache.stats(), ranking_cache.stats()
+    admission, breaker = llm.admission.stats(), llm.stats()["breaker"]
+    return [
+        ("moodify_sessions", "Live sessions", [({"backend": sessions["backend"]}, sessions["sessions"])]),
+        ("moodify_session_lookups", "Session lookups since start",
+         [({"result": "hit"}, sessions["hits"]), ({"result": "miss"}, sessions["misses"])]),
+        ("moodify_sessions_removed", "Sessions dropped since start",
+         [({"reason": "evicted"}, sessions["evictions"]), ({"reason": "expired"}, sessions["expirations"])]),
+        ("moodify_extraction_cache_entries", "Entries in the extraction cache", [({}, cache["size"])]),
+        ("moodify_extraction_cache_lookups", "Extraction cache lookups since start",
+         [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])]),
+        ("moodify_ranking_cache_entries", "Cached candidate rankings", [({}, rankings["size"])]),
+        ("moodify_ranking_cache_rows", "Candidate rows held by cached rankings", [({}, rankings["rows"])]),
+        ("moodify_ranking_cache_lookups", "Ranking cache lookups since start",
+         [({"result": "hit"}, rankings["hits"]), ({"result": "miss"}, rankings["misses"])]),
+        ("moodify_llm_in_flight", "Groq calls admitted and not yet finished", [({}, admission["in_flight"])]),
+        ("moodify_llm_queued", "Groq calls waiting for admission", [({}, admission["queued"])]),
+        ("moodify_llm_breaker_state", "1 for the LLM circuit breaker's current state",
+         [({"state": state}, int(breaker["state"] == state)) for state in ("closed", "open", "half_open", "disabled")]),
+        ("moodify_llm_breaker_opened", "Times the LLM circuit breaker opened since start", [({}, breaker.get("opened", 0))]),
+    ]
+
 class PreferenceInput(BaseModel):
     session_id: str
     genre: Optional[str] = None
     mood: Optional[str] = None
     tempo: Optional[str] = None
     artist_or_song: Optional[str] = None
+    template_first: Optional[bool] = None
 
 class CommandInput(BaseModel):
     session_id: str
     command: str
+    template_first: Optional[bool] = None
 
-@app.post("/recommend")
-def recommend(preference: PreferenceInput):
+class SimilarInput(BaseModel):
+    session_id: Optional[str] = None
+    track_id: Optional[str] = None
+    song: Optional[str] = None
+    k: int = Field(10, ge=1, le=100)
+    exclude_history: bool = True
+
+class BatchPreferences(BaseModel):
+    session_id: Optional[str] = None
+    genre: Optional[str] = None
+    mood: Optional[str] = None
+    tempo: Optional[str] = None
+    artist_or_song: Optional[str] = None
+
+class BatchInput(BaseModel):
+    requests: list[BatchPreferences] = Field(min_length=1, max_length=1000)
+    count: int = Field(1, ge=1, le=50)
+    max_per_artist: Optional[int] = Field(None, ge=1)
+    summarize: bool = True
+
+ALL_FIELDS = ["genre", "mood", "tempo", "artist_or_song"]
+NO_PREF_MESSAGES = ["no", "none", "no preference", "nothing", "any", "whatever", "anything", "doesn't matter", "no specific preference"]
+
+def apply_extracted(update, extracted: dict, user_message: str):
+    for key in ALL_FIELDS:
+        if extracted.get(key) is None and user_message.strip().lower() in NO_PREF_MESSAGES:
+            update(f"no_pref_{key}", True)
+        elif extracted.get(key):
+            update(key, extracted[key])
+            update(f"no_pref_{key}", False)
+
+def preferences_complete(session: dict) -> bool:
+    return all(session.get(k) is not None or session.get(f"no_pref_{k}", False) for k in ALL_FIELDS)
+
+def start_speculation(session: dict, user_message: str):
+    # Guess the post-extraction session locally and start scoring it right away
+    guess = dict(session)
+    guess["history"] = list(session.get("history", []))
+    apply_extracted(guess.__setitem__, guess_preferences(user_message), user_message)
+    if not preferences_complete(guess):
+        return None
+    return Speculation(guess, lambda prefs: run_in_threadpool(recommend_engine, prefs))
+
+def next_states(session: dict) -> list:
+    # The sessions the "no" and "another one" branches of command_turn hand to recommend_engine
+    last = (session.get("last_song"), session.get("last_artist"))
+    prefs = {k: session.get(k) for k in ALL_FIELDS}
+    return [dict(prefs, history=list(session["history"]) + [last]), dict(prefs, history=[last])]
+
+async def prefetch_next(states: list) -> list:
+    results = []
+    for state in states:
+        song = await run_in_threadpool(recommend_engine, state)
+        message = None
+        if PREFETCH_CHAT and song and song["song"] != "N/A":
+            same = next((r for r in results if r[1] == song), None)
+            message = same[2] if same else await agenerate_chat_response(song, dict(state), GROQ_API_KEY)
+        results.append((state, song, message))
+    return results
+
+def save_turn(session_id: str, session: dict, reply: dict):
+    try:
+        memory.save_session(session_id, session)
+    except SessionConflict:
+        # Nothing of this turn is kept (409), so its polish call is not wanted either
+        if "polish_id" in reply:
+            polish_store.cancel(reply["polish_id"])
+        raise
+    schedule_prefetch(session_id, session)
+
+def schedule_prefetch(session_id: str, session: dict):
+    # Called once the turn's session is saved; a session that is not awaiting feedback has nothing to prefetch
+    if not PREFETCH:
+        return
+    if session.get("awaiting_feedback") and session.get("last_song") is not None:
+        prefetches.start(session_id, next_states(session), prefetch_next)
+    else:
+        prefetches.discard(session_id)
+
+async def next_song(session_id: str, session: dict, timer: StageTimer) -> tuple:
+    """(song, chat message or None) for a "no"/"another one" turn, prefetched when possible."""
+    prefetched = await prefetches.take(session_id, session) if PREFETCH else None
+    if prefetched is None:
+        return await run_in_threadpool(recommend_engine, session), None
+    state, song, message = prefetched
+    timer.notes["prefetch_hit"] = True
+    for key in ("mood", "artist_or_song", "history"):
+        session[key] = state.get(key)
+    return song, message
+
+# Reply modes: "full" waits for the LLM, "template" answers with the deterministic
+# text and polishes later, "stream" hands the LLM tokens to an SSE response
+def reply_mode(template_first) -> str:
+    template_first = TEMPLATE_FIRST if template_first is None else template_first
+    return "template" if template_first else "full"
+
+async def chat_reply(song: dict, prefs: dict, timer: StageTimer, mode: str, suffix: str, message: str = None) -> dict:
+    if message is not None:
+        return {"response": f"<span style='color:green'>{message}</span>{suffix}"}
+    if mode == "stream":
+        return {"prefix": "<span style='color:green'>", "stream": astream_chat_response(song, dict(prefs), GROQ_API_KEY),
+                "suffix": "</span>" + suffix}
+    if mode == "template":
+        polish_id = polish_store.submit(
+            agenerate_chat_response(song, dict(prefs), GROQ_API_KEY),
+            template="<span style='color:green'>{}</span>" + suffix,
+        )
+        return {"response": f"<span style='color:green'>{chat_fallback(song)}</span>{suffix}", "polish_id": polish_id}
+    with timer.stage("chat"):
+        gpt_message = await agenerate_chat_response(song, prefs, GROQ_API_KEY)
+    return {"response": f"<span style='color:green'>{gpt_message}</span>{suffix}"}
+
+async def followup_reply(session: dict, user_message: str, timer: StageTimer, mode: str) -> dict:
+    if mode == "stream":
+        return {"prefix": "<span style='color:green'>", "stream": astream_next_ai_message(dict(session), user_message, GROQ_API_KEY),
+                "suffix": "</span>"}
+    with timer.stage("chat"):
+        ai_message = await anext_ai_message(session, user_message, GROQ_API_KEY)
+    return {"response": f"<span style='color:green'>{ai_message}</span>"}
+
+def with_timings(payload: dict, timer: StageTimer, request: Request, route: str) -> dict:
+    timings = timer.as_dict()
+    timer.record()
+    logging.info("%s timings: %s", route, timings)
+    if request.headers.get("x-moodify-timings"):
+        payload["timings"] = timings
+    return payload
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_reply(payload: dict, timer: StageTimer, request: Request, route: str) -> StreamingResponse:
+    """Server-Sent Events: `token` per LLM chunk, then `done` with the full HTML.
+
+    Replies that involve no LLM text (guards, fixed messages) send `done` only.
+    """
+    async def events():
+        if "stream" not in payload:
+            yield sse_event("done", with_timings(payload, timer, request, route))
+            return
+        parts = []
+        with timer.stage("chat"):
+            async for token in payload["stream"]:
+                if not parts:
+                    timer.notes["first_token_ms"] = round(timer.as_dict()["total"], 2)
+                parts.append(token)
+                yield sse_event("token", {"text": token})
+        done = {"response": payload["prefix"] + "".join(parts) + payload["suffix"]}
+        yield sse_event("done", with_timings(done, timer, request, route))
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+async def recommend_turn(preference: PreferenceInput, session: dict, timer: StageTimer, mode: str) -> dict:
     user_message = (
         preference.artist_or_song
         or preference.genre
@@ -48,83 +297,107 @@ def recommend(preference: PreferenceInput):
         or preference.tempo
         or ""
     )
-    session = memory.get_session(preference.session_id)
-
     # GUARD: If awaiting feedback, do not recommend again until /command clears it!
     if session.get("awaiting_feedback", False):
         return {"response": None}
 
-    # Always extract new info
-    extracted = extract_preferences_from_message(user_message, GROQ_API_KEY)
-    for key in ["genre", "mood", "tempo", "artist_or_song"]:
-        if extracted.get(key) is None and user_message.strip().lower() in ["no", "none", "no preference", "nothing", "any", "whatever", "anything", "doesn't matter", "no specific preference"]:
-            memory.update_session(preference.session_id, f"no_pref_{key}", True)
-        elif extracted.get(key):
-            memory.update_session(preference.session_id, key, extracted[key])
-            memory.update_session(preference.session_id, f"no_pref_{key}", False)
+    speculation = start_speculation(session, user_message) if SPECULATE else None
 
-    session = memory.get_session(preference.session_id)
-    all_fields = ["genre", "mood", "tempo", "artist_or_song"]
-    fields_completed = [
-        k for k in all_fields if session.get(k) is not None or session.get(f"no_pref_{k}", False)
-    ]
+    # Always extract new info
+    try:
+        with timer.stage("extract"):
+            extracted = await aextract_preferences_from_message(user_message, GROQ_API_KEY)
+    except BaseException:
+        # The turn ends here; do not leave the guess running
+        if speculation:
+            speculation.discard("error")
+        raise
+    apply_extracted(session.__setitem__, extracted, user_message)
 
     # Only recommend if ALL 4 are set or "no_pref"
-    if len(fields_completed) == 4:
-        song = recommend_engine(session)
+    if preferences_complete(session):
+        with timer.stage("recommend"):
+            song = await speculation.take(session) if speculation else None
+            if song is not None:
+                timer.notes["speculation_hit"] = True
+                for key in ("mood", "artist_or_song", "history"):
+                    session[key] = speculation.prefs.get(key)
+            else:
+                song = await run_in_threadpool(recommend_engine, session)
         if not song or song['song'] == "N/A":
             return {
                 "response": "<span style='color:green'>I couldn’t find a match. Want to try a different mood, artist, or genre?</span>"
             }
-        memory.update_last_song(preference.session_id, song['song'], song['artist'])
-        gpt_message = generate_chat_response(song, session, GROQ_API_KEY)
-        memory.update_session(preference.session_id, "awaiting_feedback", True)
-        memory.update_session(preference.session_id, "followup_count", 0)
-        return {"response": f"<span style='color:green'>{gpt_message}</span><br>Was that a good fit for you?"}
+        remember_song(session, song['song'], song['artist'])
+        reply = await chat_reply(song, session, timer, mode, "<br>Was that a good fit for you?")
+        session["awaiting_feedback"] = True
+        session["followup_count"] = 0
+        return reply
     else:
+        if speculation:
+            speculation.discard()
         followup_count = session.get("followup_count", 0)
         if followup_count >= 4:
             # Recommend with whatever info is present, fallback logic
-            fake_session = {k: session.get(k) for k in all_fields}
-            for k in all_fields:
+            fake_session = {k: session.get(k) for k in ALL_FIELDS}
+            for k in ALL_FIELDS:
                 if not fake_session[k]:
                     fake_session[k] = "any"
-            song = recommend_engine(fake_session)
+            with timer.stage("recommend"):
+                song = await run_in_threadpool(recommend_engine, fake_session)
             if not song or song['song'] == "N/A":
                 return {
                     "response": "<span style='color:green'>I couldn’t find a match. Want to try a different mood, artist, or genre?</span>"
                 }
-            memory.update_last_song(preference.session_id, song['song'], song['artist'])
-            gpt_message = generate_chat_response(song, fake_session, GROQ_API_KEY)
-            memory.update_session(preference.session_id, "followup_count", 0)
-            memory.update_session(preference.session_id, "awaiting_feedback", True)
-            return {"response": f"<span style='color:green'>{gpt_message}</span><br>Was that a good fit for you? Say no for another rec, or yes to keep it."}
-        ai_message = next_ai_message(session, user_message, GROQ_API_KEY)
-        memory.update_session(preference.session_id, "followup_count", followup_count + 1)
-        return {"response": f"<span style='color:green'>{ai_message}</span>"}
+            remember_song(session, song['song'], song['artist'])
+            reply = await chat_reply(song, fake_session, timer, mode,
+                                     "<br>Was that a good fit for you? Say no for another rec, or yes to keep it.")
+            session["followup_count"] = 0
+            session["awaiting_feedback"] = True
+            return reply
+        reply = await followup_reply(session, user_message, timer, mode)
+        session["followup_count"] = followup_count + 1
+        return reply
 
-@app.post("/command")
-def handle_command(command_input: CommandInput):
+# Turns mutate the session dict they are given; the endpoints load it once and
+# save it back once, so stores that hand out copies see every change. Turns of
+# one session run one at a time (memory.locked)
+@app.post("/recommend")
+async def recommend(preference: PreferenceInput, request: Request):
+    timer = StageTimer("recommend", LATENCY_BUDGET_SECONDS)
+    async with memory.locked(preference.session_id):
+        session = memory.get_session(preference.session_id)
+        reply = await recommend_turn(preference, session, timer, reply_mode(preference.template_first))
+        save_turn(preference.session_id, session, reply)
+    return with_timings(reply, timer, request, "recommend")
+
+@app.post("/recommend/stream")
+async def recommend_stream(preference: PreferenceInput, request: Request):
+    timer = StageTimer("recommend", LATENCY_BUDGET_SECONDS)
+    async with memory.locked(preference.session_id):
+        session = memory.get_session(preference.session_id)
+        reply = await recommend_turn(preference, session, timer, "stream")
+        save_turn(preference.session_id, session, reply)
+    return stream_reply(reply, timer, request, "recommend")
+
+async def command_turn(command_input: CommandInput, session: dict, timer: StageTimer, mode: str) -> dict:
     cmd = command_input.command.lower()
-    session_id = command_input.session_id
-    session = memory.get_session(session_id)
 
     # --- 1. PRIORITY: Change preferences if asked ---
     for pref in ["genre", "mood", "tempo", "artist"]:
         if f"change {pref}" in cmd or f"switch {pref}" in cmd or f"new {pref}" in cmd or (pref in cmd and "change" in cmd):
             # Clear the current preference and ask for new value
             field = "artist_or_song" if pref == "artist" else pref
-            memory.update_session(session_id, field, None)
-            memory.update_session(session_id, f"no_pref_{field}", False)  # allow user to re-specify
-            memory.update_session(session_id, "awaiting_feedback", False)
+            session[field] = None
+            session[f"no_pref_{field}"] = False  # allow user to re-specify
+            session["awaiting_feedback"] = False
             return {
                 "response": f"<span style='color:green'>Sure! What {pref} would you like instead?</span>"
             }
 
     # --- 2. Reset session if asked ---
     if any(word in cmd for word in ["start over", "restart", "reset"]):
-        memory.reset_session(session_id)
-        session = memory.get_session(session_id)
+        session.reset()
         return {
             "response": (
                 "🔁 <span style='color:green'>Alright! Let’s start fresh. How are you feeling right now?</span>"
@@ -134,31 +407,33 @@ def handle_command(command_input: CommandInput):
     # --- 3. Recommend another song if user asks ---
     if any(word in cmd for word in ["another", "again", "next one"]):
         session["history"] = [(session.get("last_song"), session.get("last_artist"))]
-        song = recommend_engine(session)
+        with timer.stage("recommend"):
+            song, message = await next_song(command_input.session_id, session, timer)
         if not song or song['song'] == "N/A":
             return {"response": "<span style='color:green'>I couldn’t find another one. Want to change mood, genre, artist, or tempo?</span>"}
-        memory.update_last_song(session_id, song['song'], song['artist'])
-        gpt_message = generate_chat_response(song, session, GROQ_API_KEY)
-        memory.update_session(session_id, "awaiting_feedback", True)
-        return {"response": f"<span style='color:green'>{gpt_message}</span><br>Was that a good fit for you?"}
+        remember_song(session, song['song'], song['artist'])
+        reply = await chat_reply(song, session, timer, mode, "<br>Was that a good fit for you?", message)
+        session["awaiting_feedback"] = True
+        return reply
 
     # --- 4. Handle feedback after recommendation ---
     if session.get("awaiting_feedback"):
         # If "no", keep recommending
         if any(word in cmd for word in ["no", "didn't", "not really", "did not", "nah", "not a good fit", "not fit", "try again"]):
             session["history"].append((session.get("last_song"), session.get("last_artist")))
-            song = recommend_engine(session)
+            with timer.stage("recommend"):
+                song, message = await next_song(command_input.session_id, session, timer)
             if not song or song['song'] == "N/A":
                 return {
                     "response": "<span style='color:green'>I couldn’t find another one. Want to change mood, genre, artist, or tempo?</span>"
                 }
-            memory.update_last_song(session_id, song['song'], song['artist'])
-            gpt_message = generate_chat_response(song, session, GROQ_API_KEY)
-            memory.update_session(session_id, "awaiting_feedback", True)
-            return {"response": f"<span style='color:green'>{gpt_message}</span><br>Was that a good fit for you?"}
+            remember_song(session, song['song'], song['artist'])
+            reply = await chat_reply(song, session, timer, mode, "<br>Was that a good fit for you?", message)
+            session["awaiting_feedback"] = True
+            return reply
         # If "yes", close feedback loop
         if any(word in cmd for word in ["yes", "love", "liked", "good", "great", "perfect", "awesome", "sure"]):
-            memory.update_session(session_id, "awaiting_feedback", False)
+            session["awaiting_feedback"] = False
             return {
                 "response": (
                     "😊 <span style='color:green'>Great! If you want to hear something different, just reset the chat.</span>"
@@ -176,26 +451,119 @@ def handle_command(command_input: CommandInput):
     # --- 6. Generic help ---
     return {"response": "<span style='color:green'>You can say 'another one', 'change genre', 'change artist', 'change mood', 'change tempo', or 'reset' to start over.</span>"}
 
+@app.post("/command")
+async def handle_command(command_input: CommandInput, request: Request):
+    timer = StageTimer("command", LATENCY_BUDGET_SECONDS)
+    async with memory.locked(command_input.session_id):
+        session = memory.get_session(command_input.session_id)
+        reply = await command_turn(command_input, session, timer, reply_mode(command_input.template_first))
+        save_turn(command_input.session_id, session, reply)
+    return with_timings(reply, timer, request, "command")
+
+@app.post("/command/stream")
+async def handle_command_stream(command_input: CommandInput, request: Request):
+    timer = StageTimer("command", LATENCY_BUDGET_SECONDS)
+    async with memory.locked(command_input.session_id):
+        session = memory.get_session(command_input.session_id)
+        reply = await command_turn(command_input, session, timer, "stream")
+        save_turn(command_input.session_id, session, reply)
+    return stream_reply(reply, timer, request, "command")
+
 @app.post("/reset")
-def reset_session(command_input: CommandInput):
+async def reset_session(command_input: CommandInput):
     session_id = command_input.session_id
-    memory.reset_session(session_id)
-    session = memory.get_session(session_id)
+    prefetches.discard(session_id)
+    async with memory.locked(session_id):
+        memory.reset_session(session_id)
     return {
         "response": (
             "🔄 <span style='color:green'>Preferences reset! Tell me how you’re feeling or what type of music you want to hear.</span>"
         )
     }
 
+@app.post("/recommend/batch")
+async def recommend_batch_endpoint(batch: BatchInput):
+    # `count` distinct songs per preference set and one LLM summary for the whole batch.
+    # Sets with a session_id skip that session's history and add their picks to it, like /recommend
+    async with memory.locked(*(item.session_id for item in batch.requests if item.session_id)):
+        sessions, preference_sets = {}, []
+        for item in batch.requests:
+            prefs = item.model_dump(exclude={"session_id"})
+            if item.session_id:
+                session = sessions.get(item.session_id) or memory.get_session(item.session_id)
+                sessions[item.session_id] = session
+                prefs["history"] = session["history"]
+            else:
+                prefs["history"] = []
+            preference_sets.append(prefs)
+
+        playlists = await run_in_threadpool(recommend_batch, preference_sets, batch.count, batch.max_per_artist)
+
+        for session_id, session in sessions.items():
+            songs = [song for item, songs in zip(batch.requests, playlists) if item.session_id == session_id for song in songs]
+            if songs:
+                session["last_song"], session["last_artist"] = songs[-1]["song"], songs[-1]["artist"]
+            memory.save_session(session_id, session)
+
+    response = {"results": [{"session_id": item.session_id, "songs": songs}
+                            for item, songs in zip(batch.requests, playlists)]}
+    if batch.summarize:
+        all_songs = [song for songs in playlists for song in songs]
+        summary_prefs = preference_sets[0] if len(preference_sets) == 1 else {}
+        response["response"] = await agenerate_playlist_summary(all_songs, summary_prefs, GROQ_API_KEY)
+    return response
+
+@app.post("/similar")
+def similar(query: SimilarInput):
+    # "More like this": nearest tracks to a seed, skipping what this session already heard
+    if not query.track_id and not query.song:
+        return JSONResponse(status_code=400, content={"message": "Provide a track_id or a song name."})
+    history = ()
+    if query.session_id and query.exclude_history:
+        history = memory.get_session(query.session_id, create=False)["history"]
+    result = similar_songs(track_id=query.track_id, song=query.song, k=query.k, history=history)
+    if result is None:
+        return JSONResponse(status_code=404, content={"message": "No matching seed track found."})
+    return result
+
+@app.get("/polish/{polish_id}")
+async def get_polished(polish_id: str):
+    # Follow-up for template-first replies: the LLM-polished message, once ready
+    return {"response": await polish_store.wait(polish_id, POLISH_WAIT_SECONDS)}
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/profile/{profile_id}")
+def get_profile(profile_id: str):
+    profile = profiles.get(profile_id)
+    if profile is None:
+        return JSONResponse(status_code=404, content={"message": "Unknown or expired profile id."})
+    return profile
+
 @app.get("/session/{session_id}")
 def get_session(session_id: str):
-    return memory.get_session(session_id)
+    # Read-only: looking up an unknown id no longer creates a session for it
+    return memory.get_session(session_id, create=False).to_dict()
+
+@app.get("/stats")
+def get_stats():
+    return {"sessions": memory.stats(), "extraction_cache": extraction_cache.stats(),
+            "ranking_cache": ranking_cache.stats(), "prefetch": prefetches.stats(), "extraction": extraction_stats,
+            "llm": llm.stats()}
+
+@app.exception_handler(SessionConflict)
+async def session_conflict_handler(request, exc):
+    # Another worker saved this session mid-turn; nothing of this turn was kept
+    return JSONResponse(
+        status_code=409,
+        content={"response": "<span style='color:green'>Still working on your last message. Please send that again.</span>"},
+    )
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
-    import traceback
-    error_details = traceback.format_exc()
-    print(f"Unhandled exception: {exc}\nDetails:\n{error_details}")
+    logging.error("Unhandled exception: %s", exc, exc_info=exc)
     return JSONResponse(
         status_code=500,
         content={"message": "An unexpected error occurred. Please try again later."},
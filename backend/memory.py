@@ -1,54 +1,387 @@
-class SessionMemory:
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import AsyncExitStack, asynccontextmanager
+
+
+class History:
+    """Songs already recommended in a session: an insertion-ordered set of
+    (song, artist) pairs with the list-style append and `in` the engine uses."""
+
+    __slots__ = ("_pairs",)
+
+    def __init__(self, pairs=()):
+        self._pairs = dict.fromkeys(tuple(pair) for pair in pairs)
+
+    def append(self, pair):
+        self._pairs[tuple(pair)] = None
+
+    def keep_last(self, n: int):
+        if len(self._pairs) > n:
+            self._pairs = dict.fromkeys(list(self._pairs)[len(self._pairs) - n:])
+
+    def __contains__(self, pair) -> bool:
+        return tuple(pair) in self._pairs
+
+    def __iter__(self):
+        return iter(self._pairs)
+
+    def __len__(self) -> int:
+        return len(self._pairs)
+
+    def __repr__(self) -> str:
+        return f"History({list(self._pairs)!r})"
+
+
+SESSION_DEFAULTS = {
+    "genre": None,
+    "mood": None,
+    "tempo": None,
+    "artist_or_song": None,
+    "last_song": None,
+    "last_artist": None,
+    "history": None,  # a fresh History per session
+    # --- New: sticky "no preference" flags ---
+    "no_pref_genre": False,
+    "no_pref_mood": False,
+    "no_pref_tempo": False,
+    "no_pref_artist": False,
+    "followup_count": 0,
+    "awaiting_feedback": False,
+}
+
+
+class SessionRecord(MutableMapping):
+    """One session's state in fixed slots, read and written through the old dict keys;
+    unknown keys go to a small overflow dict."""
+
+    __slots__ = tuple(SESSION_DEFAULTS) + ("_extra", "version")
+
+    def __init__(self, values: dict = None, version: int = 0):
+        # Store revision this record was loaded at; 0 for a session never saved
+        self.version = version
+        self.reset()
+        if values:
+            self.update(values)
+
+    @classmethod
+    def from_dict(cls, values: dict, version: int = 0) -> "SessionRecord":
+        return cls(values, version)
+
+    def reset(self):
+        for key, value in SESSION_DEFAULTS.items():
+            setattr(self, key, value)
+        self.history = History()
+        self._extra = None
+
+    clear = reset
+
+    def to_dict(self) -> dict:
+        values = {key: getattr(self, key) for key in SESSION_DEFAULTS}
+        values["history"] = list(self.history)
+        if self._extra:
+            values.update(self._extra)
+        return values
+
+    def __getitem__(self, key: str):
+        if key in SESSION_DEFAULTS:
+            return getattr(self, key)
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value):
+        if key not in SESSION_DEFAULTS:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+            return
+        if key == "history" and not isinstance(value, History):
+            value = History(value or ())
+        setattr(self, key, value)
+
+    def __delitem__(self, key: str):
+        if key in SESSION_DEFAULTS:
+            self[key] = SESSION_DEFAULTS[key]
+        elif self._extra and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        yield from SESSION_DEFAULTS
+        if self._extra:
+            yield from list(self._extra)
+
+    def __len__(self) -> int:
+        return len(SESSION_DEFAULTS) + len(self._extra or ())
+
+    def __repr__(self) -> str:
+        return f"SessionRecord({self.to_dict()!r})"
+
+
+def new_session() -> SessionRecord:
+    return SessionRecord()
+
+
+def remember_song(session: dict, song: str, artist: str):
+    session["last_song"] = song
+    session["last_artist"] = artist
+    session["history"].append((song, artist))
+
+
+class SessionConflict(Exception):
+    """The session was saved by another request since this one loaded it."""
+
+    def __init__(self, session_id: str):
+        super().__init__(f"Session {session_id} changed while this request was handled")
+        self.session_id = session_id
+
+
+class InMemorySessionStore:
+    """Live session records in this process, least recently saved first."""
+
     def __init__(self):
-        self.sessions = {}
-
-    def get_session(self, session_id: str) -> dict:
-        if session_id not in self.sessions:
-            self.sessions[session_id] = {
-                "genre": None,
-                "mood": None,
-                "tempo": None,
-                "artist_or_song": None,
-                "last_song": None,
-                "last_artist": None,
-                "history": [],
-                # --- New: sticky "no preference" flags ---
-                "no_pref_genre": False,
-                "no_pref_mood": False,
-                "no_pref_tempo": False,
-                "no_pref_artist": False,
-                "followup_count": 0,
-                "awaiting_feedback": False,
-            }
-        return self.sessions[session_id]
+        self._sessions = OrderedDict()  # session_id -> (touched_at, session)
+
+    def load(self, session_id: str):
+        return self._sessions.get(session_id)
+
+    def save(self, session_id: str, session: SessionRecord, now: float):
+        self._sessions[session_id] = (now, session)
+        self._sessions.move_to_end(session_id)
+
+    def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def expire(self, cutoff: float) -> int:
+        expired = 0
+        while self._sessions:
+            _, (touched_at, _) = next(iter(self._sessions.items()))
+            if touched_at >= cutoff:
+                break
+            self._sessions.popitem(last=False)
+            expired += 1
+        return expired
+
+    def trim(self, max_sessions: int) -> int:
+        evicted = 0
+        while len(self._sessions) > max_sessions:
+            self._sessions.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """Sessions as JSON rows in a SQLite file, shared by every worker on the host.
+    Saves are versioned: a stale one raises SessionConflict."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self.reopen()
+
+    def reopen(self):
+        # A connection must not cross fork(); serve.py closes it before forking and reopens per worker
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, touched_at REAL NOT NULL, "
+            "version INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(sessions)")]
+        if "version" not in columns:
+            self._db.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched_at)")
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def load(self, session_id: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT touched_at, data, version FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], SessionRecord.from_dict(json.loads(row[1]), row[2])
+
+    def save(self, session_id: str, session: SessionRecord, now: float):
+        data = json.dumps(session.to_dict())
+        with self._lock:
+            updated = self._db.execute(
+                "UPDATE sessions SET data = ?, touched_at = ?, version = version + 1 WHERE id = ? AND version = ?",
+                (data, now, session_id, session.version),
+            ).rowcount
+            if not updated:
+                # New, expired or deleted meanwhile: insert, unless another worker got there first
+                try:
+                    self._db.execute(
+                        "INSERT INTO sessions (id, data, touched_at, version) VALUES (?, ?, ?, ?)",
+                        (session_id, data, now, session.version + 1),
+                    )
+                except sqlite3.IntegrityError:
+                    self._db.rollback()
+                    raise SessionConflict(session_id) from None
+            self._db.commit()
+        session.version += 1
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._db.commit()
+
+    def expire(self, cutoff: float) -> int:
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM sessions WHERE touched_at < ?", (cutoff,)).rowcount
+            self._db.commit()
+        return deleted
+
+    def trim(self, max_sessions: int) -> int:
+        with self._lock:
+            deleted = self._db.execute(
+                "DELETE FROM sessions WHERE id IN "
+                "(SELECT id FROM sessions ORDER BY touched_at DESC LIMIT -1 OFFSET ?)",
+                (max_sessions,),
+            ).rowcount
+            self._db.commit()
+        return deleted
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class SessionMemory:
+    """Per-session conversation state, bounded by ttl, max_sessions and max_history.
+    Callers save back the record get_session returns; locked() serializes one session's turns."""
+
+    def __init__(self, store=None, ttl: float = 6 * 3600, max_sessions: int = 10000,
+                 max_history: int = 200, sweep_interval: float = 1.0):
+        self.store = store if store is not None else InMemorySessionStore()
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_history = max_history
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.conflicts = 0
+        self._locks = {}  # session_id -> [asyncio.Lock, holders and waiters]
+
+    @classmethod
+    def from_env(cls) -> "SessionMemory":
+        backend = os.getenv("MOODIFY_SESSION_BACKEND", "memory")
+        if backend == "sqlite":
+            store = SQLiteSessionStore(os.getenv("MOODIFY_SESSION_PATH", "sessions.db"))
+        elif backend == "memory":
+            store = InMemorySessionStore()
+        else:
+            raise ValueError(f"Unknown MOODIFY_SESSION_BACKEND: {backend}")
+        return cls(
+            store=store,
+            ttl=float(os.getenv("MOODIFY_SESSION_TTL", str(6 * 3600))),
+            max_sessions=int(os.getenv("MOODIFY_MAX_SESSIONS", "10000")),
+            max_history=int(os.getenv("MOODIFY_SESSION_HISTORY", "200")),
+        )
+
+    def get_session(self, session_id: str, create: bool = True) -> SessionRecord:
+        # Unknown or expired ids get a fresh session; create=False leaves the store untouched
+        now = time.time()
+        entry = self.store.load(session_id)
+        if entry is not None:
+            touched_at, session = entry
+            if now - touched_at <= self.ttl:
+                self.hits += 1
+                return session
+            self.store.delete(session_id)
+            self.expirations += 1
+        self.misses += 1
+        session = new_session()
+        if create:
+            try:
+                self.save_session(session_id, session)
+            except SessionConflict:
+                # Created by another worker just now
+                return self.get_session(session_id, create=False)
+        return session
+
+    def save_session(self, session_id: str, session: SessionRecord):
+        session["history"].keep_last(self.max_history)
+        now = time.time()
+        try:
+            self.store.save(session_id, session, now)
+        except SessionConflict:
+            self.conflicts += 1
+            raise
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            self.expirations += self.store.expire(now - self.ttl)
+            self.evictions += self.store.trim(self.max_sessions)
 
     def update_session(self, session_id: str, key: str, value):
-        if session_id not in self.sessions:
-            self.get_session(session_id)
-        self.sessions[session_id][key] = value
+        session = self.get_session(session_id)
+        session[key] = value
+        self.save_session(session_id, session)
 
     def update_last_song(self, session_id: str, song: str, artist: str):
-        if session_id not in self.sessions:
-            self.get_session(session_id)
-        self.sessions[session_id]["last_song"] = song
-        self.sessions[session_id]["last_artist"] = artist
-        if (song, artist) not in self.sessions[session_id]["history"]:
-            self.sessions[session_id]["history"].append((song, artist))
-
-    def reset_session(self, session_id: str):
-        self.sessions[session_id] = {
-            "genre": None,
-            "mood": None,
-            "tempo": None,
-            "artist_or_song": None,
-            "last_song": None,
-            "last_artist": None,
-            "history": [],
-            # --- Reset all sticky "no preference" flags ---
-            "no_pref_genre": False,
-            "no_pref_mood": False,
-            "no_pref_tempo": False,
-            "no_pref_artist": False,
-            "followup_count": 0,
-            "awaiting_feedback": False,
+        session = self.get_session(session_id)
+        remember_song(session, song, artist)
+        self.save_session(session_id, session)
+
+    def reset_session(self, session_id: str) -> SessionRecord:
+        # Replaces whatever is stored at its current version, so a turn still running elsewhere fails to save
+        while True:
+            entry = self.store.load(session_id)
+            session = SessionRecord(version=entry[1].version if entry else 0)
+            try:
+                self.save_session(session_id, session)
+                return session
+            except SessionConflict:
+                continue
+
+    @asynccontextmanager
+    async def locked(self, *session_ids: str):
+        """Hold the given sessions for one request; other requests for them wait (this process only)."""
+        async with AsyncExitStack() as stack:
+            # Sorted, so requests holding several sessions cannot deadlock
+            for session_id in sorted(set(session_ids)):
+                entry = self._locks.setdefault(session_id, [asyncio.Lock(), 0])
+                entry[1] += 1
+                stack.callback(self._unlock, session_id, entry)
+                await stack.enter_async_context(entry[0])
+            yield
+
+    def _unlock(self, session_id: str, entry: list):
+        entry[1] -= 1
+        if not entry[1]:
+            del self._locks[session_id]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.store).__name__,
+            "sessions": len(self.store),
+            "max_sessions": self.max_sessions,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "conflicts": self.conflicts,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
         }
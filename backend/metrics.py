@@ -0,0 +1,148 @@
+"""Process-local counters and histograms, rendered in the Prometheus text format by GET /metrics."""
+import threading
+from bisect import bisect_left
+
+# Seconds; request and stage latencies from sub-millisecond engine work to slow LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 1000000)
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with REGISTRY.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        i = bisect_left(self.buckets, value)
+        with REGISTRY.lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def _bucket(self, key: tuple, le: str, value: int) -> str:
+        bound = 'le="%s"' % le
+        return f"{self.name}_bucket{_labels(self.labelnames, key, bound)} {value}"
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(self._bucket(key, _number(bound), cumulative))
+            lines.append(self._bucket(key, "+Inf", series[-1]))
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self.lock:
+            lines = [line for metric in self.metrics for line in metric.render()]
+        for collector in self.collectors:
+            for name, help, samples in collector():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+                for labels, value in samples:
+                    names, values = tuple(labels), tuple(labels.values())
+                    lines.append(f"{name}{_labels(names, values)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labelnames: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def histogram(name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def collect(fn):
+    """Register fn() -> [(name, help, [(labels dict, value), ...])] as scrape-time gauges."""
+    REGISTRY.collectors.append(fn)
+    return fn
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+REQUEST_SECONDS = histogram("moodify_request_seconds", "HTTP request latency until the response body is sent",
+                            ("route", "method", "status"))
+STAGE_SECONDS = histogram("moodify_stage_seconds", "Time per request stage", ("route", "stage"))
+ENGINE_PASSES = counter("moodify_engine_relaxation_pass_total",
+                        "recommend_engine candidate pass used: tempo+genre, genre, unfiltered or fallback",
+                        ("relaxation",))
+ENGINE_CANDIDATES = histogram("moodify_engine_candidates", "Candidates scored per recommend_engine call",
+                              buckets=COUNT_BUCKETS)
+SPECULATIONS = counter("moodify_speculation_total", "Speculative recommend_engine runs by outcome", ("outcome",))
+PREFETCHES = counter("moodify_prefetch_total",
+                     "Background next-song computations by outcome: started, skipped, hit, miss, cancelled, expired, failed",
+                     ("outcome",))
+EXTRACTIONS = counter("moodify_extractions_total", "Preference extractions by source", ("source",))
+LLM_SECONDS = histogram("moodify_llm_request_seconds", "Groq call latency, retries included", ("kind", "outcome"))
+LLM_REQUESTS = counter("moodify_llm_requests_total",
+                       "Groq requests by admission outcome: sent, coalesced (joined an identical in-flight call), "
+                       "rejected_queue_full, rejected_timeout, rejected_deadline (latency budget spent) or "
+                       "rejected_breaker_open", ("kind", "outcome"))
+LLM_QUEUE_SECONDS = histogram("moodify_llm_queue_seconds",
+                              "Wait for a concurrency slot and rate token before a Groq call", ("kind",))
+LLM_RETRIES = counter("moodify_llm_retries_total", "Groq attempts retried", ("kind",))
+LLM_TOKENS = counter("moodify_llm_tokens_total",
+                     "Groq tokens from the usage field; streamed replies count one per chunk", ("kind", "type"))
@@ -0,0 +1,223 @@
+import asyncio
+import contextvars
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from metrics import PREFETCHES, SPECULATIONS, STAGE_SECONDS
+
+# The StageTimer of the request being handled; run_in_threadpool carries it into the engine
+current_timer = contextvars.ContextVar("current_timer", default=None)
+
+
+class StageTimer:
+    """Wall-clock milliseconds per named stage of one request. The current timer is reachable
+    through stage(), note(), count() and, with a budget, remaining_budget()."""
+
+    def __init__(self, route: str = None, budget: float = None):
+        self._started = time.perf_counter()
+        self.route = route
+        self.deadline = self._started + budget if budget and budget > 0 else None
+        self.stages = {}
+        self.notes = {}
+        current_timer.set(self)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def as_dict(self) -> dict:
+        timings = {name: round(ms, 2) for name, ms in self.stages.items()}
+        timings["total"] = round((time.perf_counter() - self._started) * 1000, 2)
+        timings.update(self.notes)
+        return timings
+
+    def record(self):
+        # Stage histograms for /metrics, once per request
+        for name, ms in list(self.stages.items()):
+            STAGE_SECONDS.observe(ms / 1000, route=self.route, stage=name)
+
+
+@contextmanager
+def stage(name: str):
+    timer = current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def note(key: str, value):
+    timer = current_timer.get()
+    if timer is not None:
+        timer.notes[key] = value
+
+
+def count(key: str, amount: float = 1):
+    timer = current_timer.get()
+    if timer is not None:
+        timer.notes[key] = timer.notes.get(key, 0) + amount
+
+
+def remaining_budget():
+    """Seconds left before the current request's deadline (negative once past), or None without one."""
+    timer = current_timer.get()
+    if timer is None or timer.deadline is None:
+        return None
+    return timer.deadline - time.perf_counter()
+
+
+class PolishStore:
+    """LLM-polished chat messages finishing after a template-first response:
+    submit() returns an id at once, wait() hands over the HTML."""
+
+    def __init__(self, max_items: int = 1024, ttl: float = 300.0):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._tasks = OrderedDict()  # polish_id -> (created_at, task, template)
+
+    def submit(self, coro, template: str = "{}") -> str:
+        self._prune()
+        polish_id = uuid.uuid4().hex
+        task = asyncio.create_task(coro)
+        self._tasks[polish_id] = (time.monotonic(), task, template)
+        return polish_id
+
+    async def wait(self, polish_id: str, timeout: float):
+        entry = self._tasks.get(polish_id)
+        if entry is None:
+            return None
+        try:
+            return entry[2].format(await asyncio.wait_for(asyncio.shield(entry[1]), timeout))
+        except asyncio.TimeoutError:
+            return None
+        except Exception as e:
+            logging.warning("Polish %s failed: %s", polish_id, e)
+            return None
+
+    def _prune(self):
+        now = time.monotonic()
+        while self._tasks:
+            polish_id, (created_at, task, _) = next(iter(self._tasks.items()))
+            if len(self._tasks) < self.max_items and now - created_at < self.ttl:
+                break
+            del self._tasks[polish_id]
+            task.cancel()
+
+    def cancel(self, polish_id: str):
+        entry = self._tasks.pop(polish_id, None)
+        if entry is not None:
+            entry[1].cancel()
+
+
+class Speculation:
+    """recommend_engine run on a guessed copy of the session, adopted only if the
+    extracted preferences equal the guess."""
+
+    KEYS = ("genre", "mood", "tempo", "artist_or_song")
+
+    def __init__(self, prefs: dict, run):
+        self.prefs = prefs
+        self.snapshot = {k: prefs.get(k) for k in self.KEYS}
+        # Detached from the request timer: a discarded guess should not show up in its stages
+        context = contextvars.copy_context()
+        context.run(current_timer.set, None)
+        self.task = context.run(asyncio.create_task, run(prefs))
+
+    def matches(self, session: dict) -> bool:
+        return all(session.get(k) == v for k, v in self.snapshot.items())
+
+    async def take(self, session: dict):
+        if self.matches(session):
+            SPECULATIONS.inc(outcome="hit")
+            return await self.task
+        self.discard("miss")
+        return None
+
+    def discard(self, outcome: str = "unused"):
+        SPECULATIONS.inc(outcome=outcome)
+        self.task.cancel()
+
+
+class PrefetchStore:
+    """Each session's next recommendation, computed in the background after a song is served
+    and handed to a follow-up with the same engine state. Per process, at most max_running at once."""
+
+    def __init__(self, max_running: int = 2, max_items: int = 1024, ttl: float = 600.0):
+        self.max_running = max_running
+        self.max_items = max_items
+        self.ttl = ttl
+        self.running = 0
+        self._entries = OrderedDict()  # session_id -> (created_at, fingerprints, task)
+
+    @staticmethod
+    def fingerprint(state: dict) -> tuple:
+        # What recommend_engine reads; history order does not change its pick
+        history = frozenset(tuple(pair) for pair in state.get("history") or ())
+        return tuple(state.get(k) for k in Speculation.KEYS) + (history,)
+
+    def start(self, session_id: str, states: list, run) -> bool:
+        fingerprints = [self.fingerprint(state) for state in states]
+        entry = self._entries.get(session_id)
+        if entry is not None and entry[1] == fingerprints:
+            return False
+        self.discard(session_id)
+        self._prune()
+        if self.running >= self.max_running:
+            PREFETCHES.inc(outcome="skipped")
+            return False
+        context = contextvars.copy_context()
+        context.run(current_timer.set, None)
+        task = context.run(asyncio.create_task, run(states))
+        self.running += 1
+        task.add_done_callback(self._finished)
+        self._entries[session_id] = (time.monotonic(), fingerprints, task)
+        PREFETCHES.inc(outcome="started")
+        return True
+
+    def _finished(self, task):
+        self.running -= 1
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning("Prefetch failed: %s", task.exception())
+
+    async def take(self, session_id: str, state: dict):
+        """The prefetched result for state, waiting for it if still running; None if there is none."""
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return None
+        _, fingerprints, task = entry
+        fingerprint = self.fingerprint(state)
+        if fingerprint not in fingerprints:
+            task.cancel()
+            PREFETCHES.inc(outcome="miss")
+            return None
+        results = await asyncio.gather(task, return_exceptions=True)
+        if isinstance(results[0], BaseException):
+            PREFETCHES.inc(outcome="failed")
+            return None
+        PREFETCHES.inc(outcome="hit")
+        return results[0][fingerprints.index(fingerprint)]
+
+    def discard(self, session_id: str, outcome: str = "cancelled"):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            entry[2].cancel()
+            PREFETCHES.inc(outcome=outcome)
+
+    def _prune(self):
+        now = time.monotonic()
+        while self._entries:
+            session_id, (created_at, _, _) = next(iter(self._entries.items()))
+            if len(self._entries) < self.max_items and now - created_at < self.ttl:
+                break
+            self.discard(session_id, "expired")
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "running": self.running, "max_running": self.max_running}
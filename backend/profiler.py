@@ -0,0 +1,84 @@
+"""Opt-in sampling profiler (MOODIFY_PROFILING=1) for requests sent with `X-Moodify-Profile: 1`;
+collapsed stacks are served by GET /profile/{id}."""
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+# Innermost frames of threads that are only waiting (event loop select, idle pool workers)
+IDLE_FILES = ("selectors.py", "threading.py", "queue.py")
+IDLE_FUNCTIONS = {"_worker"}  # concurrent.futures pool threads blocked on their queue
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return code.co_filename.endswith(IDLE_FILES) or code.co_name in IDLE_FUNCTIONS
+
+
+def _collapse(frame, max_depth: int) -> str:
+    parts = []
+    while frame is not None and len(parts) < max_depth:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.002, max_depth: int = 48):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def start(self) -> "SamplingProfiler":
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="moodify-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or _is_idle(frame):
+                    continue
+                self.stacks[_collapse(frame, self.max_depth)] += 1
+                self.samples += 1
+
+    def stop(self, top: int = 30) -> dict:
+        self._stop.set()
+        self._thread.join()
+        functions = Counter()
+        for stack, n in self.stacks.items():
+            functions[stack.rsplit(";", 1)[-1]] += n
+        return {
+            "duration_ms": round((time.perf_counter() - self._started) * 1000, 2),
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "functions": [{"function": f, "samples": n} for f, n in functions.most_common(top)],
+            "stacks": [{"stack": s, "samples": n} for s, n in self.stacks.most_common(top)],
+        }
+
+
+class ProfileStore:
+    """The most recent request profiles, by id."""
+
+    def __init__(self, max_items: int = 64):
+        self.max_items = max_items
+        self._profiles = OrderedDict()
+
+    def add(self, profile: dict, profile_id: str = None) -> str:
+        profile_id = profile_id or uuid.uuid4().hex
+        self._profiles[profile_id] = profile
+        while len(self._profiles) > self.max_items:
+            self._profiles.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id: str):
+        return self._profiles.get(profile_id)
@@ -0,0 +1,126 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Best candidates kept sorted per ranking; recommend_engine picks from them before touching the rest
+HEAD_SIZE = 256
+
+
+class Ranking:
+    """Scored candidates for one normalized preference set, read-only and shared.
+    head indexes the best HEAD_SIZE scores; resolved holds the preference rewrites made."""
+
+    def __init__(self, rows, scores, matched_by_name: bool, relaxation: str, resolved: dict):
+        self.rows = np.asarray(rows, dtype=np.int32 if len(rows) < 2 ** 31 else np.int64)
+        self.scores = np.asarray(scores, dtype=np.float64)
+        self.rows.flags.writeable = False
+        self.scores.flags.writeable = False
+        self.matched_by_name = matched_by_name
+        self.relaxation = relaxation
+        self.resolved = resolved
+        self.head = top_k(self.scores, HEAD_SIZE)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def best(self, played_rows: np.ndarray) -> int:
+        """Index into rows of the best unplayed candidate, or of the best overall once all are played."""
+        if not len(played_rows):
+            return int(self.head[0])
+        played = np.isin(self.rows[self.head], played_rows)
+        if not played.all():
+            return int(self.head[np.argmin(played)])
+        if len(self.head) == len(self.rows):
+            return int(self.head[0])
+        # History covers the whole head: rank the rest
+        unplayed = np.nonzero(~np.isin(self.rows, played_rows))[0]
+        if not len(unplayed):
+            return int(self.head[0])
+        return int(unplayed[top_k(self.scores[unplayed], 1)[0]])
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first; equal scores keep candidate order."""
+    n = len(scores)
+    if k >= n:
+        return np.lexsort((np.arange(n), -scores))
+    kth = np.partition(scores, n - k)[n - k]
+    above = np.nonzero(scores > kth)[0]
+    ties = np.nonzero(scores == kth)[0][:k - len(above)]
+    chosen = np.concatenate([above, ties])
+    return chosen[np.lexsort((chosen, -scores[chosen]))]
+
+
+class RankingCache:
+    """LRU of Rankings keyed by (catalog version, normalized preferences),
+    bounded by entries and total cached rows."""
+
+    def __init__(self, max_size: int = 512, max_rows: int = 4_000_000):
+        self.max_size = max_size
+        self.max_rows = max_rows
+        self.version = 0
+        self._entries = OrderedDict()  # key -> Ranking
+        self._rows = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls) -> "RankingCache":
+        return cls(
+            max_size=int(os.getenv("MOODIFY_RANKING_CACHE_SIZE", "512")),
+            max_rows=int(os.getenv("MOODIFY_RANKING_CACHE_ROWS", "4000000")),
+        )
+
+    def get(self, key: tuple):
+        with self._lock:
+            ranking = self._entries.get((self.version, key))
+            if ranking is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((self.version, key))
+            self.hits += 1
+            return ranking
+
+    def put(self, key: tuple, ranking: Ranking, version: int):
+        if self.max_size <= 0 or len(ranking) > self.max_rows:
+            return
+        with self._lock:
+            # Computed against a catalog that has since been replaced
+            if version != self.version:
+                return
+            old = self._entries.pop((version, key), None)
+            if old is not None:
+                self._rows -= len(old)
+            self._entries[(version, key)] = ranking
+            self._rows += len(ranking)
+            while len(self._entries) > self.max_size or self._rows > self.max_rows:
+                _, evicted = self._entries.popitem(last=False)
+                self._rows -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self.invalidations += 1
+            self._entries.clear()
+            self._rows = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "rows": self._rows,
+            "max_rows": self.max_rows,
+            "catalog_version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
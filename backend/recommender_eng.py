@@ -1,34 +1,29 @@
+import json
+import os
 import pandas as pd
 import numpy as np
 import random
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MinMaxScaler
 from utils import (
     convert_tempo_to_bpm,
     bpm_to_tempo_category,
-    fuzzy_match_artist_song,
     generate_chat_response,
     extract_preferences_from_message,
     map_free_text_to_mood,
     split_mode_category,
-    build_recommendation_key,
-    precompute_recommendation_map,
 )
+from catalog import Catalog, read_catalog_csv
+from metrics import ENGINE_CANDIDATES, ENGINE_PASSES
+from pipeline import note, stage
+from ranking_cache import Ranking, RankingCache, top_k
+from snapshot import default_snapshot_path, read_snapshot, write_snapshot
+from local_extractor import set_artist_detector
+from vocab import SAD_MOODS, HAPPY_MOODS, UPBEAT_WORDS, SLOW_WORDS
+
+DATA_PATH = os.getenv("MOODIFY_DATA_PATH", "data/songs.csv")
+SNAPSHOT_PATH = default_snapshot_path(DATA_PATH)
+USE_SNAPSHOT = os.getenv("MOODIFY_SNAPSHOT", "1") != "0"
 
-# Load and prepare dataset
-DATA_PATH = "data/songs.csv"
-df = pd.read_csv(DATA_PATH)
-
-# Save original tempo for reference
-df["tempo_raw"] = pd.to_numeric(df["tempo"], errors="coerce")
-
-# Normalize feature columns
 features = ['valence', 'energy', 'danceability', 'acousticness', 'tempo']
-df = df.dropna(subset=features)
-df[features] = df[features].apply(pd.to_numeric, errors='coerce')
-df = df.dropna(subset=features)
-scaler = MinMaxScaler()
-df[features] = scaler.fit_transform(df[features])
 
 # Mood vectors
 MOOD_VECTORS = {
@@ -38,13 +33,29 @@ MOOD_VECTORS = {
     "calm": [0.5, 0.4, 0.3, 0.7, 0.5]
 }
 
-recommendation_map = precompute_recommendation_map(df)
+def load_custom_moods(spec: str) -> dict:
+    # MOODIFY_MOOD_VECTORS: inline JSON or a path to a JSON file, e.g. {"dreamy": [0.6, 0.3, 0.4, 0.8, 0.3]}
+    if not spec:
+        return {}
+    if os.path.exists(spec):
+        with open(spec) as f:
+            spec = f.read()
+    moods = {}
+    for mood, vector in json.loads(spec).items():
+        if not isinstance(vector, list) or len(vector) != len(features):
+            raise ValueError(f"Mood vector for {mood!r} needs {len(features)} values ({', '.join(features)})")
+        moods[mood.strip().lower()] = [float(v) for v in vector]
+    return moods
+
+MOOD_VECTORS.update(load_custom_moods(os.getenv("MOODIFY_MOOD_VECTORS")))
+
+CSV_CHUNK_ROWS = int(os.getenv("MOODIFY_CSV_CHUNK_ROWS", "200000"))
+
+def load_songs(path: str) -> pd.DataFrame:
+    # Chunked, column-pruned load with categorical text and float32 features (catalog.read_catalog_csv)
+    return read_catalog_csv(path, features, CSV_CHUNK_ROWS)
 
 # --- Weighted recommendation logic ---
-SAD_MOODS = {"sad", "melancholy", "down", "emotional", "blue", "heartbreak", "gloomy"}
-HAPPY_MOODS = {"happy", "joy", "energetic", "upbeat", "party", "celebrate", "excited"}
-UPBEAT_WORDS = {"upbeat", "party", "dance", "energetic", "celebrate", "hyped", "intense"}
-SLOW_WORDS = {"slow", "ballad", "chill", "calm"}
 
 def normalize(val):
     if isinstance(val, str):
@@ -117,91 +128,240 @@ def weighted_score(row, prefs):
 
     return score
 
-def recommend_engine(preferences: dict):
-    def apply_filters(preferences, filter_tempo=True, filter_genre=True, exclude_artist=None):
-        local_df = df.copy()
-        if preferences.get("mood") and preferences["mood"] not in MOOD_VECTORS:
-            preferences["mood"] = map_free_text_to_mood(preferences["mood"])
-
-        if preferences.get("artist_or_song"):
-            local_df = fuzzy_match_artist_song(local_df, preferences["artist_or_song"])
-
-        if filter_genre and preferences.get("genre"):
-            local_df = local_df[local_df['playlist_genre'].str.lower() == preferences["genre"].lower()]
-
-        if filter_tempo and preferences.get("tempo"):
-            bpm_range = convert_tempo_to_bpm(preferences["tempo"])
-            local_df = local_df[(local_df['tempo_raw'] >= bpm_range[0]) & (local_df['tempo_raw'] <= bpm_range[1])]
-
-        if preferences.get("mood") in MOOD_VECTORS and not local_df.empty:
-            mood_vec = np.array(MOOD_VECTORS[preferences["mood"]]).reshape(1, -1)
-            similarities = cosine_similarity(mood_vec, local_df[features].values).flatten()
-            local_df["similarity"] = similarities
-            local_df = local_df.sort_values(by="similarity", ascending=False)
-
-        if exclude_artist:
-            local_df = local_df[local_df["track_artist"].str.lower() != exclude_artist.lower()]
-
-        return local_df
-
-    # Detect similarity intent
-    exclude_artist = None
+def _normalized_column(df: pd.DataFrame, col: str) -> pd.Series:
+    if col not in df.columns:
+        return pd.Series("", index=df.index)
+    values = df[col]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Normalized once per distinct value; missing and non-string values become ""
+        categories = pd.Series(values.cat.categories)
+        table = categories.where(categories.map(lambda v: isinstance(v, str)), "").astype(str).str.strip().str.lower()
+        table = np.append(table.to_numpy(dtype=object), "")
+        return pd.Series(table[values.cat.codes.to_numpy()], index=df.index, dtype=object)
+    return values.where(values.map(lambda v: isinstance(v, str)), "").astype(str).str.strip().str.lower()
+
+class VectorizedScorer:
+    """weighted_score over whole candidate sets, from per-row codes and flags built at load."""
+
+    def __init__(self, df: pd.DataFrame):
+        mood = _normalized_column(df, "mode_category")
+        if "mood" in df.columns:
+            mood = mood.where(mood != "", _normalized_column(df, "mood"))
+        self.mood_codes, self.mood_table = self._codes(mood)
+        self.genre_codes, self.genre_table = self._codes(_normalized_column(df, "playlist_genre"))
+        self.tempo_codes, self.tempo_table = self._codes(_normalized_column(df, "tempo_category"))
+        self.artist_codes, self.artist_table = self._codes(_normalized_column(df, "track_artist"))
+        self.name_codes, self.name_table = self._codes(_normalized_column(df, "track_name"))
+
+        self.mood_sad = self._flag(self.mood_codes, self.mood_table, SAD_MOODS)
+        self.mood_happy = self._flag(self.mood_codes, self.mood_table, HAPPY_MOODS)
+        self.mood_happy_or_upbeat = self._flag(self.mood_codes, self.mood_table, HAPPY_MOODS | UPBEAT_WORDS)
+        self.tempo_slow = self._flag(self.tempo_codes, self.tempo_table, SLOW_WORDS)
+        self.tempo_upbeat = self._flag(self.tempo_codes, self.tempo_table, UPBEAT_WORDS)
+
+        # Same column precedence as weighted_score; missing popularity adds nothing
+        pop_col = "track_popularity" if "track_popularity" in df.columns else "popularity"
+        if pop_col in df.columns:
+            pop = pd.to_numeric(df[pop_col], errors="coerce").to_numpy(dtype=np.float64) / 100.0
+            self.popularity = np.nan_to_num(pop, nan=0.0)
+        else:
+            self.popularity = np.zeros(len(df))
+
+    @staticmethod
+    def _codes(values: pd.Series) -> tuple:
+        codes, table = pd.factorize(values)
+        return codes.astype(np.int32), list(table)
+
+    @staticmethod
+    def _flag(codes: np.ndarray, table: list, words: set) -> np.ndarray:
+        per_value = np.array([any(w in v for w in words) for v in table], dtype=bool)
+        return per_value[codes]
+
+    @staticmethod
+    def _contains(codes: np.ndarray, table: list, term: str) -> np.ndarray:
+        # Substring test once per distinct value present in the candidates
+        present, inverse = np.unique(codes, return_inverse=True)
+        hits = np.array([term in table[c] for c in present], dtype=bool)
+        return hits[inverse.reshape(-1)]
+
+    def score(self, rows: np.ndarray, prefs: dict) -> np.ndarray:
+        score = np.zeros(len(rows), dtype=np.int64)
+        if len(rows) == 0:
+            return score.astype(np.float64)
+
+        if prefs.get("genre"):
+            pgenre = normalize(prefs["genre"])
+            if pgenre:
+                score += np.where(self._contains(self.genre_codes[rows], self.genre_table, pgenre), 8, 0)
+
+        sad_request = False
+        if prefs.get("mood"):
+            pmood = normalize(prefs["mood"])
+            sad_request = pmood in SAD_MOODS
+            hit = self._contains(self.mood_codes[rows], self.mood_table, pmood) if pmood else np.zeros(len(rows), dtype=bool)
+            if sad_request:
+                score += np.where(hit | self.mood_sad[rows], 8, np.where(self.mood_happy[rows], -10, 0))
+            else:
+                score += np.where(hit, 8, 0)
+
+        slow_request = False
+        if prefs.get("tempo"):
+            ptempo = normalize(prefs["tempo"])
+            slow_request = ptempo in SLOW_WORDS
+            hit = self._contains(self.tempo_codes[rows], self.tempo_table, ptempo) if ptempo else np.zeros(len(rows), dtype=bool)
+            if slow_request:
+                score += np.where(hit | self.tempo_slow[rows], 8, np.where(self.tempo_upbeat[rows], -5, 0))
+            else:
+                score += np.where(hit, 8, 0)
+
+        if prefs.get("artist_or_song"):
+            query = normalize(prefs["artist_or_song"])
+            if query:
+                matched = self._contains(self.artist_codes[rows], self.artist_table, query)
+                matched |= self._contains(self.name_codes[rows], self.name_table, query)
+                score += np.where(matched, 2, 0)
+
+        # Float steps in weighted_score's order so the sums round identically
+        total = score + self.popularity[rows]
+        if sad_request:
+            total -= np.where(self.mood_happy_or_upbeat[rows], 7, 0)
+        if slow_request:
+            total -= np.where(self.tempo_upbeat[rows], 3, 0)
+        return total
+
+# Settings baked into a snapshot; changing any of them rebuilds from the CSV
+SNAPSHOT_KEY = {"features": features, "moods": MOOD_VECTORS}
+
+def _load_catalog() -> tuple:
+    # A snapshot compiled from this exact CSV skips parsing and every index build
+    if USE_SNAPSHOT:
+        snapshot = read_snapshot(SNAPSHOT_PATH, DATA_PATH, SNAPSHOT_KEY)
+        if snapshot is not None:
+            df, objects = snapshot
+            return df, objects["catalog"], objects["scorer"]
+    df = load_songs(DATA_PATH)
+    return df, Catalog(df, features, MOOD_VECTORS), VectorizedScorer(df)
+
+df, catalog, scorer = _load_catalog()
+set_artist_detector(catalog.artist_detector)
+ranking_cache = RankingCache.from_env()
+
+def reload_catalog():
+    """Load the catalog again (CSV or snapshot) and drop every cached ranking."""
+    global df, catalog, scorer
+    df, catalog, scorer = _load_catalog()
+    set_artist_detector(catalog.artist_detector)
+    ranking_cache.invalidate()
+
+def compile_snapshot() -> dict:
+    return write_snapshot(SNAPSHOT_PATH, DATA_PATH, df, {"catalog": catalog, "scorer": scorer}, SNAPSHOT_KEY)
+
+def candidate_rows(preferences: dict, exclude_artist=None) -> tuple:
+    """Catalog positions for the first non-empty pass (tempo+genre, genre, none), in mood order.
+    Returns (positions, matched_by_name, relaxation); relaxation is None when every pass is empty."""
+    if preferences.get("mood") and preferences["mood"] not in MOOD_VECTORS:
+        preferences["mood"] = map_free_text_to_mood(preferences["mood"])
+
+    matched_by_name = bool(preferences.get("artist_or_song"))
+    if matched_by_name:
+        base = catalog.match_rows(preferences["artist_or_song"])
+    else:
+        base = catalog.all_rows()
+
+    genre_mask = catalog.genre_mask(preferences["genre"])[base] if preferences.get("genre") else None
+    tempo_mask = None
+    if preferences.get("tempo"):
+        tempo_mask = catalog.tempo_mask(convert_tempo_to_bpm(preferences["tempo"]))[base]
+    allowed = catalog.exclude_artist_mask(exclude_artist) if exclude_artist else None
+    keep = allowed[base] if allowed is not None else np.ones(len(base), dtype=bool)
+
+    passes = [("tempo+genre", True, True), ("genre", False, True), ("unfiltered", False, False)]
+    for relaxation, filter_tempo, filter_genre in passes:
+        mask = np.ones(len(base), dtype=bool)
+        if filter_genre and genre_mask is not None:
+            mask &= genre_mask
+        if filter_tempo and tempo_mask is not None:
+            mask &= tempo_mask
+        if not (mask & keep).any():
+            continue
+
+        rows = base[mask]
+        mood = preferences.get("mood")
+        if mood in catalog.moods:
+            if matched_by_name:
+                rows = catalog.moods.sort(mood, rows)
+            else:
+                # base is the whole catalog here, so the mask lines up with catalog positions
+                rows = catalog.moods.ordered(mood, mask)
+        if allowed is not None:
+            rows = rows[allowed[rows]]
+        return rows, matched_by_name, relaxation
+
+    return base[:0], matched_by_name, None
+
+SIMILARITY_REQUEST_KEYWORDS = [
+    "similar to", "like", "vibe like", "in the style of",
+    "another artist like", "by a similar artist", "reminiscent of", "same vibe as", "any artist"
+]
+
+def similarity_target(preferences: dict):
+    # "similar to X": recommend around artist X but never X itself
     if preferences.get("artist_or_song"):
         lowered = preferences["artist_or_song"].lower()
-        similarity_request_keywords = [
-            "similar to", "like", "vibe like", "in the style of",
-            "another artist like", "by a similar artist", "reminiscent of", "same vibe as", "any artist"
-        ]
-        if any(kw in lowered for kw in similarity_request_keywords):
-            for artist in df['track_artist'].dropna().unique():
-                if artist.lower() in lowered:
-                    exclude_artist = artist
-                    preferences["artist_or_song"] = artist
-                    break
-
-    filtered = apply_filters(preferences, filter_tempo=True, filter_genre=True, exclude_artist=exclude_artist)
-    if filtered.empty:
-        filtered = apply_filters(preferences, filter_tempo=False, filter_genre=True, exclude_artist=exclude_artist)
-    if filtered.empty:
-        filtered = apply_filters(preferences, filter_tempo=False, filter_genre=False, exclude_artist=exclude_artist)
-
-    history = preferences.get("history", [])
-    top = None
-
-    # --- Scoring logic ---
-    if not filtered.empty:
-        filtered = filtered.copy()
-        filtered["weighted_score"] = filtered.apply(lambda row: weighted_score(row, preferences), axis=1)
-        filtered = filtered.sort_values(by="weighted_score", ascending=False)
-        # Pick first not in history
-        for _, row in filtered.iterrows():
-            if (row["track_name"], row["track_artist"]) not in history:
-                top = row
-                history.append((row["track_name"], row["track_artist"]))
-                break
-        if top is None and not filtered.empty:
-            top = filtered.iloc[0]
-            history.append((top["track_name"], top["track_artist"]))
+        if any(kw in lowered for kw in SIMILARITY_REQUEST_KEYWORDS):
+            artist = catalog.artist_detector.find_longest(lowered)
+            if artist is not None:
+                preferences["artist_or_song"] = artist
+                return artist
+    return None
+
+def ranking_key(preferences: dict) -> tuple:
+    # Everything candidate_rows and the scorer read; genre, tempo and name matching ignore case
+    mood = preferences.get("mood") or None
+    parts = [preferences.get(k) or None for k in ("genre", "tempo", "artist_or_song")]
+    return (mood, *(p.lower() if isinstance(p, str) else p for p in parts))
+
+def ranked_candidates(preferences: dict) -> Ranking:
+    """The scored, cached candidates for one preference set; may rewrite its mood/artist_or_song."""
+    if preferences.get("mood") and preferences["mood"] not in MOOD_VECTORS:
+        preferences["mood"] = map_free_text_to_mood(preferences["mood"])
+    key = ranking_key(preferences)
+    ranking = ranking_cache.get(key)
+    if ranking is not None:
+        preferences.update(ranking.resolved)
+        note("ranking_cache", "hit")
     else:
-        # fallback logic as before
-        genre = preferences.get("genre", "rock")
-        tempo = preferences.get("tempo", "medium")
-        mood = preferences.get("mood", "calm")
-        energy = "energetic"
-        key = build_recommendation_key(genre, mood, energy, tempo)
-        fallback_list = recommendation_map.get(key, [])
-        non_repeats = [song for song in fallback_list if (song["track_name"], song["track_artist"]) not in history]
-        if non_repeats:
-            top = random.choice(non_repeats)
-            history.append((top["track_name"], top["track_artist"]))
-        elif fallback_list:
-            top = random.choice(fallback_list)
-            history.append((top["track_name"], top["track_artist"]))
-        else:
-            return None
-
-    preferences["history"] = history
-
+        version = ranking_cache.version
+        exclude_artist = similarity_target(preferences)
+        with stage("engine.candidates"):
+            rows, matched_by_name, relaxation = candidate_rows(preferences, exclude_artist=exclude_artist)
+        with stage("engine.score"):
+            scores = scorer.score(rows, preferences) if len(rows) else np.zeros(0)
+            resolved = {"artist_or_song": exclude_artist} if exclude_artist else {}
+            ranking = Ranking(rows, scores, matched_by_name, relaxation, resolved)
+        ENGINE_CANDIDATES.observe(len(rows))
+        ranking_cache.put(key, ranking, version)
+        note("ranking_cache", "miss")
+    if ranking.relaxation:
+        ENGINE_PASSES.inc(relaxation=ranking.relaxation)
+        note("relaxation", ranking.relaxation)
+    note("candidates", len(ranking))
+    return ranking
+
+def song_records(positions, matched_by_name) -> list:
+    """Catalog rows as dicts, in one iloc. matched_by_name is a flag for all
+    rows or one per row."""
+    records = catalog.df.iloc[positions].to_dict("records")
+    if np.ndim(matched_by_name) == 0:
+        matched_by_name = [matched_by_name] * len(records)
+    for record, lowercase in zip(records, matched_by_name):
+        if lowercase:
+            # Name matching has always returned lowercased artist/track columns
+            for col in ("track_artist", "track_name"):
+                record[col] = str(record[col]).lower() if pd.notna(record[col]) else ""
+    return records
+
+def song_response(top, preferences: dict) -> dict:
     tempo_category = bpm_to_tempo_category(top.get("tempo_raw", 100))
     response = {
         "song": top.get("track_name", "Unknown"),
@@ -219,3 +379,145 @@ def recommend_engine(preferences: dict):
             response["requested_artist"] = requested
 
     return response
+
+def fallback_rows(preferences: dict) -> np.ndarray:
+    ENGINE_PASSES.inc(relaxation="fallback")
+    note("relaxation", "fallback")
+    genre = preferences.get("genre", "rock")
+    tempo = preferences.get("tempo", "medium")
+    mood = preferences.get("mood", "calm")
+    energy = "energetic"
+    return catalog.buckets.rows(genre, mood, energy, tempo)
+
+def recommend_engine(preferences: dict):
+    ranking = ranked_candidates(preferences)
+    history = preferences.get("history", [])
+    top = None
+
+    # --- Scoring logic ---
+    if len(ranking):
+        with stage("engine.select"):
+            # Best unplayed song, or the best overall once everything has been played
+            pick = ranking.best(catalog.played_rows(history, lowercased=ranking.matched_by_name))
+            top = song_records([ranking.rows[pick]], ranking.matched_by_name)[0]
+        history.append((top["track_name"], top["track_artist"]))
+    else:
+        # fallback logic as before
+        candidates = fallback_rows(preferences)
+        non_repeats = candidates[~np.isin(candidates, catalog.played_rows(history))]
+        if len(non_repeats):
+            top = catalog.df.iloc[random.choice(non_repeats)]
+            history.append((top["track_name"], top["track_artist"]))
+        elif len(candidates):
+            top = catalog.df.iloc[random.choice(candidates)]
+            history.append((top["track_name"], top["track_artist"]))
+        else:
+            return None
+
+    preferences["history"] = history
+    return song_response(top, preferences)
+
+def pick_distinct(rows: np.ndarray, scores: np.ndarray, n: int, played: np.ndarray,
+                  max_per_artist: int = None) -> list:
+    """Indices into rows of up to n distinct tracks, best first, unplayed before played
+    and at most max_per_artist per artist."""
+    track_codes = catalog.neighbors.id_codes[rows]
+    artist_codes = catalog.artist_codes[rows]
+    k = min(len(rows), max(4 * n, 32))
+    while True:
+        order = top_k(scores, k)
+        exhausted = k == len(rows)
+        picked, tracks, per_artist = [], set(), {}
+        # Played songs are only considered once every candidate has been ranked
+        for allow_played in ((False, True) if exhausted else (False,)):
+            for i in order:
+                if len(picked) == n:
+                    break
+                if played[i] != allow_played:
+                    continue
+                track, artist = track_codes[i], artist_codes[i]
+                if track >= 0 and track in tracks:
+                    continue
+                if max_per_artist and artist >= 0 and per_artist.get(artist, 0) >= max_per_artist:
+                    continue
+                picked.append(i)
+                tracks.add(track)
+                per_artist[artist] = per_artist.get(artist, 0) + 1
+        if len(picked) == n or exhausted:
+            return picked
+        k = min(len(rows), 4 * k)
+
+def song_pairs(positions, matched_by_name: bool) -> list:
+    # (track_name, track_artist) of catalog rows as song_records shows them, without building the records
+    pairs = zip(catalog.df["track_name"].array[positions], catalog.df["track_artist"].array[positions])
+    if not matched_by_name:
+        return list(pairs)
+    return [tuple(str(v).lower() if pd.notna(v) else "" for v in pair) for pair in pairs]
+
+def recommend_batch(preference_sets: list, n: int = 1, max_per_artist: int = None) -> list:
+    """Up to n distinct songs per preference set, as recommend_engine responses.
+    Identical sets share one ranking; each set's history gets its picks."""
+    ranked = {}
+    chosen, lowercase = [], []
+    for preferences in preference_sets:
+        key = tuple(preferences.get(k) for k in ("genre", "mood", "tempo", "artist_or_song"))
+        if key not in ranked:
+            shared = {k: preferences.get(k) for k in ("genre", "mood", "tempo", "artist_or_song")}
+            ranked[key] = (shared, ranked_candidates(shared))
+        shared, ranking = ranked[key]
+        preferences.update(shared)
+        history = preferences.get("history", [])
+        matched_by_name = ranking.matched_by_name
+
+        if len(ranking):
+            rows, scores = ranking.rows, ranking.scores
+        else:
+            # Fallback bucket in random order, like recommend_engine's random.choice
+            rows = fallback_rows(preferences)
+            scores = np.random.permutation(len(rows)).astype(np.float64)
+            matched_by_name = False
+        played = np.isin(rows, catalog.played_rows(history, lowercased=matched_by_name))
+        positions = rows[pick_distinct(rows, scores, n, played, max_per_artist)]
+        # Recorded right away: later sets of the batch may share this history (same session)
+        for pair in song_pairs(positions, matched_by_name):
+            history.append(pair)
+        preferences["history"] = history
+        chosen.append(positions)
+        lowercase.extend([matched_by_name] * len(positions))
+
+    # Every pick of the batch is materialized in one go
+    records = song_records(np.concatenate([np.asarray(p, dtype=np.int64) for p in chosen]) if chosen else [], lowercase)
+    playlists, start = [], 0
+    for preferences, positions in zip(preference_sets, chosen):
+        picks = records[start:start + len(positions)]
+        start += len(positions)
+        playlists.append([song_response(top, preferences) for top in picks])
+    return playlists
+
+def recommend_playlist(preferences: dict, n: int, max_per_artist: int = None) -> list:
+    return recommend_batch([preferences], n, max_per_artist)[0]
+
+def song_summary(row) -> dict:
+    return {
+        "song": row.get("track_name", "Unknown"),
+        "artist": row.get("track_artist", "Unknown"),
+        "genre": row.get("playlist_genre", "Unknown"),
+        "tempo": bpm_to_tempo_category(row.get("tempo_raw", 100)),
+        "spotify_url": f"https://open.spotify.com/track/{row.get('track_id')}" if row.get("track_id") else None,
+    }
+
+def similar_songs(track_id: str = None, song: str = None, k: int = 10, history=()):
+    """"More like this": the k tracks nearest to a seed (track_id, else fuzzy title),
+    excluding history and the seed. None if no seed matched."""
+    seed_rows = catalog.seed_rows(track_id=track_id, name=song)
+    if not len(seed_rows):
+        return None
+    seed = seed_rows[0]
+    exclude = np.union1d(seed_rows, catalog.played_rows(history))
+    rows, distances = catalog.neighbors.nearest(catalog.feature_matrix[seed], k, exclude)
+    results = []
+    for record, distance in zip(catalog.df.iloc[rows].to_dict("records"), distances):
+        summary = song_summary(record)
+        summary["distance"] = round(float(distance), 4)
+        results.append(summary)
+    return {"seed": song_summary(catalog.df.iloc[seed]), "results": results}
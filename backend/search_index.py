@@ -0,0 +1,185 @@
+import difflib
+
+import numpy as np
+import pandas as pd
+
+# Characters are folded into this many count buckets; collisions only loosen the bound
+CHAR_BUCKETS = 61
+
+
+def lower_strings(values: pd.Series) -> pd.Series:
+    # Lowercased text with "" for missing values; categoricals are lowered once per distinct value
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        table = np.append(values.cat.categories.astype(str).str.lower().to_numpy(dtype=object), "")
+        return pd.Series(table[values.cat.codes.to_numpy()], index=values.index, dtype=object)
+    return values.fillna("").astype(str).str.lower()
+
+
+def _char_counts(text: str) -> np.ndarray:
+    counts = np.zeros(CHAR_BUCKETS, dtype=np.uint16)
+    for ch in text:
+        counts[ord(ch) % CHAR_BUCKETS] += 1
+    return counts
+
+
+class FuzzyIndex:
+    """difflib.get_close_matches over one column's distinct values, pruned with difflib's
+    own upper bounds; results match a scan of the full column."""
+
+    def __init__(self, values: pd.Series):
+        codes, table = pd.factorize(values, sort=False)
+        lengths = np.array([len(v) for v in table], dtype=np.int32)
+        by_length = np.argsort(lengths, kind="stable")
+
+        self.values = [table[i] for i in by_length]
+        self.lengths = lengths[by_length]
+        self.counts = np.vstack([_char_counts(v) for v in self.values]) if self.values else np.zeros((0, CHAR_BUCKETS), dtype=np.uint16)
+
+        # Remap codes to the length-sorted order and group row positions per value
+        remap = np.empty(len(table), dtype=np.int64)
+        remap[by_length] = np.arange(len(table))
+        codes = remap[codes]
+        self.codes = codes.astype(np.int32)  # value code per row
+        self.multiplicity = np.bincount(codes, minlength=len(table))
+        self._row_order = np.argsort(codes, kind="stable")
+        self._offsets = np.concatenate([[0], np.cumsum(self.multiplicity)])
+        self._lookup = {v: i for i, v in enumerate(self.values)}
+
+    def close_matches(self, query: str, n: int = 5, cutoff: float = 0.6) -> list:
+        qlen = len(query)
+        # real_quick_ratio bound: 2 * min(la, lb) / (la + lb) >= cutoff
+        lo = np.searchsorted(self.lengths, int(np.floor(qlen * cutoff / (2 - cutoff))), side="left")
+        hi = np.searchsorted(self.lengths, int(np.ceil(qlen * (2 - cutoff) / cutoff)) if cutoff > 0 else np.iinfo(np.int32).max, side="right")
+        if lo >= hi:
+            return []
+
+        # quick_ratio bound: shared characters can only be over-counted by bucketing
+        shared = np.minimum(self.counts[lo:hi], _char_counts(query)).sum(axis=1)
+        total = self.lengths[lo:hi] + qlen
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bound = np.where(total > 0, 2.0 * shared / total, 1.0)
+        keep = np.nonzero(bound >= cutoff)[0]
+        # Best bound first, so scoring can stop once no remaining value can make the top n
+        keep = keep[np.argsort(-bound[keep], kind="stable")]
+        survivors, bounds = lo + keep, bound[keep]
+
+        s = difflib.SequenceMatcher()
+        s.set_seq2(query)
+        best = []  # (score, value, count), best first, trimmed to what get_close_matches keeps
+        for i, upper in zip(survivors, bounds):
+            if best and sum(c for _, _, c in best) >= n and upper < best[-1][0]:
+                break
+            value = self.values[i]
+            s.set_seq1(value)
+            if s.real_quick_ratio() >= cutoff and s.quick_ratio() >= cutoff and s.ratio() >= cutoff:
+                best.append((s.ratio(), value, int(self.multiplicity[i])))
+                # get_close_matches keeps the n best (score, value) pairs, duplicates included
+                best.sort(key=lambda item: (item[0], item[1]), reverse=True)
+                taken = 0
+                for pos, (_, _, count) in enumerate(best):
+                    taken += count
+                    if taken >= n:
+                        del best[pos + 1:]
+                        break
+        return [value for _, value, _ in best]
+
+    def code_of(self, value: str) -> int:
+        return self._lookup.get(value, -1)
+
+    def rows_of(self, value: str) -> np.ndarray:
+        i = self._lookup.get(value)
+        if i is None:
+            return self._row_order[:0]
+        return self._row_order[self._offsets[i]:self._offsets[i + 1]]
+
+    def rows_for(self, values: list) -> np.ndarray:
+        parts = [self.rows_of(v) for v in values]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+
+class NameIndex:
+    """Row lookup with fuzzy_match_artist_song's semantics over a fixed frame."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.artists = FuzzyIndex(lower_strings(df["track_artist"]))
+        self.tracks = FuzzyIndex(lower_strings(df["track_name"]))
+        if "popularity" in df.columns:
+            top = df["popularity"].reset_index(drop=True).nlargest(5)
+            self.fallback_rows = top.index.to_numpy()
+        else:
+            self.fallback_rows = np.arange(min(5, len(df)))
+
+    def match_rows(self, query: str, n: int = 5, cutoff: float = 0.6) -> np.ndarray:
+        query = query.lower()
+        artist_matches = self.artists.close_matches(query, n=n, cutoff=cutoff)
+        if artist_matches:
+            return self.artists.rows_for(artist_matches)
+        song_matches = self.tracks.close_matches(query, n=n, cutoff=cutoff)
+        if song_matches:
+            return self.tracks.rows_for(song_matches)
+        return self.fallback_rows
+
+
+class ArtistMentionDetector:
+    """Aho-Corasick automaton over lowercased artist names; find_longest returns the
+    longest one a message contains."""
+
+    def __init__(self, artists):
+        self.artists = []  # original spelling, first catalog occurrence per lowercased name
+        self._lengths = []
+        self._goto = [{}]
+        self._best = [-1]  # longest pattern ending at each state, through fail links
+        pattern_ids = {}
+        for artist in artists:
+            if not isinstance(artist, str):
+                continue
+            key = artist.lower()
+            if not key or key in pattern_ids:
+                continue
+            pattern_ids[key] = len(self.artists)
+            self.artists.append(artist)
+            self._lengths.append(len(key))
+            state = 0
+            for ch in key:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._best.append(-1)
+                state = nxt
+            self._best[state] = pattern_ids[key]
+        self._fail = [0] * len(self._goto)
+        self._build_fail_links()
+
+    def _build_fail_links(self):
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                # A node's own pattern is longer than any proper suffix reached by failing
+                if self._best[nxt] == -1:
+                    self._best[nxt] = self._best[self._fail[nxt]]
+                queue.append(nxt)
+
+    def find_longest(self, text: str):
+        best = -1
+        state = 0
+        for ch in text.lower():
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            found = self._best[state]
+            if found != -1 and (best == -1 or self._lengths[found] > self._lengths[best]
+                                or (self._lengths[found] == self._lengths[best] and found < best)):
+                best = found
+        return self.artists[best] if best != -1 else None
@@ -0,0 +1,115 @@
+"""Preforking launcher: load the catalog once, serve it from N worker processes.
+
+    MOODIFY_SESSION_BACKEND=sqlite python serve.py --workers 4 --port 10000
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+RESTART_DELAY_SECONDS = 1.0
+
+
+def bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def detach_stores(main):
+    # SQLite connections must not be shared across fork()
+    for store in (main.memory.store, main.extraction_cache):
+        if hasattr(store, "close"):
+            store.close()
+
+
+def run_worker(main, sock: socket.socket, args) -> int:
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    for store in (main.memory.store, main.extraction_cache):
+        if hasattr(store, "reopen"):
+            store.reopen()
+    config = uvicorn.Config(main.app, log_level=args.log_level, access_log=args.access_log,
+                            timeout_keep_alive=args.keep_alive)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    return 0
+
+
+def spawn(main, sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = run_worker(main, sock, args)
+        finally:
+            os._exit(code)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("MOODIFY_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "10000")))
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument("--keep-alive", type=int, default=5, help="seconds an idle keep-alive connection is held")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        backend = os.environ.setdefault("MOODIFY_SESSION_BACKEND", "sqlite")
+        if backend == "memory":
+            print("MOODIFY_SESSION_BACKEND=memory keeps sessions per process; use sqlite with --workers > 1")
+            return 2
+
+    started = time.perf_counter()
+    import main as app_module
+
+    sock = bind(args.host, args.port)
+    detach_stores(app_module)
+    gc.collect()
+    gc.freeze()
+    print(f"Loaded in {time.perf_counter() - started:.1f}s; "
+          f"starting {args.workers} workers on {args.host}:{args.port} (pid {os.getpid()})", flush=True)
+
+    workers = {spawn(app_module, sock, args) for _ in range(args.workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}; restarting", flush=True)
+            time.sleep(RESTART_DELAY_SECONDS)
+            if not stopping:
+                workers.add(spawn(app_module, sock, args))
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
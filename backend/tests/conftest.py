@@ -0,0 +1,21 @@
+import os
+import tempfile
+
+import pytest
+
+from tests.helpers import make_synthetic_catalog
+
+FIXTURE_ROWS = 300
+
+# recommender_eng loads its catalog at import time, so the fixture CSV has to exist first
+_data_dir = tempfile.mkdtemp(prefix="moodify-tests-")
+os.environ["MOODIFY_DATA_PATH"] = os.path.join(_data_dir, "songs.csv")
+os.environ["MOODIFY_SNAPSHOT"] = "0"
+make_synthetic_catalog(FIXTURE_ROWS).to_csv(os.environ["MOODIFY_DATA_PATH"], index=False)
+
+
+@pytest.fixture(scope="session")
+def eng():
+    import recommender_eng
+    return recommender_eng
+
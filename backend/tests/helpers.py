@@ -0,0 +1,143 @@
+"""Synthetic catalogs and the pre-optimization reference implementations the tests compare against."""
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import cosine_similarity
+
+from utils import build_recommendation_key, fuzzy_match_artist_song, split_mode_category
+
+GENRE_POOL = ["pop", "rock", "rap", "latin", "r&b", "edm", "jazz", "indie"]
+MODE_POOL = [
+    "Happy Energetic", "Happy Calm", "Sad Calm", "Sad Energetic",
+    "Calm Calm", "Upbeat Party", "Melancholy Slow", "Chill Calm",
+]
+TEMPO_POOL = ["Slow", "Medium", "Fast"]
+FEATURES = ["valence", "energy", "danceability", "acousticness", "tempo"]
+SYLLABLES = ["ka", "lo", "mi", "ra", "ne", "so", "ta", "vi", "do", "re", "lu", "ze", "an", "el", "or"]
+WORDS = ["love", "night", "fire", "dream", "city", "heart", "rain", "light", "summer", "gold", "blue", "wild"]
+
+PREFERENCE_MIX = [
+    {"genre": "pop", "mood": "happy", "tempo": "fast", "artist_or_song": None},
+    {"genre": "rock", "mood": "sad", "tempo": "slow", "artist_or_song": None},
+    {"genre": None, "mood": "calm", "tempo": None, "artist_or_song": None},
+    {"genre": "jazz", "mood": "melancholy", "tempo": "medium", "artist_or_song": None},
+    {"genre": "any", "mood": "any", "tempo": "any", "artist_or_song": "any"},
+    {"genre": "latin", "mood": "energetic", "tempo": "fast", "artist_or_song": "kalo mira"},
+    {"genre": None, "mood": "happy", "tempo": None, "artist_or_song": "heart"},
+]
+
+
+def make_synthetic_catalog(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    n_artists = max(10, n_rows // 8)
+    syl = np.array(SYLLABLES)
+    artists = np.array([
+        " ".join("".join(rng.choice(syl, size=rng.integers(2, 4))) for _ in range(rng.integers(1, 3)))
+        for _ in range(n_artists)
+    ])
+    words = np.array(WORDS)
+    names = np.array([" ".join(rng.choice(words, size=rng.integers(1, 4))) for _ in range(max(10, n_rows // 3))])
+    return pd.DataFrame({
+        "track_id": [f"trk{i:08d}" for i in range(n_rows)],
+        "track_name": rng.choice(names, size=n_rows),
+        "track_artist": rng.choice(artists, size=n_rows),
+        "track_popularity": rng.integers(0, 101, size=n_rows),
+        "playlist_genre": rng.choice(GENRE_POOL, size=n_rows),
+        "valence": rng.random(n_rows).round(3),
+        "energy": rng.random(n_rows).round(3),
+        "danceability": rng.random(n_rows).round(3),
+        "acousticness": rng.random(n_rows).round(3),
+        "tempo": rng.uniform(60, 200, size=n_rows).round(3),
+        "mode_category": rng.choice(MODE_POOL, size=n_rows),
+        "tempo_category": rng.choice(TEMPO_POOL, size=n_rows),
+    })
+
+
+def legacy_filter(eng, preferences: dict, exclude_artist=None) -> pd.DataFrame:
+    # The copy-per-pass apply_filters recommend_engine used before the Catalog masks
+    def apply_filters(preferences, filter_tempo=True, filter_genre=True):
+        local_df = eng.df.copy()
+        if preferences.get("mood") and preferences["mood"] not in eng.MOOD_VECTORS:
+            preferences["mood"] = eng.map_free_text_to_mood(preferences["mood"])
+        if preferences.get("artist_or_song"):
+            local_df = fuzzy_match_artist_song(local_df, preferences["artist_or_song"])
+        if filter_genre and preferences.get("genre"):
+            local_df = local_df[local_df["playlist_genre"].str.lower() == preferences["genre"].lower()]
+        if filter_tempo and preferences.get("tempo"):
+            bpm_range = eng.convert_tempo_to_bpm(preferences["tempo"])
+            local_df = local_df[(local_df["tempo_raw"] >= bpm_range[0]) & (local_df["tempo_raw"] <= bpm_range[1])]
+        if preferences.get("mood") in eng.MOOD_VECTORS and not local_df.empty:
+            mood_vec = np.array(eng.MOOD_VECTORS[preferences["mood"]]).reshape(1, -1)
+            local_df["similarity"] = cosine_similarity(mood_vec, local_df[eng.features].values).flatten()
+            local_df = local_df.sort_values(by="similarity", ascending=False)
+        if exclude_artist:
+            local_df = local_df[local_df["track_artist"].str.lower() != exclude_artist.lower()]
+        return local_df
+
+    filtered = apply_filters(preferences, True, True)
+    if filtered.empty:
+        filtered = apply_filters(preferences, False, True)
+    if filtered.empty:
+        filtered = apply_filters(preferences, False, False)
+    return filtered
+
+
+def fuzzy_queries(eng, count: int, seed: int = 1) -> list:
+    # Exact names, typo'd names, partial names and noise
+    rng = np.random.default_rng(seed)
+    picks = eng.df.sample(count, random_state=seed)
+    queries = []
+    for artist, name in zip(picks["track_artist"], picks["track_name"]):
+        typo = list(artist)
+        typo[rng.integers(len(typo))] = "x"
+        queries.extend([artist, "".join(typo), name, artist.split()[0][:4], "zzqv " + name[:3]])
+    return queries
+
+
+def legacy_recommendation_map(df: pd.DataFrame) -> dict:
+    # precompute_recommendation_map as it was before BucketIndex: one row Series per song
+    index_map = {}
+    for _, row in df.iterrows():
+        genre = row.get("playlist_genre", "unknown")
+        tempo = row.get("tempo_category", "medium")
+        mood, energy = split_mode_category(row.get("mode_category", "calm calm"))
+        key = build_recommendation_key(genre, mood, energy, tempo)
+        if key not in index_map:
+            index_map[key] = []
+        index_map[key].append(row)
+    return index_map
+
+
+def legacy_select(eng, rows: np.ndarray, preferences: dict, history: list):
+    # recommend_engine's pick before top_k: full sort, then iterrows until a song is not in history
+    filtered = eng.catalog.rows(rows).copy()
+    filtered["weighted_score"] = eng.scorer.score(rows, preferences)
+    filtered = filtered.sort_values(by="weighted_score", ascending=False)
+    for _, row in filtered.iterrows():
+        if (row["track_name"], row["track_artist"]) not in history:
+            return row
+    return filtered.iloc[0]
+
+
+def brute_force_neighbors(eng, seed: int, k: int, exclude: np.ndarray) -> tuple:
+    distances = np.linalg.norm(eng.catalog.feature_matrix - eng.catalog.feature_matrix[seed], axis=1)
+    distances[exclude] = np.inf
+    rows = np.argsort(distances, kind="stable")[:k]
+    return rows, distances[rows]
+
+
+def run_session(eng, prefs: dict, turns: int) -> list:
+    session = dict(prefs, history=[])
+    return [eng.recommend_engine(session) for _ in range(turns)]
+
+
+def legacy_load_songs(path: str, features: list) -> pd.DataFrame:
+    # load_songs before chunked ingestion: every column, strings as objects, float64 features
+    from sklearn.preprocessing import MinMaxScaler
+
+    df = pd.read_csv(path)
+    df["tempo_raw"] = pd.to_numeric(df["tempo"], errors="coerce")
+    df = df.dropna(subset=features)
+    df[features] = df[features].apply(pd.to_numeric, errors='coerce')
+    df = df.dropna(subset=features)
+    df[features] = MinMaxScaler().fit_transform(df[features])
+    return df
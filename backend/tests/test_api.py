@@ -0,0 +1,340 @@
+import json
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import metrics
+import utils
+from llm_client import LLMClient
+from llm_stub import StubServer
+from memory import SessionConflict, SessionMemory, SQLiteSessionStore
+from pipeline import PolishStore, PrefetchStore, Speculation
+
+STUB_TEXT = "Here is a stub reply about a great song you might enjoy."
+
+
+@pytest.fixture(scope="module")
+def stub():
+    server = StubServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(stub, monkeypatch):
+    # A client of its own per test: the app's lifespan closes it on the way out
+    llm = LLMClient(url=stub.url, backoff=0.01)
+    monkeypatch.setattr(main, "llm", llm)
+    monkeypatch.setattr(utils, "llm", llm)
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def new_session() -> str:
+    return uuid.uuid4().hex
+
+
+def ask(client, session_id: str, message: str, **settings) -> dict:
+    response = client.post("/recommend", json=dict(session_id=session_id, genre=message, **settings))
+    assert response.status_code == 200
+    return response.json()
+
+
+def command(client, session_id: str, text: str, **settings) -> dict:
+    response = client.post("/command", json=dict(session_id=session_id, command=text, **settings))
+    assert response.status_code == 200
+    return response.json()
+
+
+def served(client, session_id: str, **settings) -> dict:
+    # Two turns to a first song: what the user wants, then "no preference" for the rest
+    ask(client, session_id, "happy pop fast", **settings)
+    return ask(client, session_id, "no preference", **settings)
+
+
+def test_recommend_asks_until_preferences_are_complete(client):
+    session_id = new_session()
+    reply = ask(client, session_id, "happy pop fast")
+    assert STUB_TEXT in reply["response"]
+    assert client.get(f"/session/{session_id}").json()["followup_count"] == 1
+
+    reply = ask(client, session_id, "no preference")
+    assert "Was that a good fit for you?" in reply["response"]
+    session = client.get(f"/session/{session_id}").json()
+    assert session["awaiting_feedback"] and session["last_song"]
+    assert (session["genre"], session["mood"], session["tempo"]) == ("pop", "happy", "fast")
+
+
+def test_recommend_waits_for_feedback(client):
+    session_id = new_session()
+    served(client, session_id)
+    assert ask(client, session_id, "rock")["response"] is None
+
+
+def test_command_no_serves_another_song(client):
+    session_id = new_session()
+    served(client, session_id)
+    first = client.get(f"/session/{session_id}").json()["last_song"]
+
+    reply = command(client, session_id, "no")
+    assert "Was that a good fit for you?" in reply["response"]
+    session = client.get(f"/session/{session_id}").json()
+    assert session["last_song"] != first
+    assert len(session["history"]) == 2
+
+
+def test_command_yes_and_change(client):
+    session_id = new_session()
+    served(client, session_id)
+    assert "Great!" in command(client, session_id, "yes")["response"]
+    assert not client.get(f"/session/{session_id}").json()["awaiting_feedback"]
+
+    assert "What genre would you like instead?" in command(client, session_id, "change genre")["response"]
+    assert client.get(f"/session/{session_id}").json()["genre"] is None
+
+
+def test_reset(client):
+    session_id = new_session()
+    served(client, session_id)
+    assert client.post("/reset", json={"session_id": session_id, "command": "reset"}).status_code == 200
+    session = client.get(f"/session/{session_id}").json()
+    assert session["genre"] is None and session["history"] == []
+
+
+def test_timings_on_request(client):
+    response = client.post("/recommend", json={"session_id": new_session(), "genre": "happy pop fast"},
+                           headers={"X-Moodify-Timings": "1"})
+    assert "extract" in response.json()["timings"]
+
+
+def test_template_first_reply_is_polished_later(client):
+    session_id = new_session()
+    ask(client, session_id, "happy pop fast")
+    reply = ask(client, session_id, "no preference", template_first=True)
+    session = client.get(f"/session/{session_id}").json()
+    assert STUB_TEXT not in reply["response"]
+    assert session["last_song"] in reply["response"]
+
+    polished = client.get(f"/polish/{reply['polish_id']}").json()["response"]
+    assert polished.startswith("<span style='color:green'>" + STUB_TEXT)
+    assert polished.endswith("Was that a good fit for you?")
+    assert client.get("/polish/unknown").json()["response"] is None
+
+
+def test_speculation_hit(client):
+    session_id = new_session()
+    ask(client, session_id, "happy pop fast")
+    response = client.post("/recommend", json={"session_id": session_id, "genre": "no preference"},
+                           headers={"X-Moodify-Timings": "1"})
+    assert response.json()["timings"]["speculation_hit"] is True
+    assert client.get(f"/session/{session_id}").json()["last_song"]
+
+
+def sse_events(response) -> list:
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = []
+    for block in response.text.split("\n\n")[:-1]:
+        event, data = block.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_recommend_stream_sends_tokens_then_done(client):
+    session_id = new_session()
+    ask(client, session_id, "happy pop fast")
+    events = sse_events(client.post("/recommend/stream", json={"session_id": session_id, "genre": "no preference"}))
+    names = [name for name, _ in events]
+    assert names[-1] == "done" and set(names[:-1]) == {"token"} and len(names) > 2
+    tokens = "".join(data["text"] for name, data in events[:-1])
+    assert tokens.startswith(STUB_TEXT)
+    assert events[-1][1]["response"] == f"<span style='color:green'>{tokens}</span><br>Was that a good fit for you?"
+    assert client.get(f"/session/{session_id}").json()["awaiting_feedback"]
+
+
+def test_command_stream_without_llm_text_sends_done_only(client):
+    session_id = new_session()
+    served(client, session_id)
+    events = sse_events(client.post("/command/stream", json={"session_id": session_id, "command": "yes"},
+                                    headers={"X-Moodify-Timings": "1"}))
+    assert [name for name, _ in events] == ["done"]
+    assert "Great!" in events[0][1]["response"] and "timings" in events[0][1]
+
+
+def test_session_saved_elsewhere_mid_turn_is_a_409(client, monkeypatch, tmp_path):
+    path = str(tmp_path / "sessions.db")
+    memory, other_worker = SessionMemory(SQLiteSessionStore(path)), SessionMemory(SQLiteSessionStore(path))
+    monkeypatch.setattr(main, "memory", memory)
+    session_id = new_session()
+    extract = main.aextract_preferences_from_message
+
+    async def extract_while_another_worker_saves(message, api_key):
+        other_worker.save_session(session_id, other_worker.get_session(session_id))
+        return await extract(message, api_key)
+
+    monkeypatch.setattr(main, "aextract_preferences_from_message", extract_while_another_worker_saves)
+    response = client.post("/recommend", json={"session_id": session_id, "genre": "happy pop fast"})
+    assert response.status_code == 409
+    assert "Please send that again" in response.json()["response"]
+    assert client.get(f"/session/{session_id}").json()["genre"] is None
+
+    monkeypatch.setattr(main, "aextract_preferences_from_message", extract)
+    ask(client, session_id, "happy pop fast")
+    assert client.get(f"/session/{session_id}").json()["genre"] == "pop"
+
+
+@pytest.fixture
+def prefetches(monkeypatch):
+    store = PrefetchStore()
+    monkeypatch.setattr(main, "prefetches", store)
+    return store
+
+
+def test_prefetched_song_is_served(client, prefetches):
+    session_id = new_session()
+    served(client, session_id)
+    assert prefetches.stats()["entries"] == 1
+    response = client.post("/command", json={"session_id": session_id, "command": "no"},
+                           headers={"X-Moodify-Timings": "1"})
+    assert response.json()["timings"]["prefetch_hit"] is True
+
+
+def test_prefetch_is_dropped_when_preferences_change(client, prefetches):
+    session_id = new_session()
+    served(client, session_id)
+    command(client, session_id, "change mood")
+    assert prefetches.stats()["entries"] == 0
+
+
+def test_prefetch_is_dropped_on_reset(client, prefetches):
+    session_id = new_session()
+    served(client, session_id)
+    client.post("/reset", json={"session_id": session_id, "command": "reset"})
+    assert prefetches.stats()["entries"] == 0
+
+
+def test_failed_extraction_cancels_the_speculation(client, monkeypatch):
+    speculations = []
+
+    class Recorded(Speculation):
+        def __init__(self, *args):
+            super().__init__(*args)
+            speculations.append(self)
+
+    async def failing_extract(message, api_key):
+        raise RuntimeError("extraction failed")
+
+    session_id = new_session()
+    ask(client, session_id, "happy pop fast")
+    monkeypatch.setattr(main, "Speculation", Recorded)
+    monkeypatch.setattr(main, "aextract_preferences_from_message", failing_extract)
+    with pytest.raises(RuntimeError):
+        client.post("/recommend", json={"session_id": session_id, "genre": "no preference"})
+    assert len(speculations) == 1
+    deadline = time.monotonic() + 1.0
+    while not speculations[0].task.done() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert speculations[0].task.cancelled()
+
+
+def test_409_cancels_the_polish(client, monkeypatch):
+    polishes = PolishStore()
+    monkeypatch.setattr(main, "polish_store", polishes)
+
+    def conflict(session_id, session):
+        raise SessionConflict(session_id)
+
+    session_id = new_session()
+    ask(client, session_id, "happy pop fast")
+    monkeypatch.setattr(main.memory, "save_session", conflict)
+    response = client.post("/recommend", json={"session_id": session_id, "genre": "no preference",
+                                               "template_first": True})
+    assert response.status_code == 409
+    assert polishes._tasks == {}
+
+
+def test_batch_adds_picks_to_session_history(client):
+    session_id = new_session()
+    response = client.post("/recommend/batch", json={"count": 3, "requests": [
+        {"session_id": session_id, "genre": "pop", "mood": "happy"},
+        {"genre": "rock", "mood": "sad", "tempo": "slow"},
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert [r["session_id"] for r in body["results"]] == [session_id, None]
+    assert [len(r["songs"]) for r in body["results"]] == [3, 3]
+    assert body["response"] == STUB_TEXT
+
+    songs = body["results"][0]["songs"]
+    session = client.get(f"/session/{session_id}").json()
+    assert [tuple(pair) for pair in session["history"]] == [(s["song"], s["artist"]) for s in songs]
+    assert session["last_song"] == songs[-1]["song"]
+
+
+def test_batch_without_summary(client):
+    response = client.post("/recommend/batch", json={"summarize": False, "requests": [{"mood": "calm"}]})
+    assert "response" not in response.json()
+    assert len(response.json()["results"][0]["songs"]) == 1
+    assert client.post("/recommend/batch", json={"requests": []}).status_code == 422
+
+
+def test_similar_by_track_id(client):
+    response = client.post("/similar", json={"track_id": "trk00000000", "k": 5})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["seed"]["spotify_url"].endswith("trk00000000")
+    assert len(body["results"]) == 5
+    assert all(not r["spotify_url"].endswith("trk00000000") for r in body["results"])
+    assert [r["distance"] for r in body["results"]] == sorted(r["distance"] for r in body["results"])
+
+
+def test_similar_skips_what_the_session_heard(client):
+    session_id = new_session()
+    served(client, session_id)
+    command(client, session_id, "no")
+    heard = {tuple(pair) for pair in client.get(f"/session/{session_id}").json()["history"]}
+    results = client.post("/similar", json={"session_id": session_id, "track_id": "trk00000000", "k": 100}).json()["results"]
+    assert not heard & {(r["song"], r["artist"]) for r in results}
+
+
+def test_similar_needs_a_known_seed(client):
+    assert client.post("/similar", json={}).status_code == 400
+    assert client.post("/similar", json={"track_id": "no-such-track"}).status_code == 404
+
+
+def requests_seen(route: str, status: int) -> int:
+    series = metrics.REQUEST_SECONDS._series.get((route, "POST", str(status)))
+    return series[-1] if series else 0
+
+
+def test_failed_request_is_timed_as_500_and_stops_the_profiler(client, monkeypatch):
+    async def failing_extract(message, api_key):
+        raise RuntimeError("extraction failed")
+
+    monkeypatch.setattr(main, "PROFILING", True)
+    monkeypatch.setattr(main, "aextract_preferences_from_message", failing_extract)
+    before = requests_seen("/recommend", 500)
+    with pytest.raises(RuntimeError):
+        client.post("/recommend", json={"session_id": new_session(), "genre": "rock"},
+                    headers={"X-Moodify-Profile": "1"})
+    assert requests_seen("/recommend", 500) == before + 1
+    assert not any(thread.name == "moodify-profiler" for thread in threading.enumerate())
+
+
+def test_streamed_reply_is_profiled_to_the_end_of_its_body(client, stub, monkeypatch):
+    monkeypatch.setattr(main, "PROFILING", True)
+    monkeypatch.setattr(stub, "token_delay", 0.02)
+    session_id = new_session()
+    ask(client, session_id, "happy pop fast")
+    before = requests_seen("/recommend/stream", 200)
+    response = client.post("/recommend/stream", json={"session_id": session_id, "genre": "no preference"},
+                           headers={"X-Moodify-Profile": "1"})
+    assert sse_events(response)[-1][0] == "done"
+    # The stub sends one word every 20 ms
+    profile = client.get(f"/profile/{response.headers['X-Moodify-Profile-Id']}").json()
+    assert profile["duration_ms"] >= len(STUB_TEXT.split()) * 20
+    assert requests_seen("/recommend/stream", 200) == before + 1
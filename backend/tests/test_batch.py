@@ -0,0 +1,83 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from tests.helpers import PREFERENCE_MIX
+
+PREFERENCES = [p for p in PREFERENCE_MIX if p["artist_or_song"] is None]
+
+
+@pytest.mark.parametrize("prefs", PREFERENCES, ids=str)
+def test_playlist_head_is_the_single_pick(eng, prefs):
+    single = eng.recommend_engine(dict(prefs, history=[]))
+    playlist = eng.recommend_playlist(dict(prefs, history=[]), 20)
+    assert playlist[0] == single
+
+
+@pytest.mark.parametrize("prefs", PREFERENCES, ids=str)
+def test_playlist_follows_repeated_single_picks(eng, prefs):
+    # A playlist stops at the ranked candidates; single picks go on repeating once all are played
+    session = dict(prefs, history=[])
+    singles = [eng.recommend_engine(session) for _ in range(20)]
+    playlist = eng.recommend_playlist(dict(prefs, history=[]), 20)
+    assert len(playlist) == min(20, len(eng.ranked_candidates(dict(prefs))))
+    assert playlist == singles[:len(playlist)]
+
+
+@pytest.mark.parametrize("max_per_artist", [None, 1, 2])
+def test_playlist_tracks_are_distinct_and_capped_per_artist(eng, max_per_artist):
+    prefs = dict(PREFERENCES[2], history=[])
+    playlist = eng.recommend_playlist(prefs, 30, max_per_artist)
+    assert len(playlist) == 30
+    assert len({song["spotify_url"] for song in playlist}) == 30
+    if max_per_artist:
+        assert max(Counter(song["artist"] for song in playlist).values()) <= max_per_artist
+    assert prefs["history"] == [(song["song"], song["artist"]) for song in playlist]
+
+
+def test_batch_keeps_each_sets_history(eng):
+    played = eng.recommend_playlist(dict(PREFERENCES[0], history=[]), 3)
+    history = [(song["song"], song["artist"]) for song in played]
+    fresh, resumed = eng.recommend_batch(
+        [dict(PREFERENCES[0], history=[]), dict(PREFERENCES[0], history=list(history))], 3)
+    assert fresh == played
+    assert not {(s["song"], s["artist"]) for s in resumed} & set(history)
+
+
+def test_playlist_longer_than_the_catalog(eng):
+    playlist = eng.recommend_playlist(dict(PREFERENCES[2], history=[]), 1000)
+    assert len(playlist) == eng.catalog.size
+
+
+def test_sets_sharing_a_history_get_different_songs(eng):
+    history = []
+    first, second = eng.recommend_batch([dict(PREFERENCES[2], history=history), dict(PREFERENCES[2], history=history)], 5)
+    assert not {s["spotify_url"] for s in first} & {s["spotify_url"] for s in second}
+    assert history == [(s["song"], s["artist"]) for s in first + second]
+
+
+@pytest.fixture
+def fallback_only(eng, monkeypatch):
+    # No ranked candidates, so every set is served from a fixed fallback bucket
+    empty = eng.Ranking(np.zeros(0, dtype=np.int64), np.zeros(0), False, None, {})
+    monkeypatch.setattr(eng, "ranked_candidates", lambda preferences: empty)
+    bucket = np.arange(60)
+    monkeypatch.setattr(eng, "fallback_rows", lambda preferences: bucket)
+    return bucket
+
+
+def test_fallback_tracks_are_distinct_and_capped_per_artist(eng, fallback_only):
+    playlist = eng.recommend_playlist(dict(PREFERENCES[0], history=[]), 10, max_per_artist=1)
+    assert len(playlist) == 10
+    assert len({song["spotify_url"] for song in playlist}) == 10
+    assert max(Counter(song["artist"] for song in playlist).values()) == 1
+    bucket_ids = set(eng.df["track_id"].iloc[fallback_only])
+    assert all(song["spotify_url"].rsplit("/", 1)[1] in bucket_ids for song in playlist)
+
+
+def test_fallback_repeats_played_songs_once_all_are_played(eng, fallback_only):
+    played = [(eng.df["track_name"].iloc[i], eng.df["track_artist"].iloc[i]) for i in fallback_only]
+    playlist = eng.recommend_playlist(dict(PREFERENCES[0], history=played), 10)
+    assert len(playlist) == 10
+    assert eng.recommend_engine(dict(PREFERENCES[0], history=list(played))) is not None
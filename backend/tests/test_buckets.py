@@ -0,0 +1,46 @@
+import pandas as pd
+
+from tests.helpers import legacy_recommendation_map
+from catalog import BucketIndex
+from utils import build_recommendation_key
+
+
+def check_against_map(df: pd.DataFrame):
+    legacy = legacy_recommendation_map(df)
+    index = BucketIndex(df)
+    assert sorted(index.keys()) == sorted(legacy)
+    for key, songs in legacy.items():
+        genre, mood_energy, tempo = key.split("_")
+        mood, energy = mood_energy.split(" ")
+        assert list(df.index[index.rows(genre, mood, energy, tempo)]) == [song.name for song in songs], key
+
+
+def test_buckets_match_recommendation_map(eng):
+    check_against_map(eng.df)
+
+
+def test_irregular_values():
+    # Missing genre, "_" separators and case variants whose key strings collide
+    df = pd.DataFrame({
+        "playlist_genre": ["pop", "pop", "rock", None, "pop", "pop"],
+        "mode_category": ["Happy Energetic", "happy energetic", "Sad Calm", "Calm Calm", "Calm_Calm", "HAPPY ENERGETIC"],
+        "tempo_category": ["Fast", "fast", "Slow", "Medium", "slow", "FAST"],
+    })
+    check_against_map(df)
+
+
+def test_rows_without_a_key_are_skipped():
+    # The old map raised on these; they simply have no bucket
+    df = pd.DataFrame({
+        "playlist_genre": ["pop", "pop", "pop"],
+        "mode_category": ["Happy Energetic", "Sad", None],
+        "tempo_category": ["Fast", "Fast", "Fast"],
+    })
+    index = BucketIndex(df)
+    assert index.keys() == ["pop_Happy Energetic_Fast"]
+    assert list(index.rows("pop", "happy", "energetic", "fast")) == [0]
+
+
+def test_unknown_key_is_empty(eng):
+    assert len(eng.catalog.buckets.rows("polka", "happy", "energetic", "fast")) == 0
+    assert build_recommendation_key("polka", "happy", "energetic", "fast") not in eng.catalog.buckets.keys()
@@ -0,0 +1,37 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from tests.helpers import legacy_filter
+
+PREFERENCES = [
+    {"genre": genre, "mood": mood, "tempo": tempo, "artist_or_song": artist}
+    for genre, mood, tempo, artist in itertools.product(
+        [None, "pop", "ro"], [None, "happy", "calm", "melancholy"], [None, "slow", "fast"], [None, "heart"])
+]
+
+
+@pytest.mark.parametrize("prefs", PREFERENCES, ids=str)
+def test_candidate_rows_match_copying_filter(eng, prefs):
+    expected = legacy_filter(eng, dict(prefs))
+    got, _, _ = eng.candidate_rows(dict(prefs))
+    assert sorted(eng.df.index[got]) == sorted(expected.index)
+
+
+@pytest.mark.parametrize("prefs", [p for p in PREFERENCES if p["mood"]], ids=str)
+def test_candidates_in_mood_similarity_order(eng, prefs):
+    prefs = dict(prefs)
+    got, _, _ = eng.candidate_rows(prefs)
+    sim = eng.catalog.moods.column(prefs["mood"])[got]
+    assert (np.diff(sim) <= 0).all()
+
+
+def test_excluded_artist_never_a_candidate(eng):
+    artist = eng.df["track_artist"].iloc[0]
+    prefs = {"genre": None, "mood": "happy", "tempo": None, "artist_or_song": None}
+    expected = legacy_filter(eng, dict(prefs), exclude_artist=artist)
+    got, _, _ = eng.candidate_rows(dict(prefs), exclude_artist=artist)
+    assert sorted(eng.df.index[got]) == sorted(expected.index)
+    assert artist.lower() not in set(eng.df["track_artist"].iloc[got].str.lower())
+
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from tests.helpers import fuzzy_queries
+from utils import fuzzy_match_artist_song
+
+
+def difflib_rows(eng, query) -> np.ndarray:
+    names = eng.df[["track_artist", "track_name"]].reset_index(drop=True)
+    return fuzzy_match_artist_song(names, query).index.to_numpy()
+
+
+def test_index_matches_difflib_scan(eng):
+    # Exact, typo'd, partial and noise queries
+    for query in fuzzy_queries(eng, 20):
+        assert np.array_equal(eng.catalog.match_rows(query), difflib_rows(eng, query)), query
+
+
+@pytest.mark.parametrize("query", ["", "zzzz", "KALO", "love love love"])
+def test_edge_queries(eng, query):
+    assert np.array_equal(eng.catalog.match_rows(query), difflib_rows(eng, query))
+
+
+def test_non_string_query(eng):
+    assert np.array_equal(eng.catalog.match_rows(None), difflib_rows(eng, None))
+
+
+def test_indexed_fuzzy_match_frame(eng):
+    names = eng.df[["track_artist", "track_name"]].reset_index(drop=True)
+    for query in fuzzy_queries(eng, 5):
+        scanned = fuzzy_match_artist_song(names.copy(), query)
+        indexed = fuzzy_match_artist_song(names.copy(), query, index=eng.catalog.name_index)
+        assert scanned.astype(str).equals(indexed.astype(str)), query
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tests.helpers import legacy_load_songs, make_synthetic_catalog
+from catalog import read_catalog_csv
+from utils import convert_tempo_to_bpm
+
+FEATURES = ["valence", "energy", "danceability", "acousticness", "tempo"]
+# Just past the slow/medium/fast bounds; float32 would round each onto the bound
+BOUNDARY_TEMPOS = [89.0000001, 89.999999, 120.000001, 120.9999999]
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    df = make_synthetic_catalog(50)
+    df.loc[:len(BOUNDARY_TEMPOS) - 1, "tempo"] = BOUNDARY_TEMPOS
+    df["energy"] = df["energy"].astype(object)
+    df.loc[10, "energy"] = "n/a"
+    path = tmp_path / "songs.csv"
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.mark.parametrize("chunksize", [7, 200000])
+def test_matches_the_full_load(csv_path, chunksize):
+    got = read_catalog_csv(csv_path, FEATURES, chunksize)
+    want = legacy_load_songs(csv_path, FEATURES)
+    assert list(got.index) == list(want.index)
+    assert got["tempo_raw"].dtype == np.float64
+    assert np.array_equal(got["tempo_raw"].to_numpy(), want["tempo_raw"].to_numpy())
+    for col in FEATURES:
+        assert got[col].dtype == np.float32
+        assert np.allclose(got[col], want[col], atol=1e-6)
+    for col in ("track_name", "track_artist", "playlist_genre"):
+        assert isinstance(got[col].dtype, pd.CategoricalDtype)
+        assert list(got[col].astype(object)) == list(want[col])
+
+
+@pytest.mark.parametrize("tempo", ["slow", "medium", "fast"])
+def test_tempo_bounds_are_exact(csv_path, tempo):
+    got = read_catalog_csv(csv_path, FEATURES, 7)
+    low, high = convert_tempo_to_bpm(tempo)
+    tempos = got["tempo_raw"].to_numpy()
+    expected = [t for t in BOUNDARY_TEMPOS if low <= t <= high]
+    assert [t for t in tempos[:len(BOUNDARY_TEMPOS)] if low <= t <= high] == expected
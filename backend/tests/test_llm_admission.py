@@ -0,0 +1,283 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from llm_admission import AdmissionController, CircuitBreaker, Saturated, SingleFlight
+from llm_client import LLMClient
+
+
+def test_admits_up_to_max_concurrency():
+    gate = AdmissionController(max_concurrency=2, max_wait=0.05)
+    assert gate.admit() == 0.0 and gate.admit() == 0.0
+    with pytest.raises(Saturated) as rejected:
+        gate.admit()
+    assert rejected.value.reason == "timeout"
+    gate.release()
+    assert gate.admit() == 0.0
+    assert gate.stats()["rejected"] == {"queue_full": 0, "timeout": 1}
+    assert gate.stats()["queued"] == 0
+
+
+def test_queue_full_is_rejected_at_once():
+    gate = AdmissionController(max_concurrency=1, max_queue=1, max_wait=1.0)
+    gate.admit()
+    waiting = threading.Thread(target=lambda: (gate.admit(), gate.release()))
+    waiting.start()
+    while not gate.queued:
+        time.sleep(0.001)
+    started = time.monotonic()
+    with pytest.raises(Saturated) as rejected:
+        gate.admit()
+    assert rejected.value.reason == "queue_full"
+    assert time.monotonic() - started < 0.5
+    gate.release()
+    waiting.join()
+    assert gate.stats()["rejected"] == {"queue_full": 1, "timeout": 0}
+    assert gate.in_flight == 0
+
+
+def test_token_wait_past_the_budget_is_rejected():
+    gate = AdmissionController(rate=1.0, burst=1.0, max_wait=5.0)
+    gate.admit()
+    gate.release()
+    started = time.monotonic()
+    with pytest.raises(Saturated):
+        gate.admit(max_wait=0.1)
+    assert time.monotonic() - started < 0.1
+
+
+def test_threads_are_admitted_in_arrival_order():
+    gate = AdmissionController(max_concurrency=1, max_wait=5.0)
+    gate.admit()
+    order = []
+
+    def call(i):
+        gate.admit()
+        order.append(i)
+        gate.release()
+
+    threads = []
+    for i in range(5):
+        threads.append(threading.Thread(target=call, args=(i,)))
+        threads[-1].start()
+        while gate.queued <= i:
+            time.sleep(0.001)
+    gate.release()
+    for thread in threads:
+        thread.join()
+    assert order == list(range(5))
+
+
+def test_coroutines_are_admitted_in_arrival_order():
+    gate = AdmissionController(max_concurrency=1, max_wait=5.0)
+    order = []
+
+    async def call(i):
+        await gate.aadmit()
+        order.append(i)
+        await asyncio.sleep(0)
+        gate.release()
+
+    async def run():
+        await gate.aadmit()
+        tasks = []
+        for i in range(5):
+            tasks.append(asyncio.ensure_future(call(i)))
+            await asyncio.sleep(0)
+        gate.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == list(range(5))
+    assert gate.admitted == 6
+
+
+def test_async_timeout_and_cancellation_leave_the_queue():
+    gate = AdmissionController(max_concurrency=1, max_wait=5.0)
+
+    async def run():
+        await gate.aadmit()
+        with pytest.raises(Saturated):
+            await gate.aadmit(max_wait=0.02)
+        waiter = asyncio.ensure_future(gate.aadmit())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        # A call queued behind the leavers still gets the slot
+        later = asyncio.ensure_future(gate.aadmit())
+        await asyncio.sleep(0.01)
+        gate.release()
+        assert await later >= 0
+
+    asyncio.run(run())
+    assert gate.queued == 0 and gate.in_flight == 1
+    assert gate.rejected["timeout"] == 2
+
+
+def test_thread_is_woken_by_a_coroutine_release():
+    gate = AdmissionController(max_concurrency=1, max_wait=5.0)
+    gate.admit()
+    waited = []
+    thread = threading.Thread(target=lambda: waited.append(gate.admit()))
+    thread.start()
+    while not gate.queued:
+        time.sleep(0.001)
+
+    async def release():
+        gate.release()
+
+    asyncio.run(release())
+    thread.join(1.0)
+    assert waited and waited[0] < 1.0
+
+
+def test_single_flight_followers_share_the_leaders_error():
+    flights = SingleFlight()
+    finish = threading.Event()
+
+    def upstream():
+        finish.wait()
+        raise ValueError("upstream")
+
+    with ThreadPoolExecutor(2) as executor:
+        futures = [flights.submit("k", upstream, executor)]
+        futures += [flights.submit("k", lambda: pytest.fail("ran twice"), executor) for _ in range(3)]
+        assert all(f is futures[0] for f in futures)
+        assert (flights.leaders, flights.followers) == (1, 3)
+        finish.set()
+        with pytest.raises(ValueError):
+            futures[0].result(1.0)
+        assert flights.stats()["in_flight"] == 0
+        # The failed call is not remembered
+        assert flights.submit("k", lambda: 1, executor).result(1.0) == 1
+
+
+def test_single_flight_async_followers_share_the_leaders_error():
+    flights = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream")
+
+    async def run():
+        return await asyncio.gather(*(flights.ado("k", upstream) for _ in range(4)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(r, ValueError) for r in results)
+    assert (flights.leaders, flights.followers) == (1, 3)
+
+
+def test_single_flight_cancelled_leader_does_not_fail_followers():
+    flights = SingleFlight()
+
+    async def upstream():
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    async def run():
+        leader = asyncio.ensure_future(flights.ado("k", upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.ado("k", upstream))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == "ok"
+
+
+def breaker(**kwargs):
+    return CircuitBreaker(**dict(dict(window=10, min_calls=4, error_rate=0.5, slow_p95=1.0, cooldown=60.0), **kwargs))
+
+
+def test_breaker_opens_on_error_rate():
+    b = breaker()
+    for ok in (True, False, True):
+        b.record(ok, 0.1)
+    # Below min_calls nothing is judged
+    assert b.state == b.CLOSED
+    b.record(False, 0.1)
+    assert b.state == b.OPEN and b.opened == 1
+    assert not b.allow() and b.refused == 1
+
+
+def test_breaker_opens_on_p95_latency():
+    b = breaker()
+    for _ in range(3):
+        b.record(True, 0.1)
+    b.record(True, 1.5)
+    assert b.state == b.OPEN
+
+
+def test_breaker_judges_only_the_window():
+    b = breaker(window=4)
+    for ok in (False, True, True, True, True):
+        b.record(ok, 0.1)
+    assert b.stats()["window_calls"] == 4 and b.stats()["window_errors"] == 0
+    # Two of the last four failing opens it; the first error has left the window
+    b.record(False, 0.1)
+    assert b.state == b.CLOSED
+    b.record(False, 0.1)
+    assert b.state == b.OPEN
+
+
+def test_breaker_ignores_outcomes_while_open():
+    b = breaker()
+    for _ in range(4):
+        b.record(False, 0.1)
+    b.record(True, 0.1)
+    assert b.state == b.OPEN
+    assert b.stats()["window_calls"] == 4
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success():
+    b = breaker(cooldown=0.0)
+    for _ in range(4):
+        b.record(False, 0.1)
+    assert b.allow()
+    assert b.state == b.HALF_OPEN
+    assert not b.allow()
+    b.record(True, 0.1)
+    assert b.state == b.CLOSED
+    assert b.stats()["window_calls"] == 0
+    assert b.allow() and b.allow()
+
+
+@pytest.mark.parametrize("ok, seconds", [(False, 0.1), (True, 2.0)])
+def test_failed_or_slow_probe_reopens(ok, seconds):
+    b = breaker(cooldown=0.02)
+    for _ in range(4):
+        b.record(False, 0.1)
+    assert not b.allow()
+    time.sleep(0.03)
+    assert b.allow()
+    b.record(ok, seconds)
+    assert b.state == b.OPEN and b.opened == 2
+    assert not b.allow()
+
+
+def test_abandoned_probe_frees_the_slot():
+    b = breaker(cooldown=0.0)
+    for _ in range(4):
+        b.record(False, 0.1)
+    assert b.allow() and not b.allow()
+    b.abandon()
+    assert b.state == b.HALF_OPEN
+    assert b.allow()
+    # Abandoning outside a probe changes nothing
+    closed = breaker()
+    closed.abandon()
+    assert closed.state == closed.CLOSED and closed.allow()
+
+
+def test_breaker_is_on_unless_disabled(monkeypatch):
+    monkeypatch.delenv("MOODIFY_LLM_BREAKER", raising=False)
+    monkeypatch.setenv("MOODIFY_LLM_BREAKER_MIN_CALLS", "7")
+    assert LLMClient.from_env().breaker.min_calls == 7
+    monkeypatch.setenv("MOODIFY_LLM_BREAKER", "0")
+    assert LLMClient.from_env().breaker is None
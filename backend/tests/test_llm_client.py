@@ -0,0 +1,195 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import httpx
+import pytest
+import requests
+
+from llm_client import LLMClient, LLMError, LLMRejected
+from llm_stub import StubServer
+from pipeline import StageTimer
+from utils import _chat_body, _extraction_body
+
+BODY = _extraction_body("some happy pop music")
+EXPECTED = '{"genre": "pop", "mood": "happy", "tempo": null, "artist_or_song": null}'
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(**settings):
+        server = StubServer(**settings).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def client_for(stub, **settings) -> LLMClient:
+    return LLMClient(url=stub.url, backoff=0.01, **settings)
+
+
+def content(data: dict) -> str:
+    return data["choices"][0]["message"]["content"]
+
+
+def with_budget(budget: float, fn):
+    # StageTimer sets the current timer; a copied context keeps it out of other tests
+    def run():
+        StageTimer("test", budget)
+        return fn()
+    return contextvars.copy_context().run(run)
+
+
+def test_sync_post(stub_server):
+    stub = stub_server()
+    assert content(client_for(stub).post(BODY, "key", kind="extract")) == EXPECTED
+
+
+def test_async_post(stub_server):
+    stub = stub_server()
+
+    async def run(client):
+        try:
+            return await client.apost(BODY, "key", kind="extract")
+        finally:
+            await client.aclose()
+
+    assert content(asyncio.run(run(client_for(stub)))) == EXPECTED
+
+
+def test_sync_retries_until_success(stub_server):
+    stub = stub_server(fail_first=2)
+    assert content(client_for(stub, max_retries=2).post(BODY, "key")) == EXPECTED
+    assert stub.requests == 3
+
+
+def test_async_retries_until_success(stub_server):
+    stub = stub_server(fail_first=2)
+    client = client_for(stub, max_retries=2)
+    assert content(asyncio.run(client.apost(BODY, "key"))) == EXPECTED
+    assert stub.requests == 3
+
+
+def test_sync_gives_up_after_retries(stub_server):
+    stub = stub_server(fail_rate=1.0)
+    with pytest.raises(requests.HTTPError):
+        client_for(stub, max_retries=1).post(BODY, "key")
+    assert stub.requests == 2
+
+
+def test_async_gives_up_after_retries(stub_server):
+    stub = stub_server(fail_rate=1.0)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(client_for(stub, max_retries=1).apost(BODY, "key"))
+    assert stub.requests == 2
+
+
+def test_sync_read_timeout(stub_server):
+    stub = stub_server(latency=1.0)
+    start = time.perf_counter()
+    with pytest.raises(LLMError):
+        client_for(stub, timeout=0.2, max_retries=0).post(BODY, "key")
+    assert time.perf_counter() - start < 0.9
+
+
+def test_async_read_timeout(stub_server):
+    stub = stub_server(latency=1.0)
+    start = time.perf_counter()
+    with pytest.raises(LLMError):
+        asyncio.run(client_for(stub, timeout=0.2, max_retries=0).apost(BODY, "key"))
+    assert time.perf_counter() - start < 0.9
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_sync_latency_budget(stub_server, coalesce):
+    stub = stub_server(latency=1.0)
+    client = client_for(stub, coalesce=coalesce)
+    start = time.perf_counter()
+    with pytest.raises(LLMError):
+        with_budget(0.3, lambda: client.post(BODY, "key"))
+    assert time.perf_counter() - start < 0.8
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_async_latency_budget(stub_server, coalesce):
+    stub = stub_server(latency=1.0)
+
+    async def run():
+        StageTimer("test", 0.3)
+        return await client_for(stub, coalesce=coalesce).apost(BODY, "key")
+
+    start = time.perf_counter()
+    with pytest.raises(LLMError):
+        asyncio.run(run())
+    assert time.perf_counter() - start < 0.8
+
+
+def test_sync_follower_outlasts_the_leaders_budget(stub_server):
+    stub = stub_server(latency=0.5)
+    client = client_for(stub)
+    results = {}
+
+    def call(name, budget):
+        try:
+            results[name] = content(with_budget(budget, lambda: client.post(BODY, "key")))
+        except LLMError as e:
+            results[name] = e
+
+    leader = threading.Thread(target=call, args=("leader", 0.2))
+    leader.start()
+    while not client.flights.leaders:
+        time.sleep(0.001)
+    call("follower", 2.0)
+    leader.join()
+    assert isinstance(results["leader"], LLMError)
+    assert results["follower"] == EXPECTED
+    assert stub.requests == 1 and client.flights.followers == 1
+
+
+def test_spent_budget_is_not_sent(stub_server):
+    stub = stub_server()
+    with pytest.raises(LLMRejected) as error:
+        with_budget(0.05, lambda: client_for(stub).post(BODY, "key"))
+    assert error.value.reason == "deadline"
+    assert stub.requests == 0
+
+
+def test_identical_async_calls_share_one_request(stub_server):
+    stub = stub_server(latency=0.2)
+    client = client_for(stub)
+
+    async def run():
+        return await asyncio.gather(*(client.apost(BODY, "key") for _ in range(8)))
+
+    replies = asyncio.run(run())
+    assert [content(r) for r in replies] == [EXPECTED] * 8
+    assert stub.requests == 1
+    assert client.flights.followers == 7
+
+
+def test_stream(stub_server):
+    stub = stub_server()
+    body = _chat_body({"song": "wild night", "artist": "kata"}, {"mood": "happy"})
+
+    async def run():
+        return [delta async for delta in client_for(stub).astream(body, "key")]
+
+    deltas = asyncio.run(run())
+    assert len(deltas) > 1
+    assert "".join(deltas) == "Here is a stub reply about a great song you might enjoy."
+
+
+def test_stream_retries_before_first_token(stub_server):
+    stub = stub_server(fail_first=1)
+
+    async def run():
+        return "".join([delta async for delta in client_for(stub, max_retries=1).astream(BODY, "key")])
+
+    assert asyncio.run(run()) == EXPECTED
+    assert stub.requests == 2
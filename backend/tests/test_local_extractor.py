@@ -0,0 +1,76 @@
+import json
+import os
+
+import pytest
+
+import local_extractor
+from local_extractor import evaluate, extract_locally
+from search_index import ArtistMentionDetector
+
+RECORDED = os.path.join(os.path.dirname(__file__), "data", "recorded_extractions.jsonl")
+ARTISTS = ["Adele", "Taylor Swift", "The Weeknd", "Bruno Mars", "Heart", "Train", "Queen", "Happy"]
+
+
+@pytest.fixture(autouse=True)
+def artists():
+    previous = local_extractor._artist_detector
+    local_extractor.set_artist_detector(ArtistMentionDetector(ARTISTS))
+    yield
+    local_extractor.set_artist_detector(previous)
+
+
+def recorded() -> list:
+    with open(RECORDED) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_confident_extractions_agree_with_recorded_llm():
+    report = evaluate(recorded(), threshold=1.0)
+    assert report["disagreements"] == []
+    assert report["llm_calls_avoided"] >= 15
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("sad", {"mood": "sad"}),
+    ("upbeat pop", {"genre": "pop", "tempo": "fast"}),
+    ("something chill by Taylor Swift", {"mood": "calm", "artist_or_song": "Taylor Swift"}),
+    ("some hip-hop for my workout", {"genre": "hip hop", "mood": "energetic"}),
+    ("happy", {"mood": "happy"}),
+])
+def test_confident(message, expected):
+    prefs, confidence = extract_locally(message)
+    assert confidence == 1.0
+    assert {k: v for k, v in prefs.items() if v} == expected
+
+
+@pytest.mark.parametrize("message", [
+    # Everyday senses of mood words
+    "I'm down for some pop",
+    "something blue-ish",
+    "feeling blue",
+    "feeling down",
+    # Similarity requests keep their intent for the LLM
+    "something like Adele",
+    "songs similar to Taylor Swift",
+    "in the style of The Weeknd",
+    # One-word artist names that are ordinary words
+    "I have a heart of gold",
+    "play Adele",
+    # Negations and conflicts
+    "not sad",
+    "pop rock",
+    "sad happy",
+])
+def test_left_to_llm(message):
+    assert extract_locally(message)[1] < 1.0
+
+
+def test_ambiguous_words_never_set_mood():
+    for message in ("I'm down for some pop", "something blue", "blue"):
+        assert extract_locally(message)[0]["mood"] is None
+
+
+def test_artist_named_like_a_mood_is_a_mood():
+    prefs, confidence = extract_locally("happy pop")
+    assert prefs == {"genre": "pop", "mood": "happy", "tempo": None, "artist_or_song": None}
+    assert confidence == 1.0
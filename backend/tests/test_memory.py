@@ -0,0 +1,133 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from memory import InMemorySessionStore, SessionConflict, SessionMemory, SQLiteSessionStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def memory(request, tmp_path):
+    store = InMemorySessionStore() if request.param == "memory" else SQLiteSessionStore(str(tmp_path / "s.db"))
+    return SessionMemory(store=store, ttl=60, max_sessions=3, max_history=5, sweep_interval=0)
+
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    return str(tmp_path / "sessions.db")
+
+
+def test_round_trip(memory):
+    session = memory.get_session("a")
+    session["genre"] = "pop"
+    session["history"].append(("song", "artist"))
+    memory.save_session("a", session)
+    loaded = memory.get_session("a")
+    assert loaded["genre"] == "pop"
+    assert list(loaded["history"]) == [("song", "artist")]
+
+
+def test_history_and_session_count_are_bounded(memory):
+    session = memory.get_session("a")
+    for i in range(10):
+        session["history"].append((f"song {i}", "artist"))
+    memory.save_session("a", session)
+    assert [song for song, _ in memory.get_session("a")["history"]] == [f"song {i}" for i in range(5, 10)]
+    for session_id in "bcde":
+        memory.get_session(session_id)
+    assert len(memory.store) == 3
+
+
+def test_expired_session_starts_fresh(memory):
+    session = memory.get_session("a")
+    session["mood"] = "sad"
+    memory.save_session("a", session)
+    memory.ttl = -1
+    memory.sweep_interval = float("inf")
+    assert memory.get_session("a")["mood"] is None
+    assert memory.expirations == 1
+
+
+def test_stale_save_is_refused(sqlite_path):
+    # Two workers load the same session; the second to save loses instead of overwriting
+    first = SessionMemory(store=SQLiteSessionStore(sqlite_path))
+    second = SessionMemory(store=SQLiteSessionStore(sqlite_path))
+    first.get_session("a")
+    mine, theirs = first.get_session("a"), second.get_session("a")
+    mine["genre"] = "pop"
+    first.save_session("a", mine)
+    theirs["genre"] = "rock"
+    with pytest.raises(SessionConflict):
+        second.save_session("a", theirs)
+    assert second.conflicts == 1
+    assert second.get_session("a")["genre"] == "pop"
+    # Reloaded, the same change goes through
+    fresh = second.get_session("a")
+    fresh["genre"] = "rock"
+    second.save_session("a", fresh)
+    assert first.get_session("a")["genre"] == "rock"
+
+
+def test_concurrent_creation_keeps_the_first(sqlite_path):
+    first = SessionMemory(store=SQLiteSessionStore(sqlite_path))
+    second = SessionMemory(store=SQLiteSessionStore(sqlite_path))
+    created = first.get_session("a")
+    created["mood"] = "happy"
+    first.save_session("a", created)
+    # second never saw the row: its new record would insert at the same version
+    record = second.store.load("a")[1]
+    record.version = 0
+    with pytest.raises(SessionConflict):
+        second.save_session("a", record)
+
+
+def test_reset_wins_over_a_running_turn(sqlite_path):
+    memory = SessionMemory(store=SQLiteSessionStore(sqlite_path))
+    turn = memory.get_session("a")
+    memory.reset_session("a")
+    turn["genre"] = "pop"
+    with pytest.raises(SessionConflict):
+        memory.save_session("a", turn)
+    assert memory.get_session("a")["genre"] is None
+
+
+def test_old_table_gains_a_version_column(sqlite_path):
+    db = sqlite3.connect(sqlite_path)
+    db.execute("CREATE TABLE sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, touched_at REAL NOT NULL)")
+    db.execute("INSERT INTO sessions VALUES ('a', '{\"genre\": \"jazz\"}', 1e12)")
+    db.commit()
+    db.close()
+    memory = SessionMemory(store=SQLiteSessionStore(sqlite_path), ttl=1e13)
+    session = memory.get_session("a")
+    assert session["genre"] == "jazz"
+    memory.save_session("a", session)
+
+
+def test_locked_serializes_turns_of_one_session(memory):
+    events = []
+
+    async def turn(session_id, name):
+        async with memory.locked(session_id):
+            events.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            events.append(f"{name} end")
+
+    async def run():
+        await asyncio.gather(turn("a", "1"), turn("a", "2"), turn("b", "3"))
+
+    asyncio.run(run())
+    assert events.index("1 end") < events.index("2 start")
+    assert events.index("3 start") < events.index("1 end")
+    assert memory._locks == {}
+
+
+def test_locked_takes_several_sessions_in_order(memory):
+    async def turn(*session_ids):
+        async with memory.locked(*session_ids):
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.wait_for(asyncio.gather(turn("a", "b"), turn("b", "a"), turn("a")), 1)
+
+    asyncio.run(run())
+    assert memory._locks == {}
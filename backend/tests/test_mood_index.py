@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+
+from catalog import MoodIndex
+
+
+MOODS = ["happy", "sad", "energetic", "calm"]
+
+
+@pytest.fixture(scope="module")
+def features(eng):
+    return eng.catalog.feature_matrix
+
+
+@pytest.mark.parametrize("mood", MOODS)
+def test_similarity_matches_cosine_similarity(eng, features, mood):
+    expected = cosine_similarity(np.array(eng.MOOD_VECTORS[mood]).reshape(1, -1), features).flatten()
+    assert np.allclose(eng.catalog.moods.column(mood), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("mood", MOODS)
+def test_order_is_a_stable_sort_by_similarity(eng, mood):
+    moods = eng.catalog.moods
+    similarity = moods.column(mood)
+    order = moods.ordered(mood)
+    assert np.array_equal(order, np.argsort(-similarity, kind="stable"))
+    assert np.array_equal(moods.rank[moods._lookup[mood]][order], np.arange(len(order)))
+
+
+def test_subsets_keep_the_catalog_order(eng):
+    moods = eng.catalog.moods
+    rng = np.random.default_rng(0)
+    mask = rng.random(eng.catalog.size) < 0.3
+    subset = np.nonzero(mask)[0]
+    rng.shuffle(subset)
+    for mood in moods.moods:
+        ordered = moods.ordered(mood, mask)
+        assert np.array_equal(moods.sort(mood, subset), ordered)
+        assert np.array_equal(np.sort(ordered), np.nonzero(mask)[0])
+
+
+def test_zero_vectors_score_zero():
+    features = np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+    index = MoodIndex(features, {"up": [0.0, 1.0], "none": [0.0, 0.0]})
+    assert np.allclose(index.column("up"), cosine_similarity([[0.0, 1.0]], features).flatten())
+    assert not index.column("none").any()
+    assert list(index.ordered("up")) == [2, 0, 1]
+    assert "none" in index and "down" not in index
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tests.helpers import brute_force_neighbors
+from catalog import NeighborIndex
+
+SEEDS = list(range(0, 300, 23))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("k", [1, 10, 299])
+def test_kd_tree_matches_a_full_scan(eng, seed, k):
+    got, got_dist = eng.catalog.neighbors.nearest(eng.catalog.feature_matrix[seed], k, np.array([seed]))
+    want, want_dist = brute_force_neighbors(eng, seed, k, np.array([seed]))
+    assert np.allclose(got_dist, want_dist)
+    assert seed not in got
+    # Equal distances may come back in either order
+    assert set(got[got_dist < want_dist[-1]]) == set(want[want_dist < want_dist[-1]])
+
+
+def test_repeated_tracks_are_returned_once():
+    features = np.array([[0.0], [1.0], [1.5], [2.0], [5.0]])
+    index = NeighborIndex(features, pd.Series(["a", "b", "b", "c", None]))
+    rows, distances = index.nearest([0.0], 4, np.array([0]))
+    assert list(rows) == [1, 3, 4]
+    assert list(distances) == [1.0, 2.0, 5.0]
+    assert list(index.rows_of_id("b")) == [1, 2]
+    assert not len(index.rows_of_id("zz"))
+
+
+def test_similar_songs_skips_seed_and_history(eng):
+    track_id = eng.df["track_id"].iloc[SEEDS[1]]
+    first = eng.similar_songs(track_id=track_id, k=5)
+    assert first["seed"]["spotify_url"].endswith(track_id)
+    played = [(song["song"], song["artist"]) for song in first["results"][:2]]
+    second = eng.similar_songs(track_id=track_id, k=5, history=played)
+    assert not {(s["song"], s["artist"]) for s in second["results"]} & set(played)
+    assert [s["distance"] for s in second["results"]] == sorted(s["distance"] for s in second["results"])
+
+
+def test_unknown_seed(eng):
+    assert eng.similar_songs(track_id="nope") is None
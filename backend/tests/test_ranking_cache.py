@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from tests.helpers import PREFERENCE_MIX, run_session
+from ranking_cache import Ranking, RankingCache, top_k
+
+
+@pytest.fixture
+def cache(eng, monkeypatch):
+    monkeypatch.setattr(eng.ranking_cache, "max_size", 512)
+    eng.ranking_cache.invalidate()
+    yield eng.ranking_cache
+    eng.ranking_cache.invalidate()
+
+
+@pytest.mark.parametrize("prefs", PREFERENCE_MIX, ids=str)
+def test_cached_sessions_match_uncached(eng, cache, monkeypatch, prefs):
+    # Past HEAD_SIZE turns the cached head is exhausted and the rest of the ranking is searched
+    with monkeypatch.context() as uncached_cache:
+        uncached_cache.setattr(cache, "max_size", 0)
+        uncached = run_session(eng, prefs, 300)
+    hits = cache.hits
+    assert run_session(eng, prefs, 300) == uncached
+    assert cache.hits - hits == 299
+
+
+def test_key_ignores_case_and_empty_values(eng):
+    assert eng.ranking_key({"genre": "Pop", "mood": "happy", "tempo": "", "artist_or_song": None}) == \
+        eng.ranking_key({"genre": "pop", "mood": "happy"})
+
+
+def test_free_text_mood_is_resolved_on_hits(eng, cache):
+    first, second = {"mood": "party"}, {"mood": "party"}
+    eng.ranked_candidates(first)
+    hits = cache.hits
+    eng.ranked_candidates(second)
+    assert cache.hits - hits == 1
+    assert first["mood"] == second["mood"] != "party"
+
+
+def test_stale_rankings_are_dropped():
+    cache = RankingCache(max_size=2)
+    ranking = Ranking(np.arange(3), np.zeros(3), False, None, {})
+    version = cache.version
+    cache.invalidate()
+    cache.put(("a",), ranking, version)
+    assert cache.get(("a",)) is None
+    cache.put(("a",), ranking, cache.version)
+    assert cache.get(("a",)) is ranking
+    cache.invalidate()
+    assert cache.get(("a",)) is None
+
+
+def test_bounded_by_entries_and_rows():
+    cache = RankingCache(max_size=2, max_rows=5)
+    rankings = [Ranking(np.arange(n), np.zeros(n), False, None, {}) for n in (2, 2, 2, 6)]
+    for i, ranking in enumerate(rankings):
+        cache.put((i,), ranking, cache.version)
+    assert cache.get((0,)) is None and cache.get((1,)) is rankings[1] and cache.get((2,)) is rankings[2]
+    assert cache.get((3,)) is None
+    assert cache.stats()["rows"] == 4
+
+
+@pytest.mark.parametrize("k", [1, 3, 10, 20])
+def test_top_k_keeps_candidate_order_on_ties(k):
+    scores = np.random.default_rng(0).integers(0, 4, size=20).astype(float)
+    assert np.array_equal(top_k(scores, k), np.lexsort((np.arange(20), -scores))[:k])
@@ -0,0 +1,39 @@
+import itertools
+
+import numpy as np
+import pytest
+
+PREFERENCES = [
+    {"genre": genre, "mood": mood, "tempo": tempo, "artist_or_song": artist}
+    for genre, mood, tempo, artist in itertools.product(
+        [None, "pop", "r&b", "ro"],
+        [None, "happy", "sad", "melancholy", "calm", "party"],
+        [None, "slow", "fast", "chill", "medium"],
+        [None, "ka", "love"],
+    )
+]
+
+
+def legacy_scores(eng, rows, prefs) -> np.ndarray:
+    return eng.df.iloc[rows].apply(lambda row: eng.weighted_score(row, prefs), axis=1).to_numpy(dtype=np.float64)
+
+
+@pytest.mark.parametrize("prefs", PREFERENCES, ids=str)
+def test_vectorized_scores_equal_weighted_score(eng, prefs):
+    rows = eng.catalog.all_rows()
+    assert np.array_equal(eng.scorer.score(rows, prefs), legacy_scores(eng, rows, prefs))
+
+
+@pytest.mark.parametrize("prefs", PREFERENCES, ids=str)
+def test_pick_is_best_weighted_score(eng, prefs):
+    # The first candidate with the highest weighted_score, as recommend_engine picks it
+    prefs = dict(prefs)
+    # candidate_rows maps free-text moods to known ones, as recommend_engine scores them
+    rows, _, _ = eng.candidate_rows(prefs)
+    expected = rows[np.argmax(legacy_scores(eng, rows, prefs))]
+    ranking = eng.ranked_candidates(dict(prefs))
+    assert ranking.rows[ranking.best(np.zeros(0, dtype=np.int64))] == expected
+
+
+def test_scores_empty_candidates(eng):
+    assert eng.scorer.score(np.zeros(0, dtype=np.int64), PREFERENCES[-1]).shape == (0,)
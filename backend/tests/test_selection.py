@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from tests.helpers import PREFERENCE_MIX, legacy_select
+
+PREFERENCES = [p for p in PREFERENCE_MIX if p["artist_or_song"] is None]
+
+
+def reference_pick(eng, rows, scores, history):
+    # First song not in history by descending score, ties in candidate order; the best overall if all are played
+    order = np.lexsort((np.arange(len(rows)), -scores))
+    played = set(history)
+    for i in order:
+        row = eng.df.iloc[rows[i]]
+        if (row["track_name"], row["track_artist"]) not in played:
+            return rows[i]
+    return rows[order[0]]
+
+
+def pair(eng, row):
+    return eng.df["track_name"].iloc[row], eng.df["track_artist"].iloc[row]
+
+
+@pytest.mark.parametrize("prefs", PREFERENCES, ids=str)
+@pytest.mark.parametrize("played", [0, 1, 10, 255, 256, 299, 300])
+def test_pick_skips_the_best_played_songs(eng, prefs, played):
+    # Worst case for the old loop: the best `played` candidates were all recommended already
+    prefs = dict(prefs)
+    rows, _, _ = eng.candidate_rows(prefs)
+    scores = eng.scorer.score(rows, prefs)
+    order = np.lexsort((np.arange(len(rows)), -scores))
+    history = [pair(eng, rows[i]) for i in order[:played]]
+    expected = reference_pick(eng, rows, scores, history)
+
+    got = eng.recommend_engine(dict(prefs, history=list(history)))
+    assert (got["song"], got["artist"]) == pair(eng, expected)
+    # The old sort-and-iterrows pick lands on an equally scored song
+    legacy = legacy_select(eng, rows, prefs, history)
+    assert legacy["weighted_score"] == scores[list(rows).index(expected)]
+
+
+def test_pick_is_appended_to_history(eng):
+    session = dict(PREFERENCES[0], history=[])
+    picks = [eng.recommend_engine(session) for _ in range(5)]
+    assert session["history"] == [(p["song"], p["artist"]) for p in picks]
+    assert len(set(session["history"])) == 5
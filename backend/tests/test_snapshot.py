@@ -0,0 +1,75 @@
+import mmap
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tests.helpers import PREFERENCE_MIX
+import snapshot as snapshot_module
+from snapshot import read_manifest, read_snapshot
+
+
+def memory_mapped(values: np.ndarray) -> bool:
+    while values is not None:
+        if isinstance(values, (np.memmap, mmap.mmap)):
+            return True
+        values = getattr(values, "base", None)
+    return False
+
+
+@pytest.fixture(scope="module")
+def snapshot(eng):
+    eng.compile_snapshot()
+    return read_snapshot(eng.SNAPSHOT_PATH, eng.DATA_PATH, eng.SNAPSHOT_KEY)
+
+
+def test_round_trip(eng, snapshot):
+    df, objects = snapshot
+    pd.testing.assert_frame_equal(df, eng.df)
+    rows = eng.catalog.all_rows()
+    for prefs in PREFERENCE_MIX:
+        assert np.array_equal(objects["scorer"].score(rows, prefs), eng.scorer.score(rows, prefs))
+    assert np.array_equal(objects["catalog"].moods.order, eng.catalog.moods.order)
+
+
+def test_columns_stay_memory_mapped(snapshot):
+    # Building the frame must not copy the arrays, or forked workers stop sharing their pages
+    df, _ = snapshot
+    for name in df.columns:
+        values = df[name].array
+        if isinstance(values, pd.Categorical):
+            assert memory_mapped(values.codes), name
+        elif df[name].dtype.kind in "biuf":
+            assert memory_mapped(df[name].to_numpy()), name
+
+
+def test_index_arrays_stay_memory_mapped(snapshot):
+    _, objects = snapshot
+    catalog = objects["catalog"]
+    for values in (catalog.feature_matrix, catalog.tempo_raw, catalog.genre_codes, catalog.moods.order,
+                   catalog.buckets.positions, catalog.neighbors.id_codes):
+        assert memory_mapped(values)
+
+
+def test_stale_snapshot_is_ignored(eng, snapshot, tmp_path):
+    other = tmp_path / "songs.csv"
+    other.write_text(open(eng.DATA_PATH).read() + "\n")
+    assert read_snapshot(eng.SNAPSHOT_PATH, str(other), eng.SNAPSHOT_KEY) is None
+
+
+def test_unchanged_source_is_not_hashed(eng, snapshot, monkeypatch):
+    monkeypatch.setattr(snapshot_module, "file_checksum", lambda path: pytest.fail("hashed the CSV"))
+    assert read_snapshot(eng.SNAPSHOT_PATH, eng.DATA_PATH, eng.SNAPSHOT_KEY) is not None
+
+
+def test_touched_source_is_hashed_once(eng, snapshot, monkeypatch):
+    stat = os.stat(eng.DATA_PATH)
+    os.utime(eng.DATA_PATH, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    hashed = []
+    checksum = snapshot_module.file_checksum
+    monkeypatch.setattr(snapshot_module, "file_checksum", lambda path: hashed.append(path) or checksum(path))
+    assert read_snapshot(eng.SNAPSHOT_PATH, eng.DATA_PATH, eng.SNAPSHOT_KEY) is not None
+    assert read_snapshot(eng.SNAPSHOT_PATH, eng.DATA_PATH, eng.SNAPSHOT_KEY) is not None
+    assert hashed == [eng.DATA_PATH]
+    assert read_manifest(eng.SNAPSHOT_PATH)["source_mtime_ns"] == stat.st_mtime_ns + 10 ** 9
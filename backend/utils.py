@@ -1,17 +1,19 @@
 import difflib
-import requests
 import json
 import re
 import pandas as pd
 import base64
+import hashlib
+import logging
 import os
 
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-
-GENRES = {
-    "pop", "rock", "classical", "jazz", "metal", "electronic", "hip hop", "rap",
-    "r&b", "lofi", "latin", "folk", "reggae", "country", "blues", "indie"
-}
+from llm_client import GROQ_API_URL, llm
+from llm_cache import PreferenceCache
+from metrics import EXTRACTIONS
+from pipeline import note
+from local_extractor import extract_locally
+from search_index import lower_strings
+from vocab import GENRES
 
 NONE_LIKE = {
     "no", "none", "nah", "not really", "nothing", "any", "anything", "whatever",
@@ -49,15 +51,22 @@ def bpm_to_tempo_category(bpm: float) -> str:
     else:
         return "fast"
 
-def fuzzy_match_artist_song(df, query: str):
+def fuzzy_match_artist_song(df, query: str, index=None):
     if not isinstance(query, str):
-        print(f"Invalid query type: {type(query)}. Expected a string.")
+        logging.warning("Invalid query type: %s. Expected a string.", type(query))
         return df.head(5)
 
     query = query.lower()
-    print(f"Performing fuzzy match for query: {query}")
-    df['track_artist'] = df['track_artist'].fillna("").astype(str).str.lower()
-    df['track_name'] = df['track_name'].fillna("").astype(str).str.lower()
+    logging.debug("Performing fuzzy match for query: %s", query)
+    if index is not None:
+        # index is a search_index.NameIndex built over this same df
+        df = df.iloc[index.match_rows(query)].copy()
+        df['track_artist'] = lower_strings(df['track_artist'])
+        df['track_name'] = lower_strings(df['track_name'])
+        return df
+
+    df['track_artist'] = lower_strings(df['track_artist'])
+    df['track_name'] = lower_strings(df['track_name'])
 
     artist_matches = difflib.get_close_matches(query, df['track_artist'], n=5, cutoff=0.6)
     song_matches = difflib.get_close_matches(query, df['track_name'].str.lower(), n=5, cutoff=0.6)
@@ -69,12 +78,7 @@ def fuzzy_match_artist_song(df, query: str):
     else:
         return df.nlargest(5, 'popularity') if 'popularity' in df.columns else df.head(5)
 
-def generate_chat_response(song_dict: dict, preferences: dict, api_key: str, custom_prompt: str = None) -> str:
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-
+def _chat_body(song_dict: dict, preferences: dict, custom_prompt: str = None) -> dict:
     genre = preferences.get('genre') or "any"
     mood = preferences.get('mood') or "any"
     tempo = preferences.get('tempo') or "any"
@@ -82,7 +86,6 @@ def generate_chat_response(song_dict: dict, preferences: dict, api_key: str, cus
     artist = song_dict.get('artist', 'Unknown')
     song_genre = song_dict.get('genre', 'Unknown')
     song_tempo = song_dict.get('tempo', 'Unknown')
-    spotify_url = song_dict.get('spotify_url')
 
     prompt = custom_prompt or f"""
 The user wants a song that matches these preferences:
@@ -92,7 +95,7 @@ Reply in a warm and friendly tone. Your response must be short and concise — n
 Don't suggest alternatives or explain why. Mention only this one song.
 """
 
-    body = {
+    return {
         "model": "llama3-70b-8192",
         "messages": [
             {"role": "system", "content": "You are a helpful music assistant. Respond in under 1.5 sentences."},
@@ -102,23 +105,106 @@ Don't suggest alternatives or explain why. Mention only this one song.
         "max_tokens": 200
     }
 
+def _chat_message(data: dict, song_dict: dict) -> str:
+    message = data["choices"][0]["message"]["content"].strip()
+    spotify_url = song_dict.get('spotify_url')
+    if spotify_url:
+        message += f' 🎵 <a href="{spotify_url}" target="_blank">Listen on Spotify</a>'
+    return message
+
+def chat_fallback(song_dict: dict) -> str:
+    song = song_dict.get('song', 'Unknown')
+    artist = song_dict.get('artist', 'Unknown')
+    spotify_url = song_dict.get('spotify_url')
+    return f"🎵 Here’s a great track: '{song}' by {artist}." + (f' <a href="{spotify_url}" target="_blank">Listen</a>' if spotify_url else "")
+
+def generate_chat_response(song_dict: dict, preferences: dict, api_key: str, custom_prompt: str = None) -> str:
     try:
-        response = requests.post(GROQ_API_URL, headers=headers, json=body)
-        response.raise_for_status()
-        message = response.json()["choices"][0]["message"]["content"].strip()
-        if spotify_url:
-            message += f' 🎵 <a href="{spotify_url}" target="_blank">Listen on Spotify</a>'
-        return message
+        data = llm.post(_chat_body(song_dict, preferences, custom_prompt), api_key, kind="chat")
+        return _chat_message(data, song_dict)
     except Exception as e:
-        print("Groq Chat Error:", e)
-        return f"🎵 Here’s a great track: '{song}' by {artist}." + (f' <a href="{spotify_url}" target="_blank">Listen</a>' if spotify_url else "")
+        logging.warning("Groq Chat Error: %s", e)
+        return chat_fallback(song_dict)
 
-def extract_preferences_from_message(message: str, api_key: str) -> dict:
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
+async def agenerate_chat_response(song_dict: dict, preferences: dict, api_key: str, custom_prompt: str = None) -> str:
+    try:
+        data = await llm.apost(_chat_body(song_dict, preferences, custom_prompt), api_key, kind="chat")
+        return _chat_message(data, song_dict)
+    except Exception as e:
+        logging.warning("Groq Chat Error: %s", e)
+        return chat_fallback(song_dict)
+
+async def astream_chat_response(song_dict: dict, preferences: dict, api_key: str, custom_prompt: str = None):
+    # Token-by-token generate_chat_response; falls back to the template if nothing arrives
+    emitted = False
+    try:
+        async for token in llm.astream(_chat_body(song_dict, preferences, custom_prompt), api_key, kind="chat"):
+            if not emitted:
+                token = token.lstrip()
+                if not token:
+                    continue
+            emitted = True
+            yield token
+    except Exception as e:
+        logging.warning("Groq Chat Error: %s", e)
+        if not emitted:
+            yield chat_fallback(song_dict)
+            return
+    spotify_url = song_dict.get('spotify_url')
+    if spotify_url:
+        yield f' 🎵 <a href="{spotify_url}" target="_blank">Listen on Spotify</a>'
+
+# Songs named in a playlist summary prompt; the rest are only counted
+PLAYLIST_PROMPT_SONGS = 10
+
+def _playlist_body(songs: list, preferences: dict) -> dict:
+    genre = preferences.get('genre') or "any"
+    mood = preferences.get('mood') or "any"
+    tempo = preferences.get('tempo') or "any"
+    listed = "\n".join(f'- "{s.get("song", "Unknown")}" by {s.get("artist", "Unknown")}' for s in songs[:PLAYLIST_PROMPT_SONGS])
+    more = len(songs) - PLAYLIST_PROMPT_SONGS
+    if more > 0:
+        listed += f"\n...and {more} more."
+
+    prompt = f"""
+The user asked for a playlist matching these preferences:
+Genre: {genre}, Mood: {mood}, Tempo: {tempo}.
+It has {len(songs)} songs, including:
+{listed}
+Introduce the playlist in a warm and friendly tone in no more than 2 sentences.
+Don't list every song or suggest alternatives.
+"""
+
+    return {
+        "model": "llama3-70b-8192",
+        "messages": [
+            {"role": "system", "content": "You are a helpful music assistant. Respond in under 2 sentences."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.6,
+        "max_tokens": 200
     }
 
+def playlist_fallback(songs: list) -> str:
+    if not songs:
+        return "I couldn't find songs for that playlist. Try different preferences?"
+    first = songs[0]
+    return f"🎵 Here’s a playlist of {len(songs)} songs, starting with '{first.get('song', 'Unknown')}' by {first.get('artist', 'Unknown')}."
+
+async def agenerate_playlist_summary(songs: list, preferences: dict, api_key: str) -> str:
+    # One message for a whole batch instead of one chat reply per song
+    if not songs:
+        return playlist_fallback(songs)
+    try:
+        data = await llm.apost(_playlist_body(songs, preferences), api_key, kind="playlist")
+        return data["choices"][0]["message"]["content"].strip()
+    except Exception as e:
+        logging.warning("Groq Chat Error: %s", e)
+        return playlist_fallback(songs)
+
+PREFERENCE_KEYS = ["genre", "mood", "tempo", "artist_or_song"]
+
+def _pre_llm_fields(message: str) -> tuple:
     msg = message.strip().lower()
 
     # --- PATCH: Robust "none-like" phrase detection ---
@@ -129,7 +215,7 @@ def extract_preferences_from_message(message: str, api_key: str) -> dict:
         return False
 
     # If message contains ANY none-like, mark ALL as "no preference"
-    none_fields = {field: contains_none_like(msg) for field in ["genre", "mood", "tempo", "artist_or_song"]}
+    none_fields = {field: contains_none_like(msg) for field in PREFERENCE_KEYS}
 
     # Fast-path: map vague mood/tempo if present (pre-LLM)
     mapped = {}
@@ -140,11 +226,10 @@ def extract_preferences_from_message(message: str, api_key: str) -> dict:
             if mapped_val == "energetic":
                 mapped["tempo"] = "fast"
             break
+    return none_fields, mapped
 
-    # --- PATCH: Robust LLM call and JSON extraction ---
-    extracted = {}
-    if not any(none_fields.values()):
-        prompt = f"""
+def _extraction_body(message: str) -> dict:
+    prompt = f"""
 You are an AI that extracts music preferences from user input.
 Respond only in valid JSON with exactly these 4 keys: genre, mood, tempo, artist_or_song.
 If a value is not explicitly or implicitly stated, use null.
@@ -161,46 +246,76 @@ Examples:
 
 Input: "{message}"
 """
-        body = {
-            "model": "llama3-70b-8192",
-            "messages": [
-                {"role": "system", "content": "You extract music preferences from user messages in JSON, copying mood and genre words exactly unless a clear synonym is used. Do NOT reinterpret 'sad' or 'indie'."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.2,
-            "max_tokens": 250
-        }
+    return {
+        "model": "llama3-70b-8192",
+        "messages": [
+            {"role": "system", "content": "You extract music preferences from user messages in JSON, copying mood and genre words exactly unless a clear synonym is used. Do NOT reinterpret 'sad' or 'indie'."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.2,
+        "max_tokens": 250
+    }
 
+def _parse_extraction(data: dict) -> dict:
+    text = data["choices"][0]["message"]["content"]
+
+    # --- PATCH: Robust JSON extraction ---
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.lstrip("`")
+        text = text[text.find("{"):]
+    match = re.search(r"\{[\s\S]*\}", text)
+    if match:
+        json_text = match.group(0)
         try:
-            response = requests.post(GROQ_API_URL, headers=headers, json=body)
-            response.raise_for_status()
-            text = response.json()["choices"][0]["message"]["content"]
-
-            # --- PATCH: Robust JSON extraction ---
-            text = text.strip()
-            if text.startswith("```"):
-                text = text.lstrip("`")
-                text = text[text.find("{"):]
-            match = re.search(r"\{[\s\S]*\}", text)
-            if match:
-                json_text = match.group(0)
-                try:
-                    extracted = json.loads(json_text)
-                except Exception as e:
-                    print("Groq Extraction Error (inner):", e, "| Offending text:", repr(json_text))
-                    extracted = {"genre": None, "mood": None, "tempo": None, "artist_or_song": None}
-            else:
-                print("Groq Extraction Error: Could not find JSON object in:", repr(text))
-                extracted = {"genre": None, "mood": None, "tempo": None, "artist_or_song": None}
+            return json.loads(json_text)
         except Exception as e:
-            print("Groq Extraction Error:", e)
-            extracted = {"genre": None, "mood": None, "tempo": None, "artist_or_song": None}
-    else:
-        # If any explicit "none", just set them as None
-        extracted = {"genre": None, "mood": None, "tempo": None, "artist_or_song": None}
-
+            logging.warning("Groq Extraction Error (inner): %s | Offending text: %r", e, json_text)
+            return None
+    logging.warning("Groq Extraction Error: Could not find JSON object in: %r", text)
+    return None
+
+# Cache entries are tied to the exact prompt template and model
+EXTRACTION_CACHE_VERSION = hashlib.sha1(
+    json.dumps(_extraction_body("{message}"), sort_keys=True).encode()
+).hexdigest()[:12]
+extraction_cache = PreferenceCache.from_env()
+
+# Messages the local extractor explains at least this well skip the LLM
+LOCAL_EXTRACTION_THRESHOLD = float(os.getenv("MOODIFY_LOCAL_EXTRACTION_THRESHOLD", "1.0"))
+EXTRACTION_RECORD_PATH = os.getenv("MOODIFY_EXTRACTION_RECORD_PATH")
+extraction_stats = {"local": 0, "cached": 0, "llm": 0}
+
+def record_extraction(source: str):
+    extraction_stats[source] += 1
+    EXTRACTIONS.inc(source=source)
+    note("extraction", source)
+
+def _extraction_without_llm(message: str):
+    local, confidence = extract_locally(message)
+    if confidence >= LOCAL_EXTRACTION_THRESHOLD:
+        record_extraction("local")
+        return local
+    cached = extraction_cache.get(PreferenceCache.make_key(message, EXTRACTION_CACHE_VERSION))
+    if cached is not None:
+        record_extraction("cached")
+    return cached
+
+def _store_extraction(message: str, parsed) -> dict:
+    record_extraction("llm")
+    if parsed is None:
+        return {k: None for k in PREFERENCE_KEYS}
+    if isinstance(parsed, dict):
+        extraction_cache.put(PreferenceCache.make_key(message, EXTRACTION_CACHE_VERSION), parsed)
+        if EXTRACTION_RECORD_PATH:
+            # Recorded pairs feed `python local_extractor.py <file>`
+            with open(EXTRACTION_RECORD_PATH, "a") as f:
+                f.write(json.dumps({"message": message, "llm": parsed}) + "\n")
+    return parsed
+
+def _finish_extraction(extracted: dict, none_fields: dict, mapped: dict) -> dict:
     # --- Overwrite with mapped/none values and normalize ---
-    for key in ["genre", "mood", "tempo", "artist_or_song"]:
+    for key in PREFERENCE_KEYS:
         if none_fields.get(key):
             extracted[key] = None
         if key in mapped and mapped[key]:
@@ -208,9 +323,49 @@ Input: "{message}"
         if extracted.get(key) and extracted[key].strip().lower() in NONE_LIKE:
             extracted[key] = None
 
-    return {k: extracted.get(k, None) for k in ["genre", "mood", "tempo", "artist_or_song"]}
+    return {k: extracted.get(k, None) for k in PREFERENCE_KEYS}
 
+def extract_preferences_from_message(message: str, api_key: str) -> dict:
+    none_fields, mapped = _pre_llm_fields(message)
 
+    # --- PATCH: Robust LLM call and JSON extraction ---
+    # If any explicit "none", skip the LLM and leave everything as None
+    extracted = {k: None for k in PREFERENCE_KEYS}
+    if not any(none_fields.values()):
+        known = _extraction_without_llm(message)
+        if known is not None:
+            extracted = known
+        else:
+            try:
+                extracted = _store_extraction(message, _parse_extraction(llm.post(_extraction_body(message), api_key, kind="extract")))
+            except Exception as e:
+                logging.warning("Groq Extraction Error: %s", e)
+
+    return _finish_extraction(extracted, none_fields, mapped)
+
+async def aextract_preferences_from_message(message: str, api_key: str) -> dict:
+    none_fields, mapped = _pre_llm_fields(message)
+
+    extracted = {k: None for k in PREFERENCE_KEYS}
+    if not any(none_fields.values()):
+        known = _extraction_without_llm(message)
+        if known is not None:
+            extracted = known
+        else:
+            try:
+                extracted = _store_extraction(message, _parse_extraction(await llm.apost(_extraction_body(message), api_key, kind="extract")))
+            except Exception as e:
+                logging.warning("Groq Extraction Error: %s", e)
+
+    return _finish_extraction(extracted, none_fields, mapped)
+
+def guess_preferences(message: str) -> dict:
+    # What extraction yields without any LLM call; used to start work early
+    none_fields, mapped = _pre_llm_fields(message)
+    extracted = {k: None for k in PREFERENCE_KEYS}
+    if not any(none_fields.values()):
+        extracted, _ = extract_locally(message)
+    return _finish_extraction(extracted, none_fields, mapped)
 
 def map_free_text_to_mood(text: str) -> str:
     text = text.lower()
@@ -236,23 +391,9 @@ def split_mode_category(mode_category: str) -> tuple:
 def build_recommendation_key(genre: str, mood: str, energy: str, tempo: str) -> str:
     return f"{genre}_{mood.capitalize()} {energy.capitalize()}_{tempo.capitalize()}"
 
-def precompute_recommendation_map(df: pd.DataFrame) -> dict:
-    index_map = {}
-    for _, row in df.iterrows():
-        genre = row.get("playlist_genre", "unknown")
-        tempo = row.get("tempo_category", "medium")
-        mood, energy = split_mode_category(row.get("mode_category", "calm calm"))
-        key = build_recommendation_key(genre, mood, energy, tempo)
-        if key not in index_map:
-            index_map[key] = []
-        index_map[key].append(row)
-    return index_map
+NEXT_MESSAGE_FALLBACK = "What are you in the mood for today?"
 
-def next_ai_message(session: dict, last_user_message: str, api_key: str) -> str:
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+def _next_message_body(session: dict, last_user_message: str) -> dict:
     known_prefs = []
     for k in ["genre", "mood", "tempo", "artist_or_song"]:
         v = session.get(k)
@@ -293,7 +434,7 @@ If the user asks to change something, help them do so.
 Be as conversational as possible, do not use a fixed script. Reply with only your message, do not restate the session data.
 Ask a maximum of 4 questions before recommending a song.
 """
-    body = {
+    return {
         "model": "llama3-70b-8192",
         "messages": [
             {"role": "system", "content": "You are a friendly AI music assistant."},
@@ -302,10 +443,34 @@ Ask a maximum of 4 questions before recommending a song.
         "temperature": 0.7,
         "max_tokens": 200
     }
+
+def next_ai_message(session: dict, last_user_message: str, api_key: str) -> str:
+    try:
+        data = llm.post(_next_message_body(session, last_user_message), api_key, kind="next_message")
+        return data["choices"][0]["message"]["content"].strip()
+    except Exception as e:
+        logging.warning("Groq next_ai_message error: %s", e)
+        return NEXT_MESSAGE_FALLBACK
+
+async def anext_ai_message(session: dict, last_user_message: str, api_key: str) -> str:
+    try:
+        data = await llm.apost(_next_message_body(session, last_user_message), api_key, kind="next_message")
+        return data["choices"][0]["message"]["content"].strip()
+    except Exception as e:
+        logging.warning("Groq next_ai_message error: %s", e)
+        return NEXT_MESSAGE_FALLBACK
+
+async def astream_next_ai_message(session: dict, last_user_message: str, api_key: str):
+    emitted = False
     try:
-        response = requests.post(GROQ_API_URL, headers=headers, json=body)
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"].strip()
+        async for token in llm.astream(_next_message_body(session, last_user_message), api_key, kind="next_message"):
+            if not emitted:
+                token = token.lstrip()
+                if not token:
+                    continue
+            emitted = True
+            yield token
     except Exception as e:
-        print("Groq next_ai_message error:", e)
-        return "What are you in the mood for today?"
+        logging.warning("Groq next_ai_message error: %s", e)
+    if not emitted:
+        yield NEXT_MESSAGE_FALLBACK
@@ -0,0 +1,10 @@
+# Vocabularies shared by the scorer, the LLM prompts and the local preference extractor
+GENRES = {
+    "pop", "rock", "classical", "jazz", "metal", "electronic", "hip hop", "rap",
+    "r&b", "lofi", "latin", "folk", "reggae", "country", "blues", "indie"
+}
+
+SAD_MOODS = {"sad", "melancholy", "down", "emotional", "blue", "heartbreak", "gloomy"}
+HAPPY_MOODS = {"happy", "joy", "energetic", "upbeat", "party", "celebrate", "excited"}
+UPBEAT_WORDS = {"upbeat", "party", "dance", "energetic", "celebrate", "hyped", "intense"}
+SLOW_WORDS = {"slow", "ballad", "chill", "calm"}
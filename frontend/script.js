@@ -17,20 +17,7 @@ window.sendMessage = function () {
 
   showTypingIndicator();
 
-  fetch(`${backendUrl}/recommend`, {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify(preferences)
-  })
-    .then(res => res.json())
-    .then(data => {
-      const delay = calculateTypingDelay(data.response);
-      setTimeout(() => {
-        hideTypingIndicator();
-        appendBotMessage(data.response || "Something went wrong.");
-        updatePreferencesPanel(); // Always fetch sidebar from backend after bot response
-      }, delay);
-    })
+  streamBotReply("/recommend/stream", preferences)
     .catch(error => {
       console.error("API error:", error);
       hideTypingIndicator();
@@ -39,19 +26,70 @@ window.sendMessage = function () {
     });
 };
 
+// --- Streaming replies (Server-Sent Events over fetch, since EventSource can't POST) ---
+// "token" events are rendered as they arrive; "done" carries the final HTML.
+function streamBotReply(path, payload) {
+  let messageEl = null;
+  let streamed = "";
+
+  function handleEvent(raw) {
+    let event = "message";
+    let data = "";
+    raw.split("\n").forEach(line => {
+      if (line.startsWith("event:")) event = line.slice(6).trim();
+      else if (line.startsWith("data:")) data += line.slice(5).trim();
+    });
+    if (!data) return;
+    const parsed = JSON.parse(data);
+
+    if (event === "token") {
+      if (!messageEl) {
+        hideTypingIndicator();
+        messageEl = appendBotMessage("");
+      }
+      streamed += parsed.text;
+      setBotMessage(messageEl, `<span style='color:green'>${streamed}</span>`);
+    } else if (event === "done") {
+      const finish = () => {
+        hideTypingIndicator();
+        if (messageEl) setBotMessage(messageEl, parsed.response || streamed);
+        else messageEl = appendBotMessage(parsed.response || "Something went wrong.");
+        if (parsed.polish_id) fetchPolishedMessage(parsed.polish_id, messageEl);
+        updatePreferencesPanel(); // Always fetch sidebar from backend after bot response
+      };
+      // Non-streamed replies keep the typing pause; streamed ones are already on screen
+      if (messageEl || !parsed.response) finish();
+      else setTimeout(finish, calculateTypingDelay(parsed.response));
+    }
+  }
+
+  return fetch(`${backendUrl}${path}`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(payload)
+  }).then(res => {
+    if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    const pump = () => reader.read().then(({ done, value }) => {
+      if (done) return;
+      buffer += decoder.decode(value, { stream: true });
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        handleEvent(buffer.slice(0, boundary));
+        buffer = buffer.slice(boundary + 2);
+      }
+      return pump();
+    });
+    return pump();
+  });
+}
+
 // Initial greeting on page load
 window.onload = () => {
   document.getElementById("chat-box").innerHTML = ""; // Ensure chat is empty
-  fetch(`${backendUrl}/recommend`, {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ session_id: sessionId, artist_or_song: "hi" })
-  })
-    .then(res => res.json())
-    .then(data => {
-      appendBotMessage(data.response);
-      updatePreferencesPanel(); // Always get up-to-date preferences at start
-    })
+  streamBotReply("/recommend/stream", { session_id: sessionId, artist_or_song: "hi" })
     .catch(error => {
       console.error("API error:", error);
       appendBotMessage("⚠️ Sorry, something went wrong while contacting Moodify.");
@@ -72,16 +110,38 @@ document.getElementById("user-input").addEventListener("keypress", function (eve
 
 function appendUserMessage(msg) {
   const chatBox = document.getElementById("chat-box");
-  chatBox.innerHTML += `<p><strong>You:</strong> ${msg}</p>`;
+  // Append a node rather than rewriting innerHTML so earlier bubbles keep their identity
+  const messageEl = document.createElement("p");
+  messageEl.innerHTML = `<strong>You:</strong> ${msg}`;
+  chatBox.appendChild(messageEl);
   chatBox.scrollTop = chatBox.scrollHeight;
 }
 
 function appendBotMessage(msg) {
   const chatBox = document.getElementById("chat-box");
-  chatBox.innerHTML += `<p class="green-response"><strong>Moodify:</strong> ${msg}</p>`;
+  const messageEl = document.createElement("p");
+  messageEl.className = "green-response";
+  chatBox.appendChild(messageEl);
+  setBotMessage(messageEl, msg);
+  return messageEl;
+}
+
+function setBotMessage(messageEl, msg) {
+  messageEl.innerHTML = `<strong>Moodify:</strong> ${msg}`;
+  const chatBox = document.getElementById("chat-box");
   chatBox.scrollTop = chatBox.scrollHeight;
 }
 
+// Template-first replies arrive with a polish_id; swap in the LLM text once it is ready
+function fetchPolishedMessage(polishId, messageEl) {
+  fetch(`${backendUrl}/polish/${polishId}`)
+    .then(res => res.json())
+    .then(data => {
+      if (data.response) setBotMessage(messageEl, data.response);
+    })
+    .catch(error => console.error("Polish error:", error));
+}
+
 function showTypingIndicator() {
   const chatBox = document.getElementById("chat-box");
   const typing = document.createElement("p");